@@ -26,8 +26,9 @@ __license__ = "GNU LGPL v3"
 # Import public API
 from muflon.common.parameters import mpset, MuflonParameterSet
 from muflon.common.boilerplate import prepare_output_directory
-from muflon.io.writers import XDMFWriter, HDF5Writer
+from muflon.io.writers import XDMFWriter, AsyncXDMFWriter, HDF5Writer
 from muflon.log.loggers import MuflonLogger
+from muflon.log.profilers import MuflonProfiler
 from muflon.functions.discretization import DiscretizationFactory
 from muflon.functions.primitives import as_primitive, PrimitiveShell
 from muflon.functions.iconds import SimpleCppIC
@@ -49,18 +49,66 @@ Typical usage:
   Is it safe to allow for two-stage initialization of discretization schemes?
 """
 
+import numpy as np
+
 from ufl.tensors import ListTensor
-from dolfin import as_vector, split, FacetNormal
+from dolfin import as_vector, split, grad, sqrt, FacetNormal
 from dolfin import Parameters, VectorElement, MixedElement, FunctionSpace
 from dolfin import Function, TrialFunction, TestFunction, Expression, Constant
+from dolfin import FunctionAssigner
 from dolfin import assemble, assemble_system, dx, inner, LUSolver
-from dolfin import Vector, VectorSpaceBasis
+from dolfin import Vector, VectorSpaceBasis, HDF5File, as_backend_type, MPI
+from dolfin import PETScDMCollection, LagrangeInterpolator
+from dolfin import Form, MeshFunction, CellDiameter, CellVolume, refine
 
 from muflon.common.boilerplate import not_implemented_msg
 from muflon.common.parameters import mpset
 from muflon.functions.primitives import PrimitiveShell
 from muflon.functions.iconds import SimpleCppIC
 
+def _copy_vector(x, y):
+    """
+    Copy values of vector ``x`` into vector ``y`` without allocating new
+    memory.
+    """
+    as_backend_type(x).vec().copy(as_backend_type(y).vec())
+    y.apply("insert") # update ghost values
+
+def _imbalance(comm, load):
+    """
+    Returns the ratio of the maximal and the average ``load`` over all
+    processes.
+    """
+    load = float(load)
+    average = MPI.sum(comm, load)/MPI.size(comm)
+    return MPI.max(comm, load)/average if average > 0.0 else 1.0
+
+def _mark_interface(mesh, phi, tol):
+    """
+    Mark cells of ``mesh`` on which the variation of order parameters,
+    estimated as :math:`h_K |\\nabla \\vec \\phi|`, exceeds ``tol``.
+    Order parameters ``phi`` are given as a list of functions that are
+    interpolated onto ``mesh`` if they live on a different mesh.
+    """
+    if phi[0].function_space().mesh().id() != mesh.id():
+        phi_new = []
+        for f in phi:
+            g = Function(FunctionSpace(mesh, f.ufl_element()))
+            LagrangeInterpolator.interpolate(g, f)
+            phi_new.append(g)
+        phi = phi_new
+    DG0 = FunctionSpace(mesh, "DG", 0)
+    grad_phi = sum(inner(grad(f), grad(f)) for f in phi)
+    eta_form = Form(CellDiameter(mesh)*sqrt(grad_phi)/CellVolume(mesh)
+                    *TestFunction(DG0)*dx)
+    eta = assemble(eta_form).get_local()
+    dofmap = DG0.dofmap()
+    dofs = np.array([dofmap.cell_dofs(c)[0] for c in range(mesh.num_cells())],
+                    dtype=int)
+    markers = MeshFunction("bool", mesh, mesh.topology().dim(), False)
+    markers.array()[:] = eta[dofs] > tol
+    return markers
+
 
 # --- Generic interface for discretization schemes (factory pattern) ----------
 
@@ -251,10 +299,14 @@ class Discretization(object):
         for var in self._varnames:
             self._FE[var] = eval("FE_"+var)
         self._subspace = {}
+        self._collapsed = {}
+        self._assigners = {}
         self._ndofs = {}
         self._test_fcns = {}
         self._trial_fcns = {}
         self._constrained_domain = constrained_domain
+        self._coarse_meshes = []
+        self._transfer_matrices = {}
 
     def name(self):
         # FIXME: Isn't it too hacky?
@@ -309,7 +361,8 @@ class Discretization(object):
         attribute ``_subspace``, which is has been initialized as an empty
         dictionary, with subspaces for individual primitive variables.
         These subspaces then can be requested throughout the method
-        :py:meth:`subspace`.
+        :py:meth:`subspace`. Finally, the method :py:meth:`_prepare_views`
+        must be called to split solution functions into primitive variables.
 
         Examples:
 
@@ -340,6 +393,136 @@ class Discretization(object):
         """
         return self._mesh
 
+    def set_coarse_meshes(self, meshes):
+        """
+        Store hierarchy of meshes which can be used by geometric multigrid
+        methods. The computational mesh is the finest level of the hierarchy.
+
+        :param meshes: coarse meshes ordered from the coarsest one, each mesh
+                       being a refinement of the previous one
+        :type meshes: list
+        """
+        self._coarse_meshes = list(meshes)
+        self._transfer_matrices = {}
+
+    def mesh_hierarchy(self):
+        """
+        :returns: meshes ordered from the coarsest one to the computational
+                  mesh (only the computational mesh if no coarse meshes have
+                  been set)
+        :rtype: tuple
+        """
+        return tuple(self._coarse_meshes) + (self._mesh,)
+
+    def transfer_matrices(self, var):
+        """
+        Returns interpolation matrices between consecutive levels of the mesh
+        hierarchy for function spaces built from the finite element of
+        (a component of) variable ``var``. Matrices are created only once.
+
+        :param var: variable name
+        :type var: str
+        :returns: :py:class:`dolfin.PETScMatrix` objects ordered from the
+                  coarsest level
+        :rtype: list
+        """
+        if var not in self._transfer_matrices:
+            spaces = [FunctionSpace(mesh, self._FE[var],
+                                    constrained_domain=self._constrained_domain)
+                      for mesh in self.mesh_hierarchy()]
+            self._transfer_matrices[var] = [
+                PETScDMCollection.create_transfer_matrix(Vc, Vf)
+                for (Vc, Vf) in zip(spaces[:-1], spaces[1:])]
+        return self._transfer_matrices[var]
+
+    def load_imbalance(self):
+        """
+        Measure the distribution of work among processes. The load is given
+        by the number of owned DOFs of solution functions and by the number
+        of local cells (which determines the cost of assembly).
+
+        :returns: dictionary with ratios of the maximal and the average load
+                  (``dofs`` and ``cells``), the value 1.0 indicates perfect
+                  balance
+        :rtype: dict
+        """
+        assert hasattr(self, "_solution_ctl")
+        comm = self._mesh.mpi_comm()
+        dofs = sum(w.vector().local_size() for w in self._solution_ctl)
+        return {"dofs": _imbalance(comm, dofs),
+                "cells": _imbalance(comm, self._mesh.num_cells())}
+
+    def adapt_to_interface(self, base_mesh, levels, tol, max_imbalance=0.0):
+        """
+        Create the same discretization scheme (with the same parameters) on
+        a mesh that is locally refined in the vicinity of the interface.
+
+        The new mesh is obtained from ``base_mesh`` by ``levels`` steps of
+        refinement, each of them splitting the cells on which the variation
+        of order parameters at the current time level, estimated as
+        :math:`h_K |\\nabla \\vec \\phi|`, exceeds ``tol``. As the refinement
+        always starts from ``base_mesh``, cells that the interface has left
+        are coarsened back. Intermediate meshes are stored as the mesh
+        hierarchy of the new scheme, see :py:meth:`set_coarse_meshes`.
+
+        Refined cells stay on the processes owning their parents. If this
+        makes the ratio of the maximal and the average number of local cells
+        greater than ``max_imbalance`` (and the value is positive), then the
+        final mesh is repartitioned.
+
+        Solution functions at the current as well as at all previous time
+        levels are interpolated onto the new mesh. Forms, boundary conditions
+        and solvers built on the original scheme must be recreated.
+
+        :param base_mesh: the coarsest admissible mesh
+        :type base_mesh: :py:class:`dolfin.Mesh`
+        :param levels: number of refinement steps
+        :type levels: int
+        :param tol: threshold for the variation of order parameters in a cell
+        :type tol: float
+        :param max_imbalance: admissible imbalance of the partition
+                              (0 = no repartitioning)
+        :type max_imbalance: float
+        :returns: new discretization scheme that has already been setup
+        :rtype: (subclass of) :py:class:`Discretization`
+        """
+        assert hasattr(self, "_solution_ctl")
+        phi = self.primitive_vars_ctl(deepcopy=True)["phi"].split(deepcopy=True)
+        comm = base_mesh.mpi_comm()
+        meshes = [base_mesh]
+        for k in range(levels):
+            markers = _mark_interface(meshes[-1], phi, tol)
+            mesh = refine(meshes[-1], markers, False)
+            if (k == levels - 1 and max_imbalance > 0.0
+                  and _imbalance(comm, mesh.num_cells()) > max_imbalance):
+                mesh = refine(meshes[-1], markers, True) # repartition
+            meshes.append(mesh)
+
+        FE = [self._FE[var] for var in self._varnames]
+        DS = self.__class__(meshes[-1], *FE,
+                            constrained_domain=self._constrained_domain)
+        DS.parameters.update(self.parameters)
+        DS.setup()
+        DS.set_coarse_meshes(meshes[:-1])
+
+        # Transfer solution functions to the new mesh
+        # NOTE: Interpolation does not rely on the partition of the meshes
+        for (w_new, w) in zip(DS.solution_ctl(), self._solution_ctl):
+            LagrangeInterpolator.interpolate(w_new, w)
+        for (sol_new, sol) in zip(DS.solution_ptl(), self._solution_ptl):
+            for (w_new, w) in zip(sol_new, sol):
+                LagrangeInterpolator.interpolate(w_new, w)
+        DS._ptl_updates = self.number_of_ptl_updates()
+
+        return DS
+
+    def constrained_domain(self):
+        """
+        :returns: constrained subdomain with map function (or ``None``)
+        :rtype: :py:class:`dolfin.SubDomain`
+        """
+        return self._constrained_domain
+
     def compute_domain_size(self):
         """
         Computes size (length/area/volume depending on the dimension) of the
@@ -405,9 +588,9 @@ class Discretization(object):
         :type var: str
         :param i: component number (``None`` for scalar variables)
         :type i: int
-        :param deepcopy: if True then the returned subspace is a newly created
-                         function space, otherwise it is extracted from a
-                         correponding mixed space
+        :param deepcopy: if True then the returned subspace is a standalone
+                         function space (created only once), otherwise it is
+                         extracted from a correponding mixed space
         :type deepcopy: bool
         :returns: subspace on which requested variable lives
         :rtype: :py:class:`dolfin.FunctionSpace`
@@ -418,17 +601,136 @@ class Discretization(object):
                 msg = "For vector quantities only subspaces for individual" \
                       " components can be extracted"
                 raise ValueError(msg)
-            if deepcopy:
-                FE = self._subspace[var].ufl_element()
-                return FunctionSpace(self._mesh, FE)
-            else:
-                return self._subspace[var]
+            V = self._subspace[var]
         else:
-            if deepcopy:
-                FE = self._subspace[var][i].ufl_element()
-                return FunctionSpace(self._mesh, FE)
+            V = self._subspace[var][i]
+        if deepcopy:
+            # NOTE: Spaces are cached as function assigners require identical
+            #       (not only equivalent) spaces
+            if (var, i) not in self._collapsed:
+                FE = V.ufl_element()
+                self._collapsed[var, i] = FunctionSpace(self._mesh, FE)
+            V = self._collapsed[var, i]
+        return V
+
+    def _prepare_views(self):
+        """
+        Split solution functions at current and previous time levels into
+        primitive variables (both in the context of
+        :py:meth:`dolfin.Function.split` method and free function
+        :py:func:`dolfin.split`). The views share vectors with solution
+        functions, hence they are created only once and then returned by
+        :py:meth:`primitive_vars_ctl` and :py:meth:`primitive_vars_ptl`.
+        """
+        self._views = {}
+        self._view_keys = {}
+        levels = [None,] + list(range(len(self._solution_ptl)))
+        for level in levels:
+            self._prepare_level_views(level)
+
+    def _prepare_level_views(self, level):
+        """
+        Split solution functions at the time level ``level`` (``None`` stands
+        for the current time level) into primitive variables.
+        """
+        if level is None:
+            sol, suffix = self._solution_ctl, ""
+        else:
+            sol, suffix = self._solution_ptl[level], "0" + str(level)
+        pv = self._fit_primitives(sol, False, False)
+        self._views[level, False] = dict(
+            (self._varnames[i], PrimitiveShell(f, self._varnames[i]+suffix))
+            for i, f in enumerate(pv))
+        pv = self._fit_primitives(sol, False, True)
+        self._views[level, True] = dict(
+            (self._varnames[i], f) for i, f in enumerate(pv))
+        self._view_keys[level] = self._vector_ids(sol)
+
+    @staticmethod
+    def _vector_ids(sol):
+        return tuple(w.vector().id() for w in sol)
+
+    def _level_views(self, level, indexed):
+        """
+        Returns cached views at the time level ``level``. The views are
+        created again if some of the solution functions got a new vector
+        (e.g. by :py:meth:`dolfin.Function.assign`), since the old views
+        would keep pointing to the original one.
+        """
+        if level is None:
+            sol = self._solution_ctl
+        else:
+            sol = self._solution_ptl[level]
+        if self._view_keys[level] != self._vector_ids(sol):
+            self._prepare_level_views(level)
+        return self._views[level, indexed]
+
+    def _component(self, var, i, level):
+        """
+        Returns view of the component ``var[i]`` at the time level ``level``
+        (``None`` stands for the current time level).
+        """
+        pv = self._level_views(level, False)[var]
+        return pv.dolfin_repr() if i is None else pv.split()[i]
+
+    def _assigner(self, var, i, gather):
+        """
+        Returns cached function assigner between the subspace of ``var[i]``
+        and the corresponding standalone space.
+        """
+        key = (var, i, gather)
+        if key not in self._assigners:
+            V_sub = self.subspace(var, i)
+            V = self.subspace(var, i, deepcopy=True)
+            if gather:
+                self._assigners[key] = FunctionAssigner(V_sub, V)
             else:
-                return self._subspace[var][i]
+                self._assigners[key] = FunctionAssigner(V, V_sub)
+        return self._assigners[key]
+
+    def gather_component(self, f, var, i=None, level=None):
+        """
+        Assign values of function ``f`` to the component ``var[i]`` of
+        solution functions at the time level ``level``, where ``i`` must be
+        ``None`` for scalar variables.
+
+        Function ``f`` must live on ``subspace(var, i, deepcopy=True)``.
+        Function assigners are created only once, so this method is suitable
+        for repeated updates of primitive variables (e.g. in hooks).
+
+        :param f: function with new values of the component
+        :type f: :py:class:`dolfin.Function`
+        :param var: variable name
+        :type var: str
+        :param i: component number (``None`` for scalar variables)
+        :type i: int
+        :param level: previous time level (``None`` for the current one)
+        :type level: int
+        """
+        self._assigner(var, i, True).assign(self._component(var, i, level), f)
+
+    def split_component(self, var, i=None, level=None, f=None):
+        """
+        Copy values of the component ``var[i]`` of solution functions at the
+        time level ``level`` to the standalone function ``f`` (a new function
+        is created if ``f`` is ``None``). This is the inverse operation
+        to :py:meth:`gather_component`.
+
+        :param var: variable name
+        :type var: str
+        :param i: component number (``None`` for scalar variables)
+        :type i: int
+        :param level: previous time level (``None`` for the current one)
+        :type level: int
+        :param f: function living on ``subspace(var, i, deepcopy=True)``
+        :type f: :py:class:`dolfin.Function`
+        :returns: function with values of the component
+        :rtype: :py:class:`dolfin.Function`
+        """
+        if f is None:
+            f = Function(self.subspace(var, i, deepcopy=True))
+        self._assigner(var, i, False).assign(f, self._component(var, i, level))
+        return f
 
     def num_dofs(self, key="total"):
         """
@@ -485,7 +787,8 @@ class Discretization(object):
         Provides access to primitive variables ``phi, chi, v, p, th``
         (or allowable subset) at the current time level.
 
-        (Note that it makes no sense to require indexed deep copy.)
+        (Note that it makes no sense to require indexed deep copy.
+        Shallow copies are created only once, see :py:meth:`_prepare_views`.)
 
         :param deepcopy: if False the shallow copy of primitive
                          variables is returned
@@ -501,6 +804,8 @@ class Discretization(object):
         """
         assert hasattr(self, "_fit_primitives")
         assert hasattr(self, "_solution_ctl")
+        if not deepcopy:
+            return dict(self._level_views(None, indexed))
         pv = self._fit_primitives(self._solution_ctl, deepcopy, indexed)
         if indexed == False:
             # Wrap objects in 'pv' by PrimitiveShell
@@ -518,7 +823,8 @@ class Discretization(object):
         Provides access to primitive variables ``phi, chi, v, p, th``
         (or allowable subset) at previous time levels.
 
-        (Note that it makes no sense to require indexed deep copy.)
+        (Note that it makes no sense to require indexed deep copy.
+        Shallow copies are created only once, see :py:meth:`_prepare_views`.)
 
         :param level: determines which previous time level will be returned
         :type level: int
@@ -536,6 +842,8 @@ class Discretization(object):
         """
         assert hasattr(self, "_fit_primitives")
         assert hasattr(self, "_solution_ptl")
+        if not deepcopy:
+            return dict(self._level_views(level, indexed))
         pv = self._fit_primitives(self._solution_ptl[level], deepcopy, indexed)
         if indexed == False:
             # Wrap objects in pv by PrimitiveShell
@@ -559,6 +867,57 @@ class Discretization(object):
         assert hasattr(self, "_solution_ptl")
         return len(self._solution_ptl)
 
+    def update_ptl(self):
+        """
+        Shift solution functions to previous time levels, i.e. the solution
+        at the ``(n-k+1)``-th level is moved to the ``(n-k)``-th level and
+        the solution at the current time level becomes the solution at the
+        ``n``-th level.
+
+        Values are copied in place, which means that no new vectors are
+        allocated (as opposed to :py:meth:`dolfin.Function.assign`).
+
+        .. note::
+
+          It is not possible to just rotate references to solution functions,
+          since the functions are bound to UFL forms as coefficients
+          and forms that have been already compiled would not notice the
+          rotation.
+        """
+        assert hasattr(self, "_solution_ptl")
+        sol_ptl = self._solution_ptl
+        for k in reversed(range(1, len(sol_ptl))): # k goes from L-1 to 1
+            for (i, w) in enumerate(sol_ptl[k-1]):
+                _copy_vector(w.vector(), sol_ptl[k][i].vector())
+        for (i, w) in enumerate(self._solution_ctl):
+            _copy_vector(w.vector(), sol_ptl[0][i].vector())
+        self._ptl_updates = self.number_of_ptl_updates() + 1
+
+    def copy_ptl_to_ctl(self, level=0):
+        """
+        Copy solution functions at the ``(n-level)``-th time level to the
+        current time level.
+
+        Values are copied in place, so the cached views returned by
+        :py:meth:`primitive_vars_ctl` remain valid.
+
+        :param level: determines which previous time level will be copied
+        :type level: int
+        """
+        assert hasattr(self, "_solution_ptl")
+        for (i, w) in enumerate(self._solution_ptl[level]):
+            _copy_vector(w.vector(), self._solution_ctl[i].vector())
+
+    def number_of_ptl_updates(self):
+        """
+        Returns number of calls of :py:meth:`update_ptl`. (The value can be
+        used to identify the current time level.)
+
+        :returns: number of updates of solution at previous time levels
+        :rtype: int
+        """
+        return getattr(self, "_ptl_updates", 0)
+
     def test_functions(self):
         """
         Returns dictionary with test functions corresponding to primitive
@@ -628,14 +987,45 @@ class Discretization(object):
         """
         not_implemented_msg(self)
 
-    def load_ic_from_file(self, filenames):
+    def load_ic_from_file(self, filenames, filenames_ctl=None):
         """
-        .. todo:: add possibility to load IC from HDF5 files
-
-        :param filenames: list of HDF5 files
+        Update solution functions on previous time levels with values stored
+        in HDF5 files (e.g. in those created by
+        :py:class:`HDF5Writer <muflon.io.writers.HDF5Writer>`).
+
+        Item ``filenames[k]`` is a list of files corresponding to solution
+        functions at the ``(n-k)``-th time level. Each file must contain
+        a dataset named in the same way as the solution function which is
+        going to be updated. Solution functions at the current time level are
+        loaded from ``filenames_ctl`` if given, otherwise they are updated
+        using the values from the closest previous time level.
+
+        :param filenames: list of lists of HDF5 files
         :type filenames: list
+        :param filenames_ctl: list of HDF5 files for the current time level
+        :type filenames_ctl: list
         """
-        not_implemented_msg(self)
+        assert hasattr(self, "_solution_ptl")
+        if not filenames or len(filenames) > len(self._solution_ptl):
+            msg = "Number of time levels in 'filenames' must be between" \
+                  " 1 and %g" % len(self._solution_ptl)
+            raise ValueError(msg)
+        comm = self._mesh.mpi_comm()
+        def _read(functions, files):
+            if len(files) != len(functions):
+                msg = "Expected %g files, got %g" \
+                      % (len(functions), len(files))
+                raise ValueError(msg)
+            for (w, fname) in zip(functions, files):
+                hdf5_file = HDF5File(comm, fname, "r")
+                hdf5_file.read(w, w.name())
+                hdf5_file.close()
+        for (k, files) in enumerate(filenames):
+            _read(self._solution_ptl[k], files)
+        if filenames_ctl is None:
+            self.copy_ptl_to_ctl()
+        else:
+            _read(self._solution_ctl, filenames_ctl)
 
     def _get_constant_pressure(self, W):
         w = TrialFunction(W)
@@ -713,6 +1103,7 @@ class Monolithic(Discretization):
         # Set required attributes
         self._solution_ctl, self._solution_ptl = self._prepare_solution_fcns()
         self._fit_primitives = fit_primitives
+        self._prepare_views()
 
     def _prepare_solution_fcns(self):
         # Extract parameters needed to create finite elements
@@ -797,7 +1188,7 @@ class Monolithic(Discretization):
 
         # Copy interpolated initial condition also to CTL,
         # so it can be used as an initial guess for nonlinear solvers
-        self.solution_ctl()[0].assign(w0)  # t^(n+1) <-- t^(n-0)
+        self.copy_ptl_to_ctl()  # t^(n+1) <-- t^(n-0)
 
     load_ic_from_simple_cpp.__doc__ = \
       Discretization._inherit_docstring("load_ic_from_simple_cpp")
@@ -858,6 +1249,7 @@ class SemiDecoupled(Discretization):
         # Set required attributes
         self._solution_ctl, self._solution_ptl = self._prepare_solution_fcns()
         self._fit_primitives = fit_primitives
+        self._prepare_views()
 
     def _prepare_solution_fcns(self):
         # Extract parameters needed to create finite elements
@@ -954,8 +1346,7 @@ class SemiDecoupled(Discretization):
 
         # Copy interpolated initial condition also to CTL,
         # so it can be used as an initial guess for nonlinear solvers
-        self.solution_ctl()[0].assign(w0_ch)
-        self.solution_ctl()[1].assign(w0_ns)
+        self.copy_ptl_to_ctl()
 
     load_ic_from_simple_cpp.__doc__ = \
       Discretization._inherit_docstring("load_ic_from_simple_cpp")
@@ -1020,6 +1411,7 @@ class FullyDecoupled(Discretization):
         # Set required attributes
         self._solution_ctl, self._solution_ptl = self._prepare_solution_fcns()
         self._fit_primitives = fit_primitives
+        self._prepare_views()
 
     def _prepare_solution_fcns(self):
         # Extract parameters needed to create finite elements
@@ -1099,8 +1491,7 @@ class FullyDecoupled(Discretization):
 
         # Copy interpolated initial condition also to CTL,
         # although it is not necessary in this case
-        for i, f in enumerate(w0):
-            self.solution_ctl()[i].assign(f)
+        self.copy_ptl_to_ctl()
 
     load_ic_from_simple_cpp.__doc__ = \
       Discretization._inherit_docstring("load_ic_from_simple_cpp")
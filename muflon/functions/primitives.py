@@ -97,6 +97,15 @@ class PrimitiveShell(object):
         :rtype: tuple
         :raises RuntimeError: if we are dealing with a scalar primitive quantity
         """
+        if not deepcopy and hasattr(self, "_components"):
+            return self._components
+        components = self._split(deepcopy)
+        if not deepcopy:
+            # NOTE: Shallow components are views that can be reused
+            self._components = components
+        return components
+
+    def _split(self, deepcopy):
         if isinstance(self._variable, Function):
             num_sub_spaces = self._variable.function_space().num_sub_spaces()
             if num_sub_spaces == 0:
@@ -22,8 +22,11 @@ This module provides different utilities to process input/output data.
 """
 
 import os
+import six
+import threading
+import numpy as np
 
-from dolfin import XDMFFile, MPI
+from dolfin import XDMFFile, HDF5File, FunctionAssigner, MPI
 
 from muflon.common.boilerplate import prepare_output_directory
 
@@ -61,6 +64,7 @@ class XDMFWriter(object):
         self._flush  = flush_output
         self._fields = []
         self._xdmfs  = []
+        self._remeshed = 0 # number of replacements of fields
         for field in fields:
             self._register_field(field)
 
@@ -74,6 +78,8 @@ class XDMFWriter(object):
         """
         self._fields.append(field)
         field_name = field[1] or field[0].name()
+        if self._remeshed:
+            field_name += "_mesh%d" % self._remeshed
         f = XDMFFile(self._comm, self._prefix + field_name + '.xdmf')
         f.parameters['rewrite_function_mesh'] = False
         f.parameters['flush_output'] = self._flush
@@ -87,7 +93,189 @@ class XDMFWriter(object):
         :type t: float
         """
         for (i, field) in enumerate(self._fields):
-            self._xdmfs[i].write(field[0], t)
+            self._write_field(i, field[0], t)
+
+    def _write_field(self, i, f, t):
+        """
+        Write function ``f`` at time ``t`` into the i-th XDMF file.
+        """
+        self._xdmfs[i].write(f, t)
+
+    def replace_fields(self, fields):
+        """
+        Replace registered fields by ``fields`` living on a new mesh. Output
+        continues in new files with names extended by ``_mesh<k>``, where
+        ``k`` counts the replacements, so that the new mesh is written only
+        once. The new fields must be given in the same order as the original
+        ones.
+
+        :param fields: list of ``(<field>, <name>)`` pairs
+        :type fields: list
+        """
+        assert len(fields) == len(self._fields)
+        self._remeshed += 1
+        self._fields = []
+        self._xdmfs  = []
+        for field in fields:
+            self._register_field(field)
+
+    def flush(self):
+        """
+        Wait until all pending output is written. (Output of this class is
+        synchronous, hence there is nothing to do.)
+        """
+        pass
+
+    def close(self):
+        """
+        Write pending output. (Files are closed when the writer is deleted.)
+        """
+        self.flush()
+
+
+class AsyncXDMFWriter(XDMFWriter):
+    """
+    Asynchronous variant of :py:class:`XDMFWriter`. Local values of
+    registered fields are copied into a queue and a background thread dumps
+    them into raw binary files (one per process, field and time), so that
+    the computation can continue while the data is being written. The dumps
+    are non-collective and the thread does not hold the GIL while writing.
+
+    Collective output into XDMF files lags behind by at most ``queue_size``
+    snapshots. Once more snapshots are pending, the oldest ones are loaded
+    back from their dumps (which have been written in the meantime), written
+    into XDMF files and the dumps are removed. Hence :py:meth:`write` must
+    be called on all processes. Remaining snapshots are written by
+    :py:meth:`flush`. The resulting files are identical to those produced
+    by :py:class:`XDMFWriter`.
+    """
+
+    def __init__(self, comm, outdir, fields=[], flush_output=False,
+                 queue_size=2):
+        """
+        See :py:class:`XDMFWriter` for the description of arguments.
+
+        :param queue_size: maximal number of snapshots waiting for the output
+        :type queue_size: int
+        """
+        super(AsyncXDMFWriter, self).__init__(comm, outdir, fields,
+                                              flush_output)
+        assert queue_size > 0
+        self._dumpdir = prepare_output_directory(self._prefix + "_async")
+        self._rank = MPI.rank(comm)
+        self._queue_size = queue_size
+        self._pending = [] # (counter, time, event) of snapshots in the queue
+        self._counter = 0
+        self._allocate_buffers()
+
+        # Start the background thread
+        self._work = six.moves.queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._dump_pending)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, t):
+        """
+        Copy local values of all the fields at time t and schedule them
+        for the dump. The oldest snapshots are written into XDMF files if
+        there are more than ``queue_size`` of them. (This is a collective
+        operation.)
+
+        :param t: time
+        :type t: float
+        """
+        snapshot = []
+        for (i, field) in enumerate(self._fields):
+            self._assigners[i].assign(self._buffers[i], field[0])
+            snapshot.append(self._buffers[i].vector().get_local())
+        dumped = threading.Event()
+        self._work.put((self._counter, snapshot, dumped))
+        self._pending.append((self._counter, t, dumped))
+        self._counter += 1
+        while len(self._pending) > self._queue_size:
+            self._write_oldest()
+
+    def replace_fields(self, fields):
+        """
+        See :py:meth:`XDMFWriter.replace_fields`. Pending output is written
+        before the buffers are reallocated for the new fields.
+        """
+        self.flush()
+        super(AsyncXDMFWriter, self).replace_fields(fields)
+        self._allocate_buffers()
+
+    def _allocate_buffers(self):
+        """
+        Allocate buffers for registered fields together with assigners that
+        fill them.
+        """
+        self._buffers, self._assigners = [], []
+        for field in self._fields:
+            f = field[0].copy(deepcopy=True)
+            f.rename(field[0].name(), field[0].label())
+            self._buffers.append(f)
+            self._assigners.append(FunctionAssigner(f.function_space(),
+                                                    field[0].function_space()))
+
+    def _dumpfile(self, counter, i):
+        return self._dumpdir + "%d_%d_%d.bin" % (counter, i, self._rank)
+
+    def _write_oldest(self):
+        """
+        Wait until the oldest pending snapshot is dumped, write it into XDMF
+        files and remove the dumps. (This is a collective operation.)
+        """
+        counter, t, dumped = self._pending.pop(0)
+        dumped.wait()
+        if MPI.max(self._comm, float(self._error is not None)) > 0.0:
+            self._pending = [] # all processes must skip collective output
+            self._error = self._error or "dump failed on another process"
+            self._check_error()
+        for (i, f) in enumerate(self._buffers):
+            fname = self._dumpfile(counter, i)
+            f.vector().set_local(np.fromfile(fname))
+            f.vector().apply("insert")
+            self._write_field(i, f, t)
+            os.remove(fname)
+
+    def flush(self):
+        """
+        Write all pending snapshots into XDMF files. (This is a collective
+        operation.)
+        """
+        while self._pending:
+            self._write_oldest()
+
+    def close(self):
+        """
+        Write pending output and stop the background thread.
+        """
+        if self._thread.is_alive():
+            self.flush()
+            self._work.put(None)
+            self._thread.join()
+
+    def _dump_pending(self):
+        """
+        Target of the background thread dumping the snapshots from the queue.
+        """
+        while True:
+            item = self._work.get()
+            if item is None:
+                break
+            counter, snapshot, dumped = item
+            try:
+                for (i, values) in enumerate(snapshot):
+                    values.tofile(self._dumpfile(counter, i))
+            except Exception as err:
+                self._error = err
+            dumped.set()
+
+    def _check_error(self):
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise RuntimeError("Asynchronous output failed (%s)" % err)
 
 
 class HDF5Writer(object):
@@ -113,36 +301,77 @@ class HDF5Writer(object):
         self._comm = comm
         self._old_files = []
 
-    def write(self, t):
+    def replace_fields(self, fields):
+        """
+        Replace registered fields, e.g. by functions living on a new mesh.
+        Files saved for the original fields are removed by the next call of
+        :py:meth:`write` as usual.
+
+        :param fields: list of functions to be saved in separate files
+        :type fields: list
+        """
+        self._fields = fields
+
+    def prefix(self):
+        """
+        :returns: common prefix of the names of HDF5 files
+        :rtype: str
+        """
+        return self._prefix
+
+    @staticmethod
+    def suffix(t):
+        """
+        Time ``t`` is formatted with fixed precision, so that the names of
+        files do not depend on round-off errors accumulated in ``t``.
+
+        :returns: common suffix of the names of HDF5 files saved at time ``t``
+        :rtype: str
+        """
+        return "_%.12g.h5" % t
+
+    def write(self, t, metadata=None, functions=[]):
         """
         Save solution into HDF5 files with names returned by
         field's ``name`` attribute and current time ``t``.
 
+        Time ``t`` and optional ``metadata`` are stored as attributes of
+        the datasets.
+
         :param t: time
         :type t: float
+        :param metadata: additional values to be stored with the fields
+                         (e.g. iteration number or time step)
+        :type metadata: dict
+        :param functions: additional functions saved together with the
+                          registered fields at this time
+        :type functions: list
         """
-        # Delete previous backup
-        if self._old_files:
-            self._remove_old()
         # Create new backup
-        suffix = '_' + str(t) + '.h5'
-        for field in self._fields:
+        suffix = self.suffix(t)
+        new_files = []
+        for field in list(self._fields) + list(functions):
             # Save field into HDF5 f
             file_name = self._prefix + field.name() + suffix
             hdf5_file = HDF5File(self._comm, file_name, 'w')
             hdf5_file.write(field, field.name())
-            del hdf5_file
-            # Update the list of old files
-            self._old_files.append(file_name)
+            attr = hdf5_file.attributes(field.name())
+            attr["t"] = float(t)
+            for key, val in (metadata or {}).items():
+                attr[key] = val
+            hdf5_file.close()
+            new_files.append(file_name)
+        # Delete previous backup (only when the new one is complete)
+        self._remove_old(new_files)
+        # Update the list of old files
+        self._old_files = new_files
 
-    def _remove_old(self):
+    def _remove_old(self, new_files):
         """
-        Removes old HDF5 files just before new files are saved.
+        Removes old HDF5 files just after new files have been saved.
         """
-        rank = MPI.rank(self._comm)
-        if rank == 0:
+        MPI.barrier(self._comm)
+        if MPI.rank(self._comm) == 0:
             for f in self._old_files:
-                os.remove(f)
-            self._old_files = []
-        else:
-            return
+                if f not in new_files and os.path.isfile(f):
+                    os.remove(f)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2017 Martin Řehoř
+#
+# This file is part of MUFLON.
+#
+# MUFLON is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MUFLON is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MUFLON.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module provides utilities for profiling individual phases of
+time-stepping algorithms.
+
+Typical usage:
+
+.. code-block:: python
+
+  from muflon.log.profilers import MuflonProfiler, phase
+
+  profiler = MuflonProfiler(comm, "profile.dat")
+  profiler.begin_step()
+  with phase(profiler, "assembly"):
+      pass # assemble something
+  with phase(profiler, "solve"):
+      pass # solve something
+  profiler.end_step(t, it)
+  profiler.dump_to_file()
+
+The time spent in nested phases is subtracted from the enclosing phase, so
+the recorded values are exclusive. Function :py:func:`phase` returns a dummy
+context manager if ``profiler`` is ``None``, hence the instrumented code
+works also without profiling.
+"""
+
+import os
+
+from collections import OrderedDict
+from timeit import default_timer
+
+from dolfin import MPI
+
+from muflon.common.boilerplate import prepare_output_directory
+
+
+class _Phase(object):
+    """
+    Context manager measuring the time spent in a single phase.
+    """
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._profiler._push(self._name)
+        return self
+
+    def __exit__(self, *args):
+        self._profiler._pop()
+
+
+class _NoPhase(object):
+    """
+    Context manager doing nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+_no_phase = _NoPhase()
+
+
+def phase(profiler, name):
+    """
+    Returns context manager that measures the time spent in phase ``name``
+    using given ``profiler``.
+
+    :param profiler: profiler (or ``None`` if profiling is switched off)
+    :type profiler: :py:class:`MuflonProfiler`
+    :param name: name of the phase
+    :type name: str
+    :returns: context manager
+    """
+    if profiler is None:
+        return _no_phase
+    return profiler.phase(name)
+
+
+class MuflonProfiler(object):
+    """
+    This class collects wall-clock time spent in individual phases of time
+    steps together with iteration counts of solvers.
+
+    At the end of each step the times are reduced over all processes
+    (maximum, minimum and average values are stored). Data are kept in memory
+    and written to ``filename`` (if given) as a table with one row per step.
+    """
+
+    #: Default phases of time steps
+    phases = ("assembly", "bcs", "factorization", "solve", "pressure",
+              "hook", "io", "ptl", "remesh")
+
+    def __init__(self, comm, filename=None, phases=None):
+        """
+        :param comm: MPI communicator
+        :type comm: :py:class:`dolfin.MPI_Comm`
+        :param filename: name of the file for the output
+        :type filename: str
+        :param phases: names of phases (default phases are used if ``None``)
+        :type phases: tuple
+        """
+        self._comm = comm
+        self._rank = MPI.rank(comm)
+        self._filename = filename
+        if self._rank == 0 and filename is not None:
+            prepare_output_directory(os.path.dirname(filename) or ".")
+        # NOTE: All processes must use the same phases as the values are
+        #       reduced using collective operations
+        self._phases = tuple(phases or MuflonProfiler.phases)
+        self._stack = []
+        self._times = OrderedDict((p, 0.0) for p in self._phases)
+        self._step_start = None
+        self.data = []
+
+    def phase(self, name):
+        """
+        Returns context manager that measures the time spent in phase
+        ``name``.
+
+        :param name: name of the phase
+        :type name: str
+        :returns: context manager
+        """
+        if name not in self._times:
+            raise ValueError("Unknown phase '%s'" % name)
+        return _Phase(self, name)
+
+    def _push(self, name):
+        self._stack.append([name, default_timer(), 0.0])
+
+    def _pop(self):
+        name, start, nested = self._stack.pop()
+        elapsed = default_timer() - start
+        self._times[name] += elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def begin_step(self):
+        """
+        Start measuring a new time step. (Nothing happens if the measurement
+        of the current step has not been finished yet, e.g. if the step is
+        being repeated.)
+        """
+        if self._step_start is not None:
+            return
+        for p in self._times:
+            self._times[p] = 0.0
+        self._step_start = default_timer()
+
+    def end_step(self, t, it, iters=None):
+        """
+        Finish measuring the current time step and store collected data.
+
+        :param t: time
+        :type t: float
+        :param it: iteration number
+        :type it: int
+        :param iters: dictionary with iteration counts of solvers in the
+                      format ``{key: [total, last]}``
+        :type iters: dict
+        """
+        assert self._step_start is not None
+        wall = default_timer() - self._step_start
+        values = list(self._times.values())
+        values += [wall - sum(values), wall]
+        names = list(self._times.keys()) + ["other", "step"]
+        size = MPI.size(self._comm)
+        record = OrderedDict()
+        record["t"] = t
+        record["it"] = it
+        for (name, val) in zip(names, values):
+            record[name + "_max"] = MPI.max(self._comm, val)
+            record[name + "_min"] = MPI.min(self._comm, val)
+            record[name + "_avg"] = MPI.sum(self._comm, val)/size
+        for key, val in (iters or {}).items():
+            record["iters_" + key] = val[-1]
+        self.data.append(record)
+        self._step_start = None
+
+    def dump_to_file(self):
+        """
+        Write all collected data to the file.
+        """
+        if self._rank > 0 or self._filename is None or not self.data:
+            return
+        keys = list(self.data[0].keys())
+        for record in self.data[1:]:
+            keys += [k for k in record.keys() if k not in keys]
+        lines = ["    ".join(keys)]
+        for record in self.data:
+            lines.append("    ".join("%g" % record.get(k, float("nan"))
+                                     for k in keys))
+        with open(self._filename, "w") as datafile:
+            datafile.write("\n".join(lines) + "\n")
@@ -33,7 +33,8 @@ from dolfin import as_matrix, as_vector, variable
 from dolfin import conditional, lt, gt, eq, Or, Min, Max, sin, pi
 from dolfin import dot, inner, outer, dx, ds, sym
 from dolfin import derivative, diff, div, grad, curl, sqrt
-from dolfin import CellDiameter, FiniteElement, FunctionSpace, project
+from dolfin import CellDiameter, CellVolume, FiniteElement, FunctionSpace
+from dolfin import Form, TestFunction
 
 from muflon.common.parameters import mpset
 from muflon.models.potentials import DoublewellFactory
@@ -106,6 +107,7 @@ class Model(object):
         nested_prm = Parameters("semi")
         nested_prm.add("gdstab", 0.0)   # grad-div stabilization parameter
         nested_prm.add("sdstab", False) # turn on/off SD stabilization in PCD
+        nested_prm.add("cvx", 1.0)      # convex part of F'' in CH precond.
         prm.add(nested_prm)
 
         # Spec. parameters for FullyDecoupled scheme
@@ -673,6 +675,32 @@ class Incompressible(Model):
         # Store created double-well potential
         self.doublewell = dw
 
+    def _schur_ch_forms(self, Mo, fact_ctl, idt):
+        """
+        Returns two bilinear forms (acting on ``chi``) that define a sparse
+        approximation of the Schur complement of the CH block, see
+        :py:class:`_CHSchurPC <muflon.solving.solvers._CHSchurPC>`. The
+        second derivative of the potential is replaced by the constant
+        ``['semi']['cvx']``. The mobility is cut off at zero under the square
+        root, so that the forms remain well defined for degenerate (or
+        negative) mobility.
+        """
+        cc = self.coeffs
+        test, trial = self._test, self._trial
+        alpha_cvx = 0.5*cc["a"]*cc["eps"]*fact_ctl
+        return (
+            ( # X
+                  sqrt(idt)*inner(trial["chi"], test["chi"])
+                + sqrt(Max(alpha_cvx*Mo, 0.0))*inner(
+                    grad(trial["chi"]), grad(test["chi"]))
+            )*dx,
+            ( # T
+                  alpha_cvx*inner(grad(trial["chi"]), grad(test["chi"]))
+                + (cc["b"]/cc["eps"])*cc["cvx"]*inner(
+                    dot(cc["iLA"], trial["chi"]), test["chi"])
+            )*dx
+        )
+
 # --- Monolithic forms for Incompressible model -------------------------------
 
     def _factors_Monolithic(self, OTD, dt=None):
@@ -703,7 +731,11 @@ class Incompressible(Model):
         :py:class:`Monolithic <muflon.functions.discretization.Monolithic>`
         discretization scheme.
 
-        Forms are returned in a dictionary under ``'nln'`` item.
+        Forms are returned in a dictionary under ``'nln'`` item. Forms
+        needed for PCD preconditioning of the NS part are returned under
+        ``'pcd'`` item. Two bilinear forms (acting on ``chi``) that define
+        a sparse approximation of the Schur complement of the CH block are
+        returned under ``'schur_ch'`` item.
 
         :param matching_p: does not take any effect here because *monolithic
                            pressure* is considered as default for comparison
@@ -716,7 +748,8 @@ class Incompressible(Model):
             ("TD_theta",   1.0),
             ("TD_dF_auto", 1.0),
             ("TD_dF_full", 0.0),
-            ("TD_dF_semi", 0.0)
+            ("TD_dF_semi", 0.0),
+            ("cvx", self.parameters["semi"]["cvx"])
         ))
         cc = self.coeffs # created coefficients
         dw = self.doublewell
@@ -745,6 +778,7 @@ class Incompressible(Model):
 
         # Arguments of the system
         test = self._test
+        trial = self._trial
 
         # Source terms
         f_src = self._f_src
@@ -850,7 +884,22 @@ class Incompressible(Model):
 
         system_ns = eqn_v + Constant(-1.0)*eqn_p # FIXME: + or -
 
-        return dict(nln=system_ch + system_ns, lin=None)
+        # Create PCD operators
+        nu = self.viscosity(nu_mat, phi)
+        wind = rho*v + cc["THETA2"]*total_flux(Mo, rho_mat, chi)
+        pcd_operators = {
+            "mu": idt*rho*inner(trial["v"], test["v"])*dx,      # --> idt*M
+            "ap": inner(grad(trial["p"]), grad(test["p"]))*dx,  # --> Ap_hat
+            "mp": (1.0/nu)*trial["p"]*test["p"]*dx,             # --> Qp
+            "kp": (1.0/nu)*dot(grad(trial["p"]), wind)*test["p"]*dx, # --> Kp
+            "gp": - trial["p"]*div(test["v"])*dx                # --> B^T
+        }
+
+        # Factors of the approximate Schur complement of the CH block
+        schur_ch = self._schur_ch_forms(Mo, fact_ctl, idt)
+
+        return dict(nln=system_ch + system_ns, lin=None, pcd=pcd_operators,
+                    schur_ch=schur_ch)
 
 # --- SemiDecoupled forms for Incompressible model ----------------------------
 
@@ -893,6 +942,15 @@ class Incompressible(Model):
         corresponding to right hand sides can be found under
         ``['lin']['rhs']``.
 
+        Bilinear form that can be used to build a block preconditioner for
+        the CH part is returned under ``'pc_ch'`` item. It is obtained from
+        the Jacobian by dropping the convective term and by replacing the
+        second derivative of the potential with a constant (convex) value
+        given by the parameter ``['semi']['cvx']``. Two bilinear forms
+        (acting on ``chi``) that define a sparse approximation of the Schur
+        complement of this preconditioner are returned under ``'schur_ch'``
+        item.
+
         :param matching_p: if True then pressure matches *monolithic pressure*
         :type matching_p: bool
         :returns: dictonary with items ``'nln'`` and ``'lin'``
@@ -904,7 +962,8 @@ class Incompressible(Model):
             ("TD_dF_auto", 0.0),
             ("TD_dF_full", 0.0),
             ("TD_dF_semi", 1.0),
-            ("gdstab", prm["semi"]["gdstab"])
+            ("gdstab", prm["semi"]["gdstab"]),
+            ("cvx", prm["semi"]["cvx"])
         ))
         cc = self.coeffs # created coefficients
         dw = self.doublewell
@@ -984,6 +1043,20 @@ class Incompressible(Model):
 
         system_ch = eqn_phi + eqn_chi
 
+        # Preconditioner for CH part (convexified Jacobian without convection)
+        pc_ch = (
+              idt*inner(trial["phi"], test["chi"])
+            + Mo*inner(grad(trial["chi"]), grad(test["chi"]))
+            + inner(trial["chi"], test["phi"])
+            - 0.5*cc["a"]*cc["eps"]*fact_ctl*inner(
+                grad(trial["phi"]), grad(test["phi"]))
+            - (cc["b"]/cc["eps"])*cc["cvx"]*inner(
+                dot(cc["iLA"], trial["phi"]), test["phi"])
+        )*dx
+
+        # Factors of the approximate Schur complement of 'pc_ch'
+        schur_ch = self._schur_ch_forms(Mo, fact_ctl, idt)
+
         # System of NS eqns
         cc["J"] = J = total_flux(Mo, rho_mat, chi)
         Dv  = sym(grad(trial["v"]))
@@ -1043,7 +1116,8 @@ class Incompressible(Model):
             "rhs" : L
         }
 
-        return dict(nln=system_ch, lin=system_ns, pcd=pcd_operators)
+        return dict(nln=system_ch, lin=system_ns, pcd=pcd_operators,
+                    pc_ch=pc_ch, schur_ch=schur_ch)
 
     @staticmethod
     def sd_stab_parameter(mesh, wind, nu):
@@ -1064,15 +1138,22 @@ class Incompressible(Model):
                                 h/(2.0*wind_norm)*(1.0 - 1.0/PE),
                                 0.0)
 
-        return {"fcn": delta, "ufl": delta_ufl}
+        # L2 projection onto DG0 is cell-local, the mass matrix is diagonal
+        # with cell volumes on the diagonal
+        q = TestFunction(DG0)
+        delta_rhs = (delta_ufl/CellVolume(mesh))*q*dx
+
+        return {"fcn": delta, "ufl": delta_ufl, "rhs": delta_rhs}
 
     def _update_sd_stab_parameter(self):
         cc = self.coeffs
         info("Updating SD stabilization parameter...")
-        # FIXME: Use manual projection with stashed vectors!
-        cc["sdstab"]["fcn"].assign(
-            project(cc["sdstab"]["ufl"], cc["sdstab"]["fcn"].function_space(),
-                    solver_type='cg', preconditioner_type='icc'))
+        # Projection onto DG0 is evaluated cell-wise by assembling the
+        # (precompiled) right hand side directly into the vector of DOFs
+        sdstab = cc["sdstab"]
+        if not isinstance(sdstab["rhs"], Form):
+            sdstab["rhs"] = Form(sdstab["rhs"])
+        assemble(sdstab["rhs"], tensor=sdstab["fcn"].vector())
 
     # TODO: Think about grad-div stabilization parameter defined element-wise.
     #  e.g. (Jenkins, John, Linke, Rebholz) On the parameter
@@ -23,14 +23,111 @@ solvers.
 
 .. warning::
 
-    This module is currently not being used by any other MUFLON component.
-    Consider removing it.
+    Classes :py:class:`CHNewtonSolver` and :py:class:`CHNonlinearProblem`
+    are currently not being used by any other MUFLON component. Consider
+    removing them.
 """
 
 from dolfin import NewtonSolver, PETScFactory, NonlinearProblem
 from dolfin import SystemAssembler, assemble, as_backend_type
 
 
+class InexactNewtonSolver(NewtonSolver):
+    """Inexact Newton solver using Krylov solver for linear systems.
+
+    The relative tolerance of the linear solver in the iteration :math:`k`
+    is given by the forcing term of Eisenstat and Walker (choice 2),
+
+    .. math::
+
+        \\eta_k = \\min \\left\\{ \\eta_{\\max}, \\max \\left\\{
+        \\gamma \\left( \\frac{\\|F_k\\|}{\\|F_{k-1}\\|} \\right)^{\\alpha},
+        \\gamma \\eta_{k-1}^{\\alpha} \\right\\} \\right\\},
+
+    where the second argument of the maximum is used only if it exceeds
+    0.1. Hence the early iterations are solved only loosely, while the
+    final ones are solved accurately.
+
+    Histories of residual norms, forcing terms and linear iterations from
+    the last call of :py:meth:`solve` are stored in the attribute
+    ``history``.
+    """
+
+    def __init__(self, comm, solver, eta0=0.5, eta_max=0.9, gamma=0.9,
+                 alpha=1.5):
+        """Initialize for a given Krylov solver and forcing parameters."""
+        factory = PETScFactory.instance()
+        super(InexactNewtonSolver, self).__init__(comm, solver, factory)
+
+        # Store Python reference for solver setup
+        self._solver = solver
+
+        # Store parameters of forcing terms
+        self.forcing = {
+            "eta0": eta0,
+            "eta_max": eta_max,
+            "gamma": gamma,
+            "alpha": alpha,
+        }
+        self.history = {}
+
+
+    def solve(self, problem, x):
+        self.history = {
+            "residual": [],        # nonlinear residual norms
+            "eta": [],             # forcing terms
+            "linear_iterations": [],
+            "linear_residual": [], # final residual norms of linear solves
+        }
+        r = super(InexactNewtonSolver, self).solve(problem, x)
+
+        # Record the last linear solve (if any)
+        if len(self.history["eta"]) > len(self.history["linear_iterations"]):
+            self._record_linear_solve()
+            self.history["residual"].append(self.residual())
+        return r
+
+
+    def solver_setup(self, A, P, nonlinear_problem, iteration):
+        if iteration > 0:
+            self._record_linear_solve()
+        self.history["residual"].append(self.residual())
+
+        # Adjust tolerance of the linear solver
+        eta = self._forcing_term(iteration)
+        self.history["eta"].append(eta)
+        self._solver.parameters["relative_tolerance"] = eta
+
+        # Set operators
+        if P.empty():
+            self._solver.set_operator(A)
+        else:
+            self._solver.set_operators(A, P)
+
+
+    def _forcing_term(self, iteration):
+        prm = self.forcing
+        if iteration == 0:
+            return prm["eta0"]
+        res = self.history["residual"]
+        eta_prev = self.history["eta"][-1]
+        eta = prm["gamma"]*(res[-1]/res[-2])**prm["alpha"]
+        safeguard = prm["gamma"]*eta_prev**prm["alpha"]
+        if safeguard > 0.1:
+            eta = max(eta, safeguard)
+        return min(eta, prm["eta_max"])
+
+
+    def _record_linear_solve(self):
+        ksp = self._solver.ksp()
+        self.history["linear_iterations"].append(ksp.getIterationNumber())
+        self.history["linear_residual"].append(ksp.getResidualNorm())
+
+
+    def linear_solver(self):
+        return self._solver
+
+
 class CHNewtonSolver(NewtonSolver):
     """Newton solver suitable for use with
     :py:class:`muflon.solving.solvers.SemiDecoupled`.
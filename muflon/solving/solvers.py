@@ -22,18 +22,30 @@ This module provides tools for creating solvers based on various discretization
 schemes.
 """
 import six
+import numpy as np
 
 from collections import OrderedDict
+from functools import reduce
+
+from ufl import replace
 
 from dolfin import derivative, lhs, rhs, assemble, dx, begin, end, info
+from dolfin import Parameters
 from dolfin import NonlinearVariationalProblem, NonlinearVariationalSolver
 from dolfin import NewtonSolver, NonlinearProblem, SystemAssembler
-from dolfin import as_backend_type, LUSolver
+from dolfin import as_backend_type, LUSolver, PETScLUSolver, warning
+from dolfin import PETScKrylovSolver, has_krylov_solver_preconditioner
+from dolfin import Form, Function, FunctionSpace, FunctionAssigner
+from dolfin import TestFunction, VectorElement
 from dolfin import PETScMatrix, PETScVector, PETScFactory
 
 from fenapack import PCDKSP, PCDAssembler
+from fenapack.field_split_backend import PCDInterface
+from petsc4py import PETSc
 
 from muflon.common.boilerplate import not_implemented_msg
+from muflon.log.profilers import phase
+from muflon.solving.nls import InexactNewtonSolver
 from muflon.models.forms import Model
 
 # --- Generic interface for creating demanded systems of PDEs -----------------
@@ -78,6 +90,190 @@ class SolverFactory(object):
             SolverFactory._register(name)
         return SolverFactory.factories[name].create(model, *args, **kwargs)
 
+# --- Policy for reusing Jacobians in Newton solvers --------------------------
+
+class JacobianMonitor(object):
+    """
+    This class decides whether the Jacobian of a nonlinear problem must be
+    reassembled in the current Newton iteration, or whether the matrix
+    assembled earlier (in previous iteration or time step) can be reused.
+
+    If the matrix is not reassembled, its state in PETSc does not change,
+    hence linear solvers skip the setup of preconditioners (and the
+    factorization in case of direct solvers).
+    """
+    def __init__(self):
+        self.reuse = False
+        self._max_steps = 1
+        self._rate = 0.5
+        self._age = 0           # number of solves since last refresh
+        self._residuals = []    # residual norms in the current solve
+        self._stale = True      # is the refresh enforced?
+        self.reused = False     # has an old Jacobian been used in this solve?
+
+    def begin_solve(self, prm):
+        """
+        Prepare for a new call of the nonlinear solver.
+
+        :param prm: parameters of the strategy (see :ref:`tab_solprm`)
+        :type prm: :py:class:`dolfin.Parameters`
+        """
+        self.reuse = prm["reuse"]
+        self._max_steps = prm["max_steps"]
+        self._rate = prm["rate"]
+        self._age += 1
+        self._residuals = []
+        self.reused = False
+
+    def invalidate(self):
+        """
+        Enforce reassembly of the Jacobian in the next Newton iteration.
+        """
+        self._stale = True
+
+    def record_residual(self, b):
+        """
+        Store the norm of the residual vector ``b``.
+        """
+        if self.reuse:
+            self._residuals.append(b.norm("l2"))
+
+    def refresh_needed(self):
+        """
+        Returns ``True`` if the Jacobian must be reassembled.
+        """
+        if not self.reuse or self._stale:
+            return True
+        if len(self._residuals) < 2:
+            # First iteration of the current solve
+            return self._age > self._max_steps
+        # Refresh if the convergence rate degrades
+        return self._residuals[-1] > self._rate*self._residuals[-2]
+
+    def refreshed(self):
+        """
+        Inform the monitor that the Jacobian has been reassembled.
+        """
+        self._stale = False
+        self._age = 1
+
+# --- Helper functions for fieldsplit preconditioners -------------------------
+
+def _dofs_is(DS, variables, comm):
+    """
+    Create PETSc index set containing (owned) global DOFs of primitive
+    ``variables`` discretized by the discretization scheme ``DS``.
+    """
+    N = DS.parameters["N"]
+    gdim = DS.mesh().geometry().dim()
+    ncomps = {"phi": N - 1, "chi": N - 1, "v": gdim}
+    dofs = []
+    for var in variables:
+        if var in ncomps:
+            spaces = [DS.subspace(var, i) for i in range(ncomps[var])]
+        else:
+            spaces = [DS.subspace(var),]
+        for V in spaces:
+            dofs += list(V.dofmap().dofs())
+    return PETSc.IS().createGeneral(sorted(dofs), comm=comm)
+
+def _embed_is(iset, iset_parent, rstart):
+    """
+    Express index set ``iset`` in the numbering of the submatrix extracted
+    by ``iset_parent``, whose local rows start at ``rstart``. (Both index
+    sets must be sorted.)
+    """
+    idx = np.searchsorted(iset_parent.getIndices(), iset.getIndices())
+    idx = (idx + rstart).astype(PETSc.IntType)
+    return PETSc.IS().createGeneral(idx, comm=iset.comm)
+
+def _set_default_options(prefix, defaults):
+    """
+    Set PETSc options given by a list of pairs ``(key, value)`` unless
+    they have already been set (e.g. from the command line).
+
+    :returns: names of options that have been set
+    :rtype: list
+    """
+    options = PETSc.Options()
+    names = []
+    for (key, val) in defaults:
+        if not options.hasName(prefix + key):
+            options.setValue(prefix + key, val)
+            names.append(prefix + key)
+    return names
+
+def _submatrix(A, iset, submat=None):
+    """
+    Extract square submatrix of PETSc matrix ``A`` given by index set
+    ``iset`` (reusing ``submat`` if given).
+    """
+    if hasattr(A, "createSubMatrix"):
+        return A.createSubMatrix(iset, iset, submat)
+    return A.getSubMatrix(iset, iset, submat) # older versions of petsc4py
+
+class _CHSchurPC(object):
+    """
+    Python context of PETSc preconditioner for the Schur complement
+    :math:`S = A_{11} - A_{10} A_{00}^{-1} A_{01}` of the CH block
+    preconditioner, where :math:`A_{00} = -T` with
+    :math:`T = \\alpha K + \\beta M`, :math:`A_{01} = M`,
+    :math:`A_{10} = \\tau^{-1} M` and :math:`A_{11} = M_o K`. The Schur
+    complement is approximated by
+
+    .. math::
+
+      \\hat{S} = X T^{-1} X, \\qquad
+      X = \\tau^{-1/2} M + (\\alpha M_o)^{1/2} K,
+
+    which is spectrally equivalent to :math:`S` independently of the mesh
+    size (for :math:`\\beta = 0` the eigenvalues of
+    :math:`\\hat{S}^{-1} S` lie in :math:`[1/2, 1]`). The action of
+    :math:`\\hat{S}^{-1} = X^{-1} T X^{-1}` requires two V-cycles of
+    algebraic multigrid applied to :math:`X` and one multiplication by
+    :math:`T`.
+    """
+    def __init__(self, X, T, iset, prefix):
+        """
+        :param X: matrix :math:`X` assembled on the whole CH space
+        :type X: :py:class:`dolfin.PETScMatrix`
+        :param T: matrix :math:`T` assembled on the whole CH space
+        :type T: :py:class:`dolfin.PETScMatrix`
+        :param iset: index set extracting the Schur complement block
+        :type iset: :py:class:`petsc4py.PETSc.IS`
+        :param prefix: options prefix of the solver for :math:`X`
+        :type prefix: str
+        """
+        self._X, self._T, self._is = X, T, iset
+        self._Xsub, self._Tsub = None, None
+        self._work = None
+        _set_default_options(prefix, [
+            ("ksp_type", "preonly"),
+            ("pc_type", "hypre"),
+            ("pc_hypre_type", "boomeramg"),
+        ])
+        self._ksp = PETSc.KSP().create(iset.comm)
+        self._ksp.setOptionsPrefix(prefix)
+        self._ksp.setFromOptions()
+
+    def setUp(self, pc):
+        # NOTE: Matrices X and T have been reassembled together with
+        #       the preconditioner of the whole CH system
+        self._Xsub = _submatrix(as_backend_type(self._X).mat(), self._is,
+                                self._Xsub)
+        self._Tsub = _submatrix(as_backend_type(self._T).mat(), self._is,
+                                self._Tsub)
+        self._ksp.setOperators(self._Xsub)
+        self._ksp.setUp()
+
+    def apply(self, pc, x, y):
+        if self._work is None:
+            self._work = (x.duplicate(), x.duplicate())
+        w1, w2 = self._work
+        self._ksp.solve(x, w1)
+        self._Tsub.mult(w1, w2)
+        self._ksp.solve(w2, y)
+
 # --- Generic class for creating solvers ---------------------------------------
 
 class Solver(object):
@@ -109,6 +305,9 @@ class Solver(object):
         if forms is None:
             forms = model.create_forms()
 
+        # Initialize parameters
+        self.parameters = Solver._init_parameters()
+
         # Store attributes
         self.data = OrderedDict()
         self.data["model"] = model
@@ -119,6 +318,53 @@ class Solver(object):
         self._flags["fix_p"] = fix_p
         self._flags["setup"] = False
 
+        # Profiling is switched off by default
+        self._profiler = None
+
+        # Solutions from previous time levels used for extrapolation
+        self._history = {}
+
+        # Copies of initial guesses restored if modified Newton method fails
+        self._backups = {}
+
+    @staticmethod
+    def _init_parameters():
+        """
+        .. _tab_solprm:
+
+           ====================  =============  ===================================
+           Solver                \              \
+           parameters
+           ------------------------------------------------------------------------
+           Option                Suboption      Description
+           ====================  =============  ===================================
+           initial_guess                        initial guess for nonlinear
+                                                solvers, one of ``'previous'``,
+                                                ``'linear'``, ``'quadratic'``
+           --jacobian
+           \                     .reuse         reuse Jacobians in Newton solvers
+           \                     .max_steps     refresh the Jacobian at least
+                                                once per this number of steps
+           \                     .rate          refresh the Jacobian if the ratio
+                                                of consecutive residual norms
+                                                exceeds this value
+           ====================  =============  ===================================
+
+        If ``jacobian.reuse`` is ``True``, nonlinear solvers use modified
+        Newton method, see :py:class:`JacobianMonitor`. The Jacobian is also
+        refreshed whenever the time step changes. If the Newton solver fails
+        to converge with an old Jacobian, the solution is repeated with the
+        Jacobian refreshed in every iteration.
+        """
+        prm = Parameters("solver")
+        prm.add("initial_guess", "previous")
+        nested_prm = Parameters("jacobian")
+        nested_prm.add("reuse", False)
+        nested_prm.add("max_steps", 1)
+        nested_prm.add("rate", 0.5)
+        prm.add(nested_prm)
+        return prm
+
     def comm(self):
         """
         Returns MPI communicator.
@@ -145,6 +391,159 @@ class Solver(object):
         Put solver into its initial state.
         """
         self._flags["setup"] = False
+        self._history = {}
+        self._invalidate_jacobians()
+
+    def _invalidate_jacobians(self):
+        for key in ["problem", "problem_ch"]:
+            if key in self.data:
+                self.data[key].jacobian.invalidate()
+
+    def _newton_solve(self, solver, problem, x):
+        """
+        Solve nonlinear ``problem`` by Newton ``solver`` with the policy for
+        reusing Jacobians given by parameters ``jacobian``.
+
+        :returns: number of Newton iterations
+        :rtype: int
+        """
+        monitor = problem.jacobian
+        monitor.begin_solve(self.parameters["jacobian"])
+        if monitor.reuse:
+            x0 = self._backups.get(id(problem))
+            if x0 is None or x0.local_range() != x.local_range():
+                x0 = self._backups[id(problem)] = x.copy()
+            else:
+                x0.zero()         # reuse allocated vector
+                x0.axpy(1.0, x)
+        try:
+            with phase(self._profiler, "solve"):
+                return solver.solve(problem, x)[0]
+        except RuntimeError:
+            if not monitor.reused:
+                raise
+        # Modified Newton method failed, repeat the solve with full Newton
+        warning("Newton solver failed with reused Jacobian, "
+                "repeating the solve with refreshed Jacobian")
+        iters = solver.iteration()
+        x.zero()
+        x.axpy(1.0, x0)
+        monitor.reuse = False
+        with phase(self._profiler, "solve"):
+            iters += solver.solve(problem, x)[0]
+        return iters
+
+    def set_profiler(self, profiler):
+        """
+        Register profiler that will measure the time spent in individual
+        phases of the solution process.
+
+        :param profiler: profiler (``None`` switches the profiling off)
+        :type profiler: :py:class:`MuflonProfiler \
+                        <muflon.log.profilers.MuflonProfiler>`
+        """
+        self._profiler = profiler
+        for key in ["problem", "problem_ch"]:
+            if key in self.data:
+                self.data[key].profiler = profiler
+
+    def update_time_step(self, OTD, dt):
+        """
+        Update time discretization factors and the value of the time step in
+        the UFL forms. Override this method if the solver keeps some data that
+        depend on the time step and must be refreshed whenever it changes.
+
+        :param OTD: order of time discretization
+        :type OTD: int
+        :param dt: new value of the time step
+        :type dt: float
+        """
+        model = self.data["model"]
+        model.update_TD_factors(OTD, dt)
+        model.update_time_step_value(dt)
+        self._invalidate_jacobians()
+
+    def _extrapolation_order(self):
+        orders = {"previous": 0, "linear": 1, "quadratic": 2}
+        guess = self.parameters["initial_guess"]
+        if guess not in orders:
+            msg = "Unknown initial guess '%s', use one of %s" \
+                  % (guess, list(orders.keys()))
+            raise ValueError(msg)
+        return orders[guess]
+
+    def _apply_initial_guess(self, key, x):
+        """
+        Overwrite vector ``x`` by the extrapolation of solutions stored in the
+        history under ``key`` (see :py:meth:`_store_history`). The order of
+        extrapolation is determined by the parameter ``initial_guess``. If the
+        history is not long enough, extrapolation of lower order is used.
+        Nothing happens for ``initial_guess = 'previous'``, i.e. the initial
+        guess is the solution obtained in the last step.
+
+        :param key: name of the history
+        :type key: str
+        :param x: vector of the solution function
+        :type x: :py:class:`dolfin.GenericVector`
+        """
+        order = self._extrapolation_order()
+        if order == 0:
+            return
+        DS = self.data["model"].discretization_scheme()
+        level = DS.number_of_ptl_updates()
+        dt = self.data["model"].time_step_value()
+        points = [h for h in self._history.get(key, []) if h[0] < level]
+        points = points[-(order + 1):]
+        if not dt > 0.0 or len(points) < 2 or points[-1][0] != level - 1:
+            return
+        taus = [h[1] for h in points]
+        if len(set(taus)) < len(taus):
+            return
+        # Lagrange extrapolation to the new time level
+        tau = taus[-1] + dt
+        x.zero()
+        for (j, h) in enumerate(points):
+            weight = 1.0
+            for (m, tau_m) in enumerate(taus):
+                if m != j:
+                    weight *= (tau - tau_m)/(taus[j] - tau_m)
+            x.axpy(weight, h[2])
+        x.apply("insert")
+
+    def _store_history(self, key, x):
+        """
+        Store solution vector ``x`` in the history under ``key``. Each entry
+        of the history is identified by the number of updates of solution
+        at previous time levels, so the solution obtained in a repeated step
+        replaces the previous one.
+
+        :param key: name of the history
+        :type key: str
+        :param x: vector of the solution function
+        :type x: :py:class:`dolfin.GenericVector`
+        """
+        order = self._extrapolation_order()
+        if order == 0:
+            return
+        DS = self.data["model"].discretization_scheme()
+        level = DS.number_of_ptl_updates()
+        dt = self.data["model"].time_step_value()
+        history = self._history.setdefault(key, [])
+        entry = None
+        if history and history[-1][0] == level:
+            entry = history.pop() # repeated step
+        elif history and history[-1][0] != level - 1:
+            del history[:]        # history is not contiguous
+        elif len(history) == order + 1:
+            entry = history.pop(0)
+        tau = history[-1][1] + dt if history else 0.0
+        if entry is None:
+            vec = x.copy()
+        else:
+            vec = entry[2]        # reuse allocated vector
+            vec.zero()
+            vec.axpy(1.0, x)
+        history.append([level, tau, vec])
 
     def _calibrate_pressure(self, sol_fcn, null_fcn):
         """
@@ -158,11 +557,17 @@ class Solver(object):
                          shape of ``sol_fcn``, so `axpy` operation may be used)
         :type null_fcn: :py:class:`dolfin.Function`
         """
-        DS = self.data["model"].discretization_scheme()
-        domain_size = DS.compute_domain_size()
-        p = DS.primitive_vars_ctl()["p"].dolfin_repr()
-        p_corr = assemble(p*dx)/domain_size
-        sol_fcn.vector().axpy(-p_corr, null_fcn.vector())
+        with phase(self._profiler, "pressure"):
+            if "p_weights" not in self.data:
+                # Precompute weights such that their dot product with the
+                # vector of DOFs yields the mean value of pressure
+                DS = self.data["model"].discretization_scheme()
+                q = DS.test_functions()["p"]
+                p_weights = assemble(q*dx)
+                p_weights *= 1.0/DS.compute_domain_size()
+                self.data["p_weights"] = p_weights
+            p_corr = self.data["p_weights"].inner(sol_fcn.vector())
+            sol_fcn.vector().axpy(-p_corr, null_fcn.vector())
 
 # --- Monolithic nonlinear solver ---------------------------------------------
 
@@ -170,6 +575,42 @@ class Monolithic(Solver):
     """
     This class implements nonlinear solver for monolithic discretization
     scheme.
+
+    Linear systems within Newton iterations are solved either by a direct
+    solver (default), or by a preconditioned Krylov solver, see the
+    `table`__ below.
+
+    __ tab_mprm_
+
+    .. _tab_mprm:
+
+       ====================  =============  ===================================
+       Monolithic            \              \
+       parameters
+       ------------------------------------------------------------------------
+       Option                Suboption      Description
+       ====================  =============  ===================================
+       ls                                   ``'direct'`` or ``'iterative'``
+       --krylov
+       \                     .rtol          relative tolerance
+       \                     .maxit         maximum number of iterations
+       ====================  =============  ===================================
+
+    In the iterative mode, GMRES is preconditioned by nested fieldsplit
+    preconditioners. The outer (multiplicative) splitting separates the CH
+    block ``ch`` from the NS block ``ns``. The CH block is split into
+    ``phi`` and ``chi``. The ``phi`` block is inverted by algebraic
+    multigrid and the Schur complement is approximated by the product of
+    sparse matrices built from the forms ``forms["schur_ch"]``, see
+    :py:class:`_CHSchurPC` (unless the option
+    ``-mono_fieldsplit_ch_fieldsplit_chi_pc_type`` is set). The NS
+    block is split into ``u`` and ``p`` with the Schur complement
+    approximated by the PCD preconditioner from FENaPack, which is built
+    from the forms ``forms["pcd"]`` (see :py:meth:`forms_Monolithic \
+    <muflon.models.forms.Incompressible.forms_Monolithic>`). The PETSc
+    options prefix of the solver is ``mono_``, so all the default options
+    can be overwritten from the command line (e.g.
+    ``-mono_fieldsplit_ns_fieldsplit_u_pc_type``).
     """
     class Factory(object):
         def create(self, *args, **kwargs):
@@ -183,18 +624,45 @@ class Monolithic(Solver):
             super(Monolithic.Problem, self).__init__()
             self.assembler = SystemAssembler(J, F, bcs)
             self.null_space = null_space
+            self.profiler = None
+            self.jacobian = JacobianMonitor()
+            # Matrices reassembled together with the Jacobian
+            self.schur_forms = ()
+            self.schur_mats = []
+            # Callback invoked after the first assembly of the Jacobian
+            self.init_pc = None
+
+        def set_schur_forms(self, schur, comm):
+            """
+            Matrices corresponding to bilinear forms ``schur`` will be
+            reassembled together with the Jacobian.
+            """
+            self.schur_forms = tuple(schur)
+            self.schur_mats = [PETScMatrix(comm) for a in schur]
 
         def F(self, b, x):
-            self.assembler.assemble(b, x)
+            with phase(self.profiler, "assembly"):
+                self.assembler.assemble(b, x)
             if self.null_space:
                 # Orthogonalize RHS vector b with respect to the null space
                 self.null_space.orthogonalize(b)
+            self.jacobian.record_residual(b)
 
         def J(self, A, x):
-            self.assembler.assemble(A)
+            if not self.jacobian.refresh_needed():
+                self.jacobian.reused = True
+                return
+            with phase(self.profiler, "assembly"):
+                self.assembler.assemble(A)
+                for (a, S) in zip(self.schur_forms, self.schur_mats):
+                    assemble(a, tensor=S)
             if self.null_space:
                 # Attach null space to PETSc matrix
                 as_backend_type(A).set_nullspace(self.null_space)
+            self.jacobian.refreshed()
+            if self.init_pc is not None:
+                init_pc, self.init_pc = self.init_pc, None
+                init_pc(A)
 
     def __init__(self, *args, **kwargs):
         """
@@ -207,6 +675,13 @@ class Monolithic(Solver):
         """
         super(Monolithic, self).__init__(*args, **kwargs)
 
+        # Add parameters of linear solvers
+        self.parameters.add("ls", "direct")
+        nested_prm = Parameters("krylov")
+        nested_prm.add("rtol", 1e-6)
+        nested_prm.add("maxit", 1000)
+        self.parameters.add(nested_prm)
+
         # Adjust forms
         DS = self.data["model"].discretization_scheme()
         w = DS.solution_ctl()[0]
@@ -241,16 +716,187 @@ class Monolithic(Solver):
         self.data["solver"] = solver
         self.data["problem"] = Monolithic.Problem(F, bcs, J, null_space)
         self.data["sol_fcn"] = w
+        self.data["bcs"] = bcs
+
+        # Store number of iterations
+        self.iters = OrderedDict()
+        self.iters["nln"] = [0, 0] # (total, last solve)
+
+    def setup(self):
+        """
+        Replace the direct solver by the Krylov solver with fieldsplit
+        preconditioner if required.
+        """
+        ls = self.parameters["ls"]
+        if ls not in ["direct", "iterative"]:
+            msg = "Unknown type of linear solver '%s'" % ls
+            raise ValueError(msg)
+        if ls == "iterative" and "pcd_assembler" not in self.data:
+            self._setup_fieldsplit()
+        super(Monolithic, self).setup()
+
+    def _setup_fieldsplit(self):
+        """
+        Create Newton solver with GMRES preconditioned by nested fieldsplit
+        preconditioners.
+        """
+        DS = self.data["model"].discretization_scheme()
+        if DS.num_dofs("th") > 0:
+            msg = "Fieldsplit preconditioner cannot handle temperature"
+            not_implemented_msg(self, msg)
+
+        # Create PCD assembler (for preconditioner only)
+        forms = self.data["forms"]
+        problem = self.data["problem"]
+        w = self.data["sol_fcn"]
+        F = forms["nln"]
+        self.data["pcd_assembler"] = PCDAssembler(
+            derivative(F, w),       # A
+            F,                      # b
+            self.data["bcs"],       # bcs
+            gp=forms["pcd"]["gp"],  # B^T
+            ap=forms["pcd"]["ap"],
+            kp=forms["pcd"]["kp"],
+            mp=forms["pcd"]["mp"],
+            mu=forms["pcd"]["mu"],
+            bcs_pcd=self.data["model"].bcs().get("pcd", []))
+
+        # Create linear solver
+        prm = self.parameters["krylov"]
+        linear_solver = PETScKrylovSolver("gmres")
+        linear_solver.set_options_prefix("mono_")
+        linear_solver.parameters["relative_tolerance"] = prm["rtol"]
+        linear_solver.parameters["maximum_iterations"] = prm["maxit"]
+        linear_solver.parameters["error_on_nonconvergence"] = False
+        self.data["linear_solver"] = linear_solver
+
+        # Create Newton solver
+        factory = PETScFactory.instance()
+        solver = NewtonSolver(self.comm(), linear_solver, factory)
+        solver.parameters['absolute_tolerance'] = 1E-8
+        solver.parameters['relative_tolerance'] = 1E-16
+        solver.parameters['maximum_iterations'] = 10
+        self.data["solver"] = solver
+
+        # Approximation of the Schur complement of the CH block
+        if "schur_ch" not in forms:
+            msg = "Form 'schur_ch' is required by the fieldsplit" \
+                  " preconditioner"
+            raise ValueError(msg)
+        problem.set_schur_forms(forms["schur_ch"], self.comm())
+
+        # NOTE: Nested splittings can be defined only when the operator is
+        #       available, i.e. after the first assembly of the Jacobian
+        problem.init_pc = self._init_fieldsplit
+
+    def _init_fieldsplit(self, A):
+        """
+        Set up nested fieldsplit preconditioner for the Jacobian ``A``.
+        """
+        DS = self.data["model"].discretization_scheme()
+        ksp = self.data["linear_solver"].ksp()
+        prefix = ksp.getOptionsPrefix()
+        matA = as_backend_type(A).mat()
+        ksp.setOperators(matA)
+
+        # Default options
+        # NOTE: Schur complement of the CH block is approximated by
+        #       _CHSchurPC unless its preconditioner is set by the user
+        schur_ch = not PETSc.Options().hasName(
+            prefix + "fieldsplit_ch_fieldsplit_chi_pc_type")
+        defaults = [("pc_fieldsplit_type", "multiplicative")]
+        for (block, sub) in [("ch", "phi"), ("ch", "chi"), ("ns", "u")]:
+            defaults.append(
+                ("fieldsplit_%s_fieldsplit_%s_ksp_type" % (block, sub),
+                 "preonly"))
+        for (block, sub) in [("ch", "phi"), ("ns", "u")]:
+            defaults.append(
+                ("fieldsplit_%s_fieldsplit_%s_pc_type" % (block, sub),
+                 "hypre"))
+        defaults += [
+            ("fieldsplit_ch_ksp_type", "preonly"),
+            ("fieldsplit_ch_pc_fieldsplit_type", "schur"),
+            ("fieldsplit_ch_pc_fieldsplit_schur_fact_type", "lower"),
+            ("fieldsplit_ch_pc_fieldsplit_schur_precondition", "a11"),
+            ("fieldsplit_ns_ksp_type", "preonly"),
+            ("fieldsplit_ns_fieldsplit_p_ksp_type", "preonly"),
+            ("fieldsplit_ns_fieldsplit_p_pc_python_type",
+             "fenapack.PCDPC_BRM1"),
+        ]
+        for op in ["Ap", "Mp"]:
+            defaults += [
+                ("fieldsplit_ns_fieldsplit_p_PCD_%s_ksp_type" % op,
+                 "richardson"),
+                ("fieldsplit_ns_fieldsplit_p_PCD_%s_ksp_max_it" % op, "1"),
+            ]
+        defaults += [
+            ("fieldsplit_ns_fieldsplit_p_PCD_Ap_pc_type", "hypre"),
+            ("fieldsplit_ns_fieldsplit_p_PCD_Mp_pc_type", "jacobi"),
+        ]
+        _set_default_options(prefix, defaults)
+
+        # Outer splitting
+        pc = ksp.getPC()
+        is_ch = _dofs_is(DS, ["phi", "chi"], pc.comm)
+        is_ns = _dofs_is(DS, ["v", "p"], pc.comm)
+        pc.setType(PETSc.PC.Type.FIELDSPLIT)
+        pc.setFieldSplitIS(("ch", is_ch), ("ns", is_ns))
+        ksp.setFromOptions()
+        pc.setUp()
+        ksp_ch, ksp_ns = pc.getFieldSplitSubKSP()
+
+        # CH block
+        rstart = ksp_ch.getOperators()[0].getOwnershipRange()[0]
+        is_chi = _dofs_is(DS, ["chi"], pc.comm)
+        ksp_ch.pc.setType(PETSc.PC.Type.FIELDSPLIT)
+        for var in ["phi", "chi"]:
+            iset = _embed_is(_dofs_is(DS, [var], pc.comm), is_ch, rstart)
+            ksp_ch.pc.setFieldSplitIS((var, iset))
+        ksp_ch.setFromOptions()
+        if schur_ch:
+            ksp_ch.pc.setUp()
+            ksp_S = ksp_ch.pc.getFieldSplitSubKSP()[1]
+            X, T = self.data["problem"].schur_mats
+            ksp_S.pc.setType(PETSc.PC.Type.PYTHON)
+            ksp_S.pc.setPythonContext(_CHSchurPC(
+                X, T, is_chi, prefix + "fieldsplit_ch_fieldsplit_chi_X_"))
+
+        # NS block (the same setting as in PCDKSP)
+        rstart = ksp_ns.getOperators()[0].getOwnershipRange()[0]
+        is_v = _dofs_is(DS, ["v"], pc.comm)
+        is_p = _dofs_is(DS, ["p"], pc.comm)
+        pc_ns = ksp_ns.pc
+        pc_ns.setType(PETSc.PC.Type.FIELDSPLIT)
+        pc_ns.setFieldSplitIS(("u", _embed_is(is_v, is_ns, rstart)),
+                              ("p", _embed_is(is_p, is_ns, rstart)))
+        pc_ns.setFieldSplitType(PETSc.PC.CompositeType.SCHUR)
+        pc_ns.setFieldSplitSchurFactType(PETSc.PC.SchurFactType.UPPER)
+        pc_ns.setFieldSplitSchurPreType(PETSc.PC.SchurPreType.USER)
+        ksp_ns.setFromOptions()
+        pc_ns.setUp()
+        ksp_u, ksp_p = pc_ns.getFieldSplitSubKSP()
+        ksp_u.setFromOptions()
+        ksp_p.pc.setType(PETSc.PC.Type.PYTHON)
+        ksp_p.setFromOptions()
+
+        # Provide PCD operators extracted from the monolithic system
+        pcd_interface = PCDInterface(self.data["pcd_assembler"], matA,
+                                     is_v, is_p, deep_submats=True)
+        ksp_p.pc.getPythonContext().init_pcd(pcd_interface)
 
     def solve(self):
         """
         Perform one solution step (in time).
         """
-        self.data["solver"].solve(
-            self.data["problem"], self.data["sol_fcn"].vector())
+        self._apply_initial_guess("nln", self.data["sol_fcn"].vector())
+        self.iters["nln"][-1] = self._newton_solve(
+            self.data["solver"], self.data["problem"],
+            self.data["sol_fcn"].vector())
+        self.iters["nln"][0] += self.iters["nln"][-1]
 
         if self._flags["fix_p"]:
             self._calibrate_pressure(self.data["sol_fcn"], self.data["null_fcn"])
+        self._store_history("nln", self.data["sol_fcn"].vector())
 
 # --- Semi-decoupled nonlinear solver ---------------------------------------------
 
@@ -258,6 +904,71 @@ class SemiDecoupled(Solver):
     """
     This class implements nonlinear solver for semi-decoupled discretization
     scheme.
+
+    The CH part is solved either by Newton method with a direct solver
+    (default), or by inexact Newton method with a preconditioned Krylov
+    solver, see the `table`__ below.
+
+    __ tab_sdprm_
+
+    .. _tab_sdprm:
+
+       ====================  =============  ===================================
+       SemiDecoupled         \              \
+       parameters
+       ------------------------------------------------------------------------
+       Option                Suboption      Description
+       ====================  =============  ===================================
+       ch_ls                                ``'direct'`` or ``'iterative'``
+       ch_pc                                ``'default'`` or ``'schur'``
+                                            (preconditioner in the iterative
+                                            mode)
+       --forcing
+       \                     .eta0          forcing term in the first iteration
+       \                     .eta_max       upper bound for forcing terms
+       \                     .gamma         parameter of Eisenstat-Walker
+                                            forcing terms
+       \                     .alpha         parameter of Eisenstat-Walker
+                                            forcing terms
+       --ns_krylov
+       \                     .guess         initial guess for the Krylov
+                                            solver of the NS part, one of
+                                            ``'zero'``, ``'previous'``,
+                                            ``'fischer'``
+       \                     .size          number of stored solutions for
+                                            the ``'fischer'`` guess
+       \                     .deflation     use deflated GMRES
+       ====================  =============  ===================================
+
+    In the iterative mode, the CH part is solved by
+    :py:class:`InexactNewtonSolver <muflon.solving.nls.InexactNewtonSolver>`
+    with GMRES as the linear solver. The PETSc options prefix of the linear
+    solver is ``ch_``, so it can be adjusted from the command line (e.g.
+    ``-ch_pc_type``). Histories of residuals from the last solve are
+    available in ``solver.data["solver"]["CH"]["nln"].history``.
+
+    If ``ch_pc`` is ``'schur'``, the linear solver is preconditioned by
+    a block preconditioner built from the forms ``forms["pc_ch"]`` and
+    ``forms["schur_ch"]`` (see :py:meth:`Incompressible.forms_SemiDecoupled \
+    <muflon.models.forms.Incompressible.forms_SemiDecoupled>`). PETSc's
+    fieldsplit with the lower Schur factorization splits the system into
+    blocks ``phi`` and ``chi``. The ``phi`` block is inverted by a single
+    V-cycle of algebraic multigrid. The Schur complement is approximated
+    by a product of sparse matrices which is spectrally equivalent to it
+    (see :py:class:`_CHSchurPC`), its inverse costs two V-cycles. Hence
+    the cost of the solution scales linearly with the number of degrees of
+    freedom. (The approximation is not used if the option
+    ``-ch_fieldsplit_chi_pc_type`` is set.)
+
+    Parameters ``ns_krylov`` take effect if the NS part is solved by
+    :py:class:`fenapack.PCDKSP`. Unless ``guess`` is ``'zero'``, the
+    solution from the previous step (or its extrapolation, see
+    :ref:`tab_solprm`) is used as the initial guess. The ``'fischer'``
+    guess in addition projects the new solution onto the space spanned by
+    ``size`` previous solutions (PETSc's ``KSPGUESSFISCHER``). If
+    ``deflation`` is ``True``, then DGMRES is used, which keeps the
+    approximate invariant subspace computed at restarts for subsequent
+    solves.
     """
     class Factory(object):
         def create(self, *args, **kwargs):
@@ -271,13 +982,44 @@ class SemiDecoupled(Solver):
 
             # Assembler for Newton system
             self.assembler = SystemAssembler(J, F, bcs)
+            self.profiler = None
+            self.jacobian = JacobianMonitor()
+
+            # Assembler for preconditioner (see set_pc_form)
+            self.assembler_pc = None
+            self._assemble_pc = False
+            self.schur_mats = []
+            # Callback invoked after the first assembly of the preconditioner
+            self.init_pc = None
+
+            # Store bcs
+            self._bcs = bcs
 
             # Store forms for later
             self.forms = {
                 "F": F,
                 "J": J,
+                "J_pc": None,
+                "schur": (),
             }
 
+        def set_pc_form(self, J_pc, schur=()):
+            """
+            Use bilinear form ``J_pc`` to assemble preconditioner. Matrices
+            corresponding to bilinear forms ``schur`` are reassembled
+            together with the preconditioner. (``J_pc = None`` switches
+            the assembly of the preconditioner off.)
+            """
+            self.assembler_pc = None
+            self.init_pc = None
+            if J_pc is not None:
+                self.assembler_pc = SystemAssembler(J_pc, self.forms["F"],
+                                                    self._bcs)
+            self.forms["J_pc"] = J_pc
+            self.forms["schur"] = tuple(schur)
+            comm = self.function_space().mesh().mpi_comm()
+            self.schur_mats = [PETScMatrix(comm) for a in schur]
+
         def function_space(self):
             return self.forms["F"].arguments()[0].function_space()
 
@@ -287,18 +1029,38 @@ class SemiDecoupled(Solver):
                 assert not matA.isAssembled()
                 bs = self.function_space().dofmap().block_size()
                 matA.setBlockSize(bs)
-                # matP = as_backend_type(P).mat()
-                # assert not matP.isAssembled()
-                # matP.setBlockSize(bs)
+                if self.assembler_pc is not None and P.empty():
+                    matP = as_backend_type(P).mat()
+                    assert not matP.isAssembled()
+                    matP.setBlockSize(bs)
 
         def F(self, b, x):
-            self.assembler.assemble(b, x)
+            with phase(self.profiler, "assembly"):
+                self.assembler.assemble(b, x)
+            self.jacobian.record_residual(b)
 
         def J(self, A, x):
             # matA = as_backend_type(A).mat()
             # bs = self.function_space().dofmap().block_size()
             # assert matA.getBlockSize() == bs
-            self.assembler.assemble(A)
+            self._assemble_pc = self.jacobian.refresh_needed()
+            if not self._assemble_pc:
+                self.jacobian.reused = True
+                return
+            with phase(self.profiler, "assembly"):
+                self.assembler.assemble(A)
+            self.jacobian.refreshed()
+
+        def J_pc(self, P, x):
+            # NOTE: Preconditioner is refreshed together with the Jacobian
+            if self.assembler_pc is not None and self._assemble_pc:
+                with phase(self.profiler, "assembly"):
+                    self.assembler_pc.assemble(P)
+                    for (a, S) in zip(self.forms["schur"], self.schur_mats):
+                        assemble(a, tensor=S)
+                if self.init_pc is not None:
+                    init_pc, self.init_pc = self.init_pc, None
+                    init_pc(P)
 
 
     def __init__(self, *args, **kwargs):
@@ -312,6 +1074,23 @@ class SemiDecoupled(Solver):
         """
         super(SemiDecoupled, self).__init__(*args, **kwargs)
 
+        # Add parameters of the CH solver
+        self.parameters.add("ch_ls", "direct")
+        self.parameters.add("ch_pc", "default")
+        nested_prm = Parameters("forcing")
+        nested_prm.add("eta0", 0.5)
+        nested_prm.add("eta_max", 0.9)
+        nested_prm.add("gamma", 0.9)
+        nested_prm.add("alpha", 0.5*(1.0 + 5.0**0.5))
+        self.parameters.add(nested_prm)
+
+        # Add parameters of the NS solver
+        nested_prm = Parameters("ns_krylov")
+        nested_prm.add("guess", "zero")
+        nested_prm.add("size", 10)
+        nested_prm.add("deflation", False)
+        self.parameters.add(nested_prm)
+
         # Extract solution functions
         DS = self.data["model"].discretization_scheme()
         w_ch, w_ns = DS.solution_ctl()
@@ -353,11 +1132,76 @@ class SemiDecoupled(Solver):
         self.iters["CH"] = [0, 0] # (total, last solve)
         self.iters["NS"] = [0, 0] # (total, last solve)
 
+        # Parameters used by the last setup, see SemiDecoupled.setup
+        self._setup_keys = {}
+
     def setup(self):
-        # Set up nonlinear CH solver based on provided linear solver
-        factory = PETScFactory.instance()
-        solver_ch = NewtonSolver(
-            self.comm(), self.data["solver"]["CH"]["lin"], factory)
+        """
+        Create nonlinear CH solver and persistent objects for the NS system.
+
+        (Objects that already exist are kept, so the method can be called
+        repeatedly, e.g. by consecutive runs of time-stepping algorithms.
+        Solvers are adjusted again if their parameters have changed since
+        the last call, or if the NS solver has been replaced.)
+        """
+        key = self._parameters_key(["ch_ls", "ch_pc", "forcing"])
+        if self._setup_keys.get("CH") != key:
+            self._setup_ch_solver()
+            self._setup_keys["CH"] = key
+
+        # Create NS system matrix, RHS vector and preconditioner matrix that
+        # will be reassembled in place (sparsity patterns are kept)
+        if "A_ns" not in self.data:
+            self.data["A_ns"] = PETScMatrix(self.comm())
+            self.data["b_ns"] = PETScVector(self.comm())
+            self.data["P_ns"] = PETScMatrix(self.comm())
+
+        # Set up NS solver
+        solver_ns = self.data["solver"]["NS"]
+        key = self._parameters_key(["ns_krylov"])
+        previous = self._setup_keys.get("NS", (None, None))
+        if previous[0] is not solver_ns or previous[1] != key:
+            self._setup_ns_solver(new_solver=(previous[0] is not solver_ns))
+            self._setup_keys["NS"] = (solver_ns, key)
+
+        super(SemiDecoupled, self).setup()
+
+    def _parameters_key(self, names):
+        """
+        Returns values of parameters ``names`` (including nested ones).
+        """
+        key = []
+        for name in names:
+            prm = self.parameters[name]
+            if isinstance(prm, Parameters):
+                key.append(tuple((k, prm[k]) for k in sorted(prm.keys())))
+            else:
+                key.append(prm)
+        return tuple(key)
+
+    def _setup_ch_solver(self):
+        """
+        Create nonlinear solver for the CH part based on parameters
+        ``ch_ls``, ``ch_pc`` and ``forcing``.
+        """
+        problem = self.data["problem_ch"]
+        problem.set_pc_form(None)
+        problem.jacobian.invalidate()
+        ch_ls = self.parameters["ch_ls"]
+        if ch_ls == "direct":
+            if self._flags.get("ch_krylov", False):
+                # Drop the Krylov solver created in the iterative mode
+                self.data["solver"]["CH"]["lin"] = LUSolver("mumps")
+                self._flags["ch_krylov"] = False
+            factory = PETScFactory.instance()
+            solver_ch = NewtonSolver(
+                self.comm(), self.data["solver"]["CH"]["lin"], factory)
+        elif ch_ls == "iterative":
+            solver_ch = self._create_inexact_newton_solver()
+            self._flags["ch_krylov"] = True
+        else:
+            msg = "Unknown type of CH solver '%s'" % ch_ls
+            raise ValueError(msg)
         solver_ch.parameters['absolute_tolerance'] = 1E-8
         solver_ch.parameters['relative_tolerance'] = 1E-16
         solver_ch.parameters['maximum_iterations'] = 25
@@ -366,74 +1210,221 @@ class SemiDecoupled(Solver):
         #solver_ch.parameters['convergence_criterion'] = 'incremental'
         assert solver_ch.parameters["linear_solver"] == "user_defined"
         assert solver_ch.parameters["preconditioner"] == "user_defined"
-        assert "nln" not in self.data["solver"]["CH"]
         self.data["solver"]["CH"]["nln"] = solver_ch
 
-        # Set up NS solver
+    def _setup_ns_solver(self, new_solver):
+        """
+        Prepare PCD assembler for the NS solver (if ``new_solver`` is
+        ``True``) and adjust the solver according to parameters
+        ``ns_krylov``.
+        """
         if hasattr(self.data["solver"]["NS"], "ksp"):
             ksp = getattr(self.data["solver"]["NS"], "ksp")()
             if isinstance(ksp, PCDKSP):
-                forms = self.data["forms"]
-                bcs_ns = self.data["bcs_ns"]
-                bc_pcd = self.data["model"].bcs()["pcd"]
-                self.data["pcd_assembler"] = PCDAssembler(
-                    forms["lin"]["lhs"],       # A
-                    forms["lin"]["rhs"],       # b
-                    bcs_ns,                    # bcs
-                    forms["pcd"]["a_pc"],      # P
-                    gp=forms["pcd"]["gp"],     # B^T
-                    ap=forms["pcd"]["ap"],
-                    kp=forms["pcd"]["kp"],
-                    mp=forms["pcd"]["mp"],
-                    mu=forms["pcd"]["mu"],
-                    bcs_pcd=bc_pcd)
-                self.data["pcd_assembler"].get_pcd_form("mp").constant = False
-                self.data["pcd_assembler"].get_pcd_form("mu").constant = False
-                #self.data["pcd_assembler"].get_pcd_form("gp").phantom = False
-                self._flags["init_pcd_called"] = False
-        else:
+                if new_solver:
+                    self._create_pcd_assembler()
+                self._setup_ns_krylov()
+        elif new_solver:
+            self.data.pop("pcd_assembler", None)
             info("")
             info("'LUSolver' will be applied to the Navier-Stokes subproblem.")
             info("")
 
+    def _create_pcd_assembler(self):
+        """
+        Create assembler of the NS system and PCD operators.
+        """
+        forms = self.data["forms"]
+        bcs_ns = self.data["bcs_ns"]
+        bc_pcd = self.data["model"].bcs()["pcd"]
+        self.data["pcd_assembler"] = PCDAssembler(
+            forms["lin"]["lhs"],       # A
+            forms["lin"]["rhs"],       # b
+            bcs_ns,                    # bcs
+            forms["pcd"]["a_pc"],      # P
+            gp=forms["pcd"]["gp"],     # B^T
+            ap=forms["pcd"]["ap"],
+            kp=forms["pcd"]["kp"],
+            mp=forms["pcd"]["mp"],
+            mu=forms["pcd"]["mu"],
+            bcs_pcd=bc_pcd)
+        self.data["pcd_assembler"].get_pcd_form("mp").constant = False
+        self.data["pcd_assembler"].get_pcd_form("mu").constant = False
+        #self.data["pcd_assembler"].get_pcd_form("gp").phantom = False
+        self._flags["init_pcd_called"] = False
+
+    def _setup_ns_krylov(self):
+        """
+        Adjust Krylov solver for the NS part according to parameters
+        ``ns_krylov``. (Options set by previous calls are replaced.)
+        """
+        prm = self.parameters["ns_krylov"]
+        guess = prm["guess"]
+        if guess not in ["zero", "previous", "fischer"]:
+            msg = "Unknown initial guess '%s' for NS solver" % guess
+            raise ValueError(msg)
+        self._flags["ns_guess"] = (guess != "zero")
+        solver = self.data["solver"]["NS"]
+        ksp = solver.ksp()
+        prefix = ksp.getOptionsPrefix() or ""
+
+        # Remove options set by the previous call
+        options = PETSc.Options()
+        previous = self.data.pop("ns_options", [])
+        for name in previous:
+            options.delValue(name)
+        if prefix + "ksp_type" in previous and not prm["deflation"]:
+            ksp.setType(PETSc.KSP.Type.GMRES)
+        if prefix + "ksp_guess_type" in previous and guess != "fischer":
+            warning("Fischer's initial guess cannot be switched off,"
+                    " replace the NS solver")
+
+        defaults = []
+        if prm["deflation"]:
+            defaults.append(("ksp_type", "dgmres"))
+        solver.parameters["nonzero_initial_guess"] = (guess != "zero")
+        ksp.setInitialGuessNonzero(guess != "zero")
+        if guess == "fischer":
+            defaults += [
+                ("ksp_guess_type", "fischer"),
+                ("ksp_guess_fischer_model", "1,%d" % prm["size"]),
+            ]
+        if defaults:
+            self.data["ns_options"] = _set_default_options(prefix, defaults)
+            ksp.setFromOptions()
+
+    def _create_inexact_newton_solver(self):
+        """
+        Create inexact Newton solver with GMRES as the linear solver.
+        """
+        solver = PETScKrylovSolver("gmres")
+        solver.set_options_prefix("ch_")
+        # NOTE: Tolerances are driven by forcing terms, failure of the linear
+        #       solver is detected by the outer Newton iteration
+        solver.parameters["error_on_nonconvergence"] = False
+        ch_pc = self.parameters["ch_pc"]
+        if ch_pc == "schur":
+            self._setup_ch_block_preconditioner(solver)
+        elif ch_pc != "default":
+            msg = "Unknown preconditioner for CH solver '%s'" % ch_pc
+            raise ValueError(msg)
+        solver.set_from_options()
+        self.data["solver"]["CH"]["lin"] = solver
+
+        prm = self.parameters["forcing"]
+        return InexactNewtonSolver(
+            self.comm(), solver, eta0=prm["eta0"], eta_max=prm["eta_max"],
+            gamma=prm["gamma"], alpha=prm["alpha"])
+
+    def _setup_ch_block_preconditioner(self, solver):
+        """
+        Set up fieldsplit preconditioner with Schur complement for the CH
+        part. Options that are already set (e.g. from the command line) are
+        not overwritten.
+        """
+        J_pc = self.data["forms"].get("pc_ch", None)
+        schur = self.data["forms"].get("schur_ch", None)
+        if J_pc is None or schur is None:
+            msg = "Forms 'pc_ch' and 'schur_ch' are required by the block" \
+                  " preconditioner"
+            raise ValueError(msg)
+        problem = self.data["problem_ch"]
+        problem.set_pc_form(J_pc, schur)
+
+        # Default options
+        prefix = solver.ksp().getOptionsPrefix()
+        defaults = [
+            ("pc_fieldsplit_type", "schur"),
+            ("pc_fieldsplit_schur_fact_type", "lower"),
+            ("pc_fieldsplit_schur_precondition", "a11"),
+            ("fieldsplit_phi_ksp_type", "preonly"),
+            ("fieldsplit_phi_pc_type", "hypre"),
+            ("fieldsplit_phi_pc_hypre_type", "boomeramg"),
+            ("fieldsplit_chi_ksp_type", "preonly"),
+        ]
+        if not PETSc.Options().hasName(prefix + "fieldsplit_chi_pc_type"):
+            # NOTE: Approximation of the Schur complement can be provided
+            #       only when the operator is available
+            problem.init_pc = self._init_ch_schur_pc
+        _set_default_options(prefix, defaults)
+
+        # Define splitting by index sets
+        DS = self.data["model"].discretization_scheme()
+        pc = solver.ksp().getPC()
+        pc.setType(PETSc.PC.Type.FIELDSPLIT)
+        for var in ["phi", "chi"]:
+            pc.setFieldSplitIS((var, _dofs_is(DS, [var], pc.comm)))
+
+    def _init_ch_schur_pc(self, P):
+        """
+        Set up fieldsplit preconditioner for the CH preconditioner matrix
+        ``P`` and attach the approximation of the Schur complement to it.
+        """
+        DS = self.data["model"].discretization_scheme()
+        ksp = self.data["solver"]["CH"]["lin"].ksp()
+        prefix = ksp.getOptionsPrefix()
+        matP = as_backend_type(P).mat()
+        ksp.setOperators(matP) # operators are reset by the Newton solver
+        pc = ksp.getPC()
+        pc.setUp()
+        ksp_S = pc.getFieldSplitSubKSP()[1]
+        X, T = self.data["problem_ch"].schur_mats
+        ksp_S.pc.setType(PETSc.PC.Type.PYTHON)
+        ksp_S.pc.setPythonContext(_CHSchurPC(
+            X, T, _dofs_is(DS, ["chi"], pc.comm), prefix + "fieldsplit_chi_X_"))
+
     def solve(self):
         """
         Perform one solution step (in time).
         """
         begin("Cahn-Hilliard step")
-        self.iters["CH"][-1] = self.data["solver"]["CH"]["nln"].solve(
-            self.data["problem_ch"], self.data["sol_ch"].vector())[0]
+        self._apply_initial_guess("CH", self.data["sol_ch"].vector())
+        self.iters["CH"][-1] = self._newton_solve(
+            self.data["solver"]["CH"]["nln"], self.data["problem_ch"],
+            self.data["sol_ch"].vector())
         self.iters["CH"][0] += self.iters["CH"][-1]
+        self._store_history("CH", self.data["sol_ch"].vector())
         end()
 
         begin("Navier-Stokes step")
         # Update stabilization terms
         if self.data["model"].parameters["semi"]["sdstab"]:
-            self.data["model"]._update_sd_stab_parameter()
+            with phase(self._profiler, "assembly"):
+                self.data["model"]._update_sd_stab_parameter()
 
         pcd_assembler = self.data.get("pcd_assembler", None)
+        A, b = self.data["A_ns"], self.data["b_ns"]
+        first_assembly = A.empty()
         if pcd_assembler:
             # Symmetric assembly of the linear system
-            A, b = PETScMatrix(self.comm()), PETScVector(self.comm())
-            pcd_assembler.system_matrix(A)
-            pcd_assembler.rhs_vector(b)
+            with phase(self._profiler, "assembly"):
+                pcd_assembler.system_matrix(A)
+                pcd_assembler.rhs_vector(b)
         else:
             # Standard assembly of the linear system
-            A = assemble(self.data["forms"]["lin"]["lhs"])
-            b = assemble(self.data["forms"]["lin"]["rhs"])
-            for bc in self.data["bcs_ns"]:
-                bc.apply(A, b)
+            with phase(self._profiler, "assembly"):
+                assemble(self.data["forms"]["lin"]["lhs"], tensor=A)
+                assemble(self.data["forms"]["lin"]["rhs"], tensor=b)
+            with phase(self._profiler, "bcs"):
+                for bc in self.data["bcs_ns"]:
+                    bc.apply(A, b)
+        if first_assembly:
+            # Sparsity pattern is fixed from now on
+            as_backend_type(A).mat().setOption(
+                PETSc.Mat.Option.NEW_NONZERO_ALLOCATION_ERR, True)
 
         if self._flags["fix_p"]:
-            # Attach null space to PETSc matrix
-            as_backend_type(A).set_nullspace(self.data["null_space"])
+            if first_assembly:
+                # Attach null space to PETSc matrix
+                as_backend_type(A).set_nullspace(self.data["null_space"])
             # Orthogonalize RHS vector b with respect to the null space
             self.data["null_space"].orthogonalize(b)
 
         if pcd_assembler:
             # Symmetric assembly of the preconditioner
-            P = PETScMatrix(self.comm())
-            pcd_assembler.pc_matrix(P)
+            with phase(self._profiler, "assembly"):
+                P = self.data["P_ns"]
+                pcd_assembler.pc_matrix(P)
             # FIXME: Should we attach the null space also to preconditioner?
             #        Probably not as 'set_nullspace' is related to KSP (not PC).
             # if P.empty():
@@ -458,14 +1449,20 @@ class SemiDecoupled(Solver):
             self.data["solver"]["NS"].set_operator(A)
             # NOTE: Preconditioner matrix can't be set for LUSolver.
 
-        self.iters["NS"][-1] = \
-          self.data["solver"]["NS"].solve(self.data["sol_ns"].vector(), b)
+        ns_guess = self._flags.get("ns_guess", False)
+        if ns_guess:
+            self._apply_initial_guess("NS", self.data["sol_ns"].vector())
+        with phase(self._profiler, "solve"):
+            self.iters["NS"][-1] = \
+              self.data["solver"]["NS"].solve(self.data["sol_ns"].vector(), b)
         info("Navier-Stokes solver finished in {} iterations".format(self.iters["NS"][-1]))
         self.iters["NS"][0] += self.iters["NS"][-1]
 
         if self._flags["fix_p"]:
             self._calibrate_pressure(
                 self.data["sol_ns"], self.data["null_fcn"])
+        if ns_guess:
+            self._store_history("NS", self.data["sol_ns"].vector())
         end()
 
 # --- FullyDecoupled linear solver --------------------------------------------
@@ -474,6 +1471,51 @@ class FullyDecoupled(Solver):
     """
     This class implements linear solver for fully decoupled discretization
     scheme.
+
+    Linear systems are solved either by direct solvers (default) or by
+    preconditioned Krylov solvers, see the `table`__ below.
+
+    __ tab_fdprm_
+
+    .. _tab_fdprm:
+
+       ====================  =============  ===================================
+       FullyDecoupled        \              \
+       parameters
+       ------------------------------------------------------------------------
+       Option                Suboption      Description
+       ====================  =============  ===================================
+       ls                                   ``'direct'`` or ``'iterative'``
+       fuse_rhs                             assemble right hand sides for all
+                                            components of ``phi``, ``chi``
+                                            and ``v`` at once
+       --krylov
+       \                     .rtol          relative tolerance
+       \                     .atol          absolute tolerance
+       \                     .maxit         maximum number of iterations
+       \                     .pc            ``'amg'`` or ``'gmg'``
+       ====================  =============  ===================================
+
+    In the iterative mode, CG preconditioned by algebraic multigrid is used
+    for ``phi``, ``chi`` and ``p``, while GMRES with the same preconditioner
+    is used for velocity components (the matrix is not symmetric due to
+    application of Dirichlet BCs). Matrices are constant, hence the
+    preconditioners are set up only once. Each solver has its own PETSc
+    options prefix ``fd_<var>_``, so it can be further adjusted from the
+    command line (e.g. ``-fd_p_ksp_monitor``).
+
+    If ``krylov.pc`` is ``'gmg'`` and the discretization scheme keeps a
+    hierarchy of nested meshes (see :py:meth:`Discretization.set_coarse_meshes
+    <muflon.functions.discretization.Discretization.set_coarse_meshes>`),
+    then geometric multigrid is used instead of the algebraic one. Coarse
+    operators are obtained by Galerkin projection with the interpolation
+    matrices between the levels. Without the hierarchy a warning is issued
+    and the algebraic multigrid is used.
+
+    Right hand sides are assembled into preallocated vectors. If
+    ``fuse_rhs`` is ``True``, then the forms for individual components are
+    merged into a single vector-valued form, so that the coefficients shared
+    by all components are evaluated only once per cell.
     """
     class Factory(object):
         def create(self, *args, **kwargs):
@@ -490,17 +1532,137 @@ class FullyDecoupled(Solver):
         """
         super(FullyDecoupled, self).__init__(*args, **kwargs)
 
-        # Create solvers
-        solver = OrderedDict()
-        solver["phi"] = LUSolver("mumps")
-        solver["chi"] = LUSolver("mumps")
-        solver["v"]   = LUSolver("mumps")
-        solver["p"]   = LUSolver("mumps")
-        self.data["solver"] = solver
+        # Add parameters of linear solvers
+        self.parameters.add("ls", "direct")
+        self.parameters.add("fuse_rhs", False)
+        nested_prm = Parameters("krylov")
+        nested_prm.add("rtol", 1e-8)
+        nested_prm.add("atol", 1e-12)
+        nested_prm.add("maxit", 1000)
+        nested_prm.add("pc", "amg")
+        self.parameters.add(nested_prm)
+
+        # NOTE: Solvers are created during setup, one for each distinct
+        #       matrix, see FullyDecoupled._cached_solver
+        self.data["solver"] = OrderedDict()
 
         # Initialize flags
         self._flags["setup"] = False
 
+    @staticmethod
+    def _operator_key(form, bcs):
+        """
+        Returns key identifying the matrix obtained by the assembly of the
+        bilinear ``form`` and application of Dirichlet ``bcs``. Matrices with
+        equal keys are identical (values prescribed by the boundary conditions
+        do not matter, only the constrained DOFs do).
+
+        The signature of the form does not distinguish between coefficients
+        of the same type, hence the key contains also their identities.
+        """
+        key = [form.signature(), tuple(id(c) for c in form.coefficients())]
+        for bc in bcs:
+            args = tuple(a if isinstance(a, (int, str)) else id(a)
+                         for a in bc.domain_args)
+            key.append((args, bc.method()))
+        return tuple(key)
+
+    def _cached_solver(self, var, form, bcs=[]):
+        """
+        Assemble the matrix corresponding to ``form`` with applied ``bcs`` and
+        create a linear solver for it. Both the matrix and the solver are
+        cached, so they are shared among components with identical operators.
+        The operator is set only once, which means that the factorization
+        (or the preconditioner) is computed before the first solve and then
+        reused, see :py:meth:`_factorize`.
+
+        :param var: name of the variable (determines the type of iterative
+                    solver and its options prefix)
+        :type var: str
+        :returns: (matrix, solver)
+        :rtype: tuple
+        """
+        key = self._operator_key(form, bcs)
+        if key not in self._operators:
+            with phase(self._profiler, "assembly"):
+                A = assemble(form)
+                for bc in bcs:
+                    bc.apply(A)
+            if var == "p" and self._flags["fix_p"]:
+                # Attach null space to PETSc matrix
+                as_backend_type(A).set_nullspace(self.data["null_space"])
+            ls = self.parameters["ls"]
+            if ls == "direct":
+                solver = PETScLUSolver("mumps")
+                if "reuse_factorization" in solver.parameters.keys():
+                    solver.parameters["reuse_factorization"] = True
+            elif ls == "iterative":
+                solver = self._create_krylov_solver(var)
+            else:
+                msg = "Unknown type of linear solver '%s'," \
+                      " use 'direct' or 'iterative'" % ls
+                raise ValueError(msg)
+            solver.set_operator(A)
+            self._operators[key] = (A, solver)
+        return self._operators[key]
+
+    def _create_krylov_solver(self, var):
+        """
+        Create preconditioned Krylov solver for the variable ``var``.
+        """
+        prm = self.parameters["krylov"]
+        method = "gmres" if var == "v" else "cg"
+        DS = self.data["model"].discretization_scheme()
+        if prm["pc"] == "gmg" and len(DS.mesh_hierarchy()) > 1:
+            solver = PETScKrylovSolver(method)
+            solver.set_options_prefix("fd_%s_" % var)
+            if var == "p" and self._flags["fix_p"]:
+                # NOTE: Coarse Galerkin operator inherits the null space
+                _set_default_options("fd_p_", [
+                    ("mg_coarse_pc_factor_shift_type", "nonzero"),
+                    ("mg_coarse_redundant_pc_factor_shift_type", "nonzero"),
+                ])
+            self._setup_geometric_multigrid(solver, DS.transfer_matrices(var))
+        elif prm["pc"] in ["amg", "gmg"]:
+            if prm["pc"] == "gmg":
+                warning("No coarse meshes available, using algebraic"
+                        " multigrid instead of the geometric one for '%s'"
+                        % var)
+            pc = "hypre_amg"
+            if not has_krylov_solver_preconditioner(pc):
+                pc = "petsc_amg"
+            solver = PETScKrylovSolver(method, pc)
+            solver.set_options_prefix("fd_%s_" % var)
+        else:
+            msg = "Unknown preconditioner '%s'" % prm["pc"]
+            raise ValueError(msg)
+        solver.parameters["relative_tolerance"] = prm["rtol"]
+        solver.parameters["absolute_tolerance"] = prm["atol"]
+        solver.parameters["maximum_iterations"] = prm["maxit"]
+        solver.parameters["error_on_nonconvergence"] = True
+        # NOTE: Solution from the previous time step is a good initial guess
+        solver.parameters["nonzero_initial_guess"] = True
+        # NOTE: Matrices are constant, the preconditioner is set up only once
+        solver.set_reuse_preconditioner(True)
+        solver.set_from_options()
+        return solver
+
+    @staticmethod
+    def _setup_geometric_multigrid(solver, interpolations):
+        """
+        Set up PCMG preconditioner with given interpolation matrices.
+        """
+        ksp = solver.ksp()
+        _set_default_options(ksp.getOptionsPrefix(), [
+            ("pc_mg_galerkin", "both"),
+        ])
+        pc = ksp.getPC()
+        pc.setType(PETSc.PC.Type.MG)
+        pc.setMGLevels(len(interpolations) + 1)
+        pc.setMGType(PETSc.PC.MGType.MULTIPLICATIVE)
+        for (level, P) in enumerate(interpolations):
+            pc.setMGInterpolation(level + 1, as_backend_type(P).mat())
+
     def setup(self):
         """
         Pre-assemble time independent matrices, group right hand sides and
@@ -513,40 +1675,60 @@ class FullyDecoupled(Solver):
         n = len(pv["phi"]) # n = N - 1
         gdim = len(pv["v"])
 
+        # Preparation for tackling singular systems
+        if self._flags["fix_p"] and "null_space" not in self.data:
+            null_space, null_fcn = DS.build_pressure_null_space()
+            self.data["null_space"] = null_space
+            self.data["null_fcn"] = null_fcn
+
         _A   = OrderedDict(phi=[], chi=[], v=[])
         _rhs = OrderedDict(phi=[], chi=[], v=[])
         _sol = OrderedDict(phi=[], chi=[], v=[])
         _bcs = OrderedDict(sorted(six.iteritems(self.data["model"].bcs())))
+        solver = OrderedDict(phi=[], chi=[], v=[])
+        self._operators = {} # matrices and solvers for distinct operators
+        self._factorized = set() # solvers with factorized operators
         for i in range(n):
-            _A["phi"].append(assemble(eqn["lhs"][i]))
-            _A["chi"].append(assemble(eqn["lhs"][n+i]))
-            _rhs["phi"].append(eqn["rhs"][i])
-            _rhs["chi"].append(eqn["rhs"][n+i])
-            _sol["phi"].append(w[i])
-            _sol["chi"].append(w[n+i])
-        for i in range(gdim): # TODO: We know that A_v2 = A_v1
-            _A["v"].append(assemble(eqn["lhs"][2*n+i]))
+            for var, j in [("phi", i), ("chi", n+i)]:
+                A, lu = self._cached_solver(var, eqn["lhs"][j])
+                _A[var].append(A)
+                solver[var].append(lu)
+                _rhs[var].append(eqn["rhs"][j])
+                _sol[var].append(w[j])
+        for i in range(gdim):
+            # NOTE: Velocity components usually share the matrix
+            bcs = [bc[i] for bc in _bcs.get("v", []) if bc[i] is not None]
+            A, lu = self._cached_solver("v", eqn["lhs"][2*n+i], bcs)
+            _A["v"].append(A)
+            solver["v"].append(lu)
             _rhs["v"].append(eqn["rhs"][2*n+i])
             _sol["v"].append(w[2*n+i])
-            for bc in _bcs.get("v", []):
-                if bc[i] is not None:
-                    bc[i].apply(_A["v"][-1])
-        _A["p"] = assemble(eqn["lhs"][2*n+gdim])
-        for bc in _bcs.get("p", []):
-            bc.apply(_A["p"])
+        _A["p"], solver["p"] = self._cached_solver(
+            "p", eqn["lhs"][2*n+gdim], _bcs.get("p", []))
         _rhs["p"] = eqn["rhs"][2*n+gdim]
         _sol["p"] = w[2*n+gdim]
         # FIXME: Deal with possible bcs for ``phi`` and ``th``
 
-        # Preparation for tackling singular systems
-        if self._flags["fix_p"]:
-            null_space, null_fcn = DS.build_pressure_null_space()
-            self.data["null_space"] = null_space
-            self.data["null_fcn"] = null_fcn
-            # Attach null space to PETSc matrix
-            as_backend_type(_A["p"]).set_nullspace(null_space)
+        # Group components sharing the same solver (and operator)
+        groups = OrderedDict()
+        for var in ["phi", "chi", "v"]:
+            groups[var] = []
+            for i, lu in enumerate(solver[var]):
+                for group in groups[var]:
+                    if group[0] is lu:
+                        group[1].append(i)
+                        break
+                else:
+                    groups[var].append([lu, [i]])
+        self._block_mats = {} # dense matrices for multi-RHS solves
+
+        # Prepare assembly of right hand sides (forms remain the same)
+        if "rhs_assembly" not in self.data:
+            self._prepare_rhs_assembly(_rhs)
 
         # Store matrices + grouped right hand sides and solution functions
+        self.data["solver"] = solver
+        self.data["groups"] = groups
         self.data["A"]   = _A
         self.data["rhs"] = _rhs
         self.data["sol"] = _sol
@@ -554,30 +1736,157 @@ class FullyDecoupled(Solver):
 
         self._flags["setup"] = True
 
+    def update_time_step(self, OTD, dt):
+        """
+        Update the value of the time step and re-assemble matrices that
+        depend on it (if they have been already pre-assembled).
+        """
+        super(FullyDecoupled, self).update_time_step(OTD, dt)
+        if self._flags["setup"]:
+            self.setup()
+
+    def _prepare_rhs_assembly(self, rhs_forms):
+        """
+        Precompile forms representing right hand sides and allocate vectors
+        for their assembly.
+        """
+        data = OrderedDict()
+        for var in ["phi", "chi", "v", "p"]:
+            forms = rhs_forms[var] if var != "p" else [rhs_forms[var]]
+            if self.parameters["fuse_rhs"] and len(forms) > 1:
+                data[var] = self._fused_rhs(forms)
+            else:
+                data[var] = {
+                    "forms": [Form(f) for f in forms],
+                    "vecs": [PETScVector(self.comm()) for f in forms]
+                }
+        self.data["rhs_assembly"] = data
+
+    def _fused_rhs(self, forms):
+        """
+        Merge linear ``forms`` defined on identical scalar spaces into
+        a single form with a vector-valued test function.
+        """
+        DS = self.data["model"].discretization_scheme()
+        spaces = [f.arguments()[0].function_space() for f in forms]
+        el = spaces[0].ufl_element()
+        el = VectorElement(el.family(), el.cell(), el.degree(), dim=len(forms))
+        V = FunctionSpace(DS.mesh(), el,
+                          constrained_domain=DS.constrained_domain())
+        q = TestFunction(V)
+        fused = reduce(lambda f0, f1: f0 + f1,
+            [replace(f, {f.arguments()[0]: q[i]}) for i, f in enumerate(forms)])
+        parts = [Function(V_i) for V_i in spaces]
+        return {
+            "fused": Form(fused),
+            "f_vec": Function(V),
+            "parts": parts,
+            "assigner": FunctionAssigner(spaces, V)
+        }
+
+    def _assemble_rhs(self, var):
+        """
+        Assemble right hand sides for all components of variable ``var``.
+
+        :returns: list of assembled vectors
+        :rtype: list
+        """
+        item = self.data["rhs_assembly"][var]
+        if "fused" in item:
+            assemble(item["fused"], tensor=item["f_vec"].vector())
+            item["assigner"].assign(item["parts"], item["f_vec"])
+            return [f.vector() for f in item["parts"]]
+        for (form, b) in zip(item["forms"], item["vecs"]):
+            assemble(form, tensor=b)
+        return item["vecs"]
+
+    def _solve_components(self, var, b):
+        """
+        Solve systems for all components of variable ``var`` with right hand
+        sides ``b``. Components sharing the same operator are solved together
+        as a single multi-RHS block solve (if possible).
+        """
+        sol = self.data["sol"][var]
+        for (lu, indices) in self.data["groups"][var]:
+            self._factorize(lu)
+            if (len(indices) > 1 and isinstance(lu, PETScLUSolver)
+                  and self._flags.get("block_solve", True)):
+                x_block = [sol[i].vector() for i in indices]
+                b_block = [b[i] for i in indices]
+                try:
+                    self._block_solve(lu, x_block, b_block)
+                    continue
+                except PETSc.Error:
+                    warning("Multi-RHS solve failed, switching to solves"
+                            " with single right hand sides")
+                    self._flags["block_solve"] = False
+            for i in indices:
+                lu.solve(sol[i].vector(), b[i])
+
+    def _factorize(self, lu):
+        """
+        Compute the factorization of the operator of the direct solver ``lu``
+        (or set up the preconditioner of an iterative solver) if it has not
+        been done yet. The time spent in this phase is profiled separately
+        from the subsequent solves.
+        """
+        if id(lu) in self._factorized:
+            return
+        with phase(self._profiler, "factorization"):
+            lu.ksp().setUp()
+        self._factorized.add(id(lu))
+
+    def _block_solve(self, lu, x, b):
+        """
+        Solve systems with multiple right hand sides ``b`` using
+        the factorization computed by the direct solver ``lu``.
+        """
+        F = lu.ksp().getPC().getFactorMatrix()
+        b_vecs = [as_backend_type(b_i).vec() for b_i in b]
+        key = (id(lu), len(b))
+        if key not in self._block_mats:
+            sizes = (b_vecs[0].getSizes(), (PETSc.DECIDE, len(b)))
+            B = PETSc.Mat().createDense(sizes, comm=b_vecs[0].getComm())
+            B.setUp()
+            self._block_mats[key] = (B, B.duplicate())
+        B, X = self._block_mats[key]
+        B_array = B.getDenseArray()
+        for (j, b_vec) in enumerate(b_vecs):
+            B_array[:, j] = b_vec.getArray(readonly=True)
+        B.assemble()
+        F.matSolve(B, X)
+        X_array = X.getDenseArray()
+        for (j, x_j) in enumerate(x):
+            as_backend_type(x_j).vec().setArray(X_array[:, j])
+            x_j.apply("insert")
+
     def solve(self):
         """
         Perform one solution step (in time).
         """
         solver = self.data["solver"]
+        profiler = self._profiler
         begin("Advance-phase")
-        for i, A in enumerate(self.data["A"]["chi"]):
-            b = assemble(self.data["rhs"]["chi"][i])
-            solver["chi"].solve(A, self.data["sol"]["chi"][i].vector(), b)
-        for i, A in enumerate(self.data["A"]["phi"]):
-            b = assemble(self.data["rhs"]["phi"][i])
-            solver["phi"].solve(A, self.data["sol"]["phi"][i].vector(), b)
+        for var in ["chi", "phi"]: # NOTE: rhs for 'phi' depends on 'chi'
+            with phase(profiler, "assembly"):
+                b = self._assemble_rhs(var)
+            with phase(profiler, "solve"):
+                self._solve_components(var, b)
         end()
 
         begin("Pressure step")
-        b = assemble(self.data["rhs"]["p"])
-        for bc in self.data["bcs"].get("p", []):
-            bc.apply(b)
+        with phase(profiler, "assembly"):
+            b = self._assemble_rhs("p")[0]
+        with phase(profiler, "bcs"):
+            for bc in self.data["bcs"].get("p", []):
+                bc.apply(b)
         if self._flags["fix_p"]:
             # Orthogonalize RHS vector b with respect to the null space
             self.data["null_space"].orthogonalize(b)
 
-        solver["p"].solve(
-            self.data["A"]["p"], self.data["sol"]["p"].vector(), b)
+        with phase(profiler, "solve"):
+            self._factorize(solver["p"])
+            solver["p"].solve(self.data["sol"]["p"].vector(), b)
 
         if self._flags["fix_p"]:
             self._calibrate_pressure(
@@ -585,11 +1894,14 @@ class FullyDecoupled(Solver):
         end()
 
         begin("Velocity step")
-        for i, A in enumerate(self.data["A"]["v"]):
-            b = assemble(self.data["rhs"]["v"][i])
-            # FIXME: How to apply bcs in a symmetric fashion?
+        with phase(profiler, "assembly"):
+            b = self._assemble_rhs("v")
+        # FIXME: How to apply bcs in a symmetric fashion?
+        with phase(profiler, "bcs"):
             for bc in self.data["bcs"].get("v", []):
-                if bc[i] is not None:
-                    bc[i].apply(b)
-            solver["v"].solve(A, self.data["sol"]["v"][i].vector(), b)
+                for i, b_i in enumerate(b):
+                    if bc[i] is not None:
+                        bc[i].apply(b_i)
+        with phase(profiler, "solve"):
+            self._solve_components("v", b)
         end()
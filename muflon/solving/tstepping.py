@@ -23,14 +23,20 @@ This module provides various time-stepping algorithms.
 
 import os
 import six
+import glob
+import time
 import collections
 
-from dolfin import info, begin, end, near, Timer, Parameters
-from dolfin import GenericLinearSolver
+import numpy as np
+
+from dolfin import info, begin, end, near, warning, Timer, Parameters
+from dolfin import GenericLinearSolver, HDF5File, MPI
+from dolfin import Form, Function, assemble, inner, dx
 
 from muflon.common.boilerplate import not_implemented_msg
 from muflon.log.loggers import MuflonLogger
-from muflon.io.writers import XDMFWriter
+from muflon.log.profilers import MuflonProfiler, phase
+from muflon.io.writers import XDMFWriter, AsyncXDMFWriter, HDF5Writer
 from muflon.solving.solvers import Solver
 
 # FIXME: remove the following workaround
@@ -62,6 +68,7 @@ class TimeSteppingFactory(object):
         Currently implemented algorithms:
 
         * :py:class:`ConstantTimeStep`
+        * :py:class:`AdaptiveTimeStep`
 
         :param algorithm: name of a specific algorithm
         :type algorithm: str
@@ -92,6 +99,24 @@ class TSHook(object):
     def tail(self, t, it, logger):
         pass # do nothing by default
 
+    def rebuild(self, DS):
+        """
+        Create a new solver for the discretization scheme ``DS`` that lives
+        on an adapted mesh. The method is called by time-stepping algorithms
+        if the parameter ``remesh.modulo`` is positive. Model, boundary
+        conditions and forms must be recreated on the new scheme.
+
+        :param DS: discretization scheme with transferred solution functions
+        :type DS: :py:class:`Discretization
+                  <muflon.functions.discretization.Discretization>`
+        :returns: pair of a new solver and a list of fields that replace the
+                  fields registered for XDMF output (``None`` stops the
+                  output)
+        :rtype: tuple
+        """
+        msg = "Override this method to enable mesh adaptivity."
+        not_implemented_msg(self, msg)
+
 class TimeStepping(object):
     """
     This class provides a generic interface for time-stepping algorithms.
@@ -143,6 +168,9 @@ class TimeStepping(object):
             logfile = os.path.join(outdir, logfile)
         self._logger = MuflonLogger(comm, logfile)
 
+        # Profiler is created on demand
+        self._profiler = None
+
     @staticmethod
     def _init_parameters():
         """
@@ -159,7 +187,41 @@ class TimeStepping(object):
            \                     .flush         flush output of XDMF files
            \                     .modulo        modulo for saving results
            \                     .iconds        whether to save initial conditions
+           \                     .async         write XDMF files in background
+           \                     .queue_size    max. number of pending snapshots
+           --checkpoint
+           \                     .folder        name of the folder for HDF5 files
+           \                     .modulo        modulo for saving checkpoints
+                                                (0 = no checkpoints)
+           --walltime
+           \                     .budget        wall-clock budget in seconds
+                                                (0 = unlimited)
+           \                     .window        number of steps for averaging
+           \                     .safety        safety factor for the estimate
+           --profiling
+           \                     .enabled       measure time spent in phases
+           \                     .filename      name of the file for profiles
+           --steady
+           \                     .tol           tolerance for relative increments
+                                                (0 = no steady-state detection)
+           \                     .window        number of steps below tolerance
+           \                     .fields        monitored primitive variables
+           --rollback
+           \                     .enabled       repeat time steps that failed
+           \                     .max_retries   max. number of repetitions
+           \                     .subdivision   reduction factor of time step
+           --remesh
+           \                     .modulo        modulo for adapting the mesh
+                                                (0 = fixed mesh)
+           \                     .levels        number of refinement steps
+           \                     .tol           threshold for the variation
+                                                of order parameters in a cell
+           \                     .imbalance     admissible ratio of the max.
+                                                and avg. number of local cells
+                                                (0 = no repartitioning)
            ====================  =============  ===================================
+
+        Mesh adaptivity is described in :py:meth:`_adapt_mesh`.
         """
         prm = Parameters("time-stepping")
 
@@ -168,8 +230,45 @@ class TimeStepping(object):
         nested_prm.add("flush", False)
         nested_prm.add("modulo", 1)
         nested_prm.add("iconds", True)
+        nested_prm.add("async", False)
+        nested_prm.add("queue_size", 2)
+        prm.add(nested_prm)
+
+        nested_prm = Parameters("checkpoint")
+        nested_prm.add("folder", "HDF5data")
+        nested_prm.add("modulo", 0)
+        prm.add(nested_prm)
+
+        nested_prm = Parameters("walltime")
+        nested_prm.add("budget", 0.0)
+        nested_prm.add("window", 5)
+        nested_prm.add("safety", 1.5)
+        prm.add(nested_prm)
+
+        nested_prm = Parameters("profiling")
+        nested_prm.add("enabled", False)
+        nested_prm.add("filename", "profile.dat")
+        prm.add(nested_prm)
+
+        nested_prm = Parameters("steady")
+        nested_prm.add("tol", 0.0)
+        nested_prm.add("window", 3)
+        nested_prm.add("fields", "phi v")
+        prm.add(nested_prm)
 
+        nested_prm = Parameters("rollback")
+        nested_prm.add("enabled", False)
+        nested_prm.add("max_retries", 3)
+        nested_prm.add("subdivision", 2)
         prm.add(nested_prm)
+
+        nested_prm = Parameters("remesh")
+        nested_prm.add("modulo", 0)
+        nested_prm.add("levels", 2)
+        nested_prm.add("tol", 0.1)
+        nested_prm.add("imbalance", 1.2)
+        prm.add(nested_prm)
+
         return prm
 
     def mpi_comm(self):
@@ -207,6 +306,7 @@ class TimeStepping(object):
         Currently implemented algorithms:
 
         * :py:class:`ConstantTimeStep`
+        * :py:class:`AdaptiveTimeStep`
 
         :param t_beg: beginning time of the algorithm
         :type t_beg: float
@@ -220,18 +320,284 @@ class TimeStepping(object):
         :type it: int
         :returns: dictionary with results of the computation
         :rtype: dict
+
+        If the parameter ``walltime.budget`` is positive, then the computation
+        is stopped as soon as the estimated wall-clock time of the next step
+        (moving average of the solution time per step multiplied by
+        ``walltime.safety``) would exceed the budget counted from the call of
+        this method. In such a case the checkpoint is saved and the returned
+        dictionary contains ``resume = True`` together with the time ``t``
+        that has been reached. (The computation can be resumed using
+        :py:meth:`load_checkpoint`.)
         """
+        self._walltime_start = time.time()
+        self._solve_times = collections.deque(
+            maxlen=self.parameters["walltime"]["window"])
         if self._xfields and not hasattr(self, "_xdmf_writer"):
             # create xdmf writer for given fields
             xfolder = os.path.join(self._outdir,
                                    self.parameters["xdmf"]["folder"])
             xflush = self.parameters["xdmf"]["flush"]
-            self._xdmf_writer = XDMFWriter(self._comm, xfolder,
-                                           self._xfields, xflush)
+            if self.parameters["xdmf"]["async"]:
+                self._xdmf_writer = AsyncXDMFWriter(
+                    self._comm, xfolder, self._xfields, xflush,
+                    self.parameters["xdmf"]["queue_size"])
+            else:
+                self._xdmf_writer = XDMFWriter(self._comm, xfolder,
+                                               self._xfields, xflush)
             if self.parameters["xdmf"]["iconds"] and it == 0:
                 self._xdmf_writer.write(t_beg)
+        if ((self.parameters["checkpoint"]["modulo"] > 0
+               or self.parameters["walltime"]["budget"] > 0.0)
+              and not hasattr(self, "_hdf5_writer")):
+            # create hdf5 writer for all solution functions
+            self._hdf5_writer = HDF5Writer(self._comm,
+                                           self._checkpoint_folder(),
+                                           self._snapshot_functions())
+        if (self.parameters["profiling"]["enabled"]
+              and self._profiler is None):
+            # create profiler and register it in the solver
+            pfile = os.path.join(self._outdir,
+                                 self.parameters["profiling"]["filename"])
+            self._profiler = MuflonProfiler(self._comm, pfile)
+            self._solver.set_profiler(self._profiler)
         return self._tstepping_loop(t_beg, t_end, dt, OTD, it)
 
+    def profiler(self):
+        """
+        Returns profiler collecting time spent in individual phases of time
+        steps (``None`` if profiling is switched off).
+
+        :returns: profiler
+        :rtype: :py:class:`MuflonProfiler <muflon.log.profilers.MuflonProfiler>`
+        """
+        return self._profiler
+
+    def _begin_step(self):
+        if self._profiler is not None:
+            self._profiler.begin_step()
+
+    def _end_step(self, t, it):
+        if self._profiler is not None:
+            iters = getattr(self._solver, "iters", None)
+            self._profiler.end_step(t, it, iters)
+
+    def load_checkpoint(self):
+        """
+        Restore solution functions from the latest checkpoint saved in the
+        folder specified by the parameter ``checkpoint.folder``.
+
+        Returned values can be used to continue the computation:
+
+        .. code-block:: python
+
+          # let 'TS' is an instance of a time-stepping algorithm
+          chkp = TS.load_checkpoint()
+          TS.run(chkp["t"], t_end, chkp["dt"], OTD, it=chkp["it"])
+
+        :returns: dictionary with time ``t``, iteration number ``it``, time
+                  step ``dt`` and other metadata saved with the checkpoint
+        :rtype: dict
+        """
+        DS = self._solver.data["model"].discretization_scheme()
+        sol_ctl = DS.solution_ctl()
+        sol_ptl = DS.solution_ptl()
+        prefix = self._checkpoint_folder() + os.path.sep
+
+        # Find times for which all files are available
+        def _times(w):
+            files = glob.glob(prefix + w.name() + "_*.h5")
+            return set(f[len(prefix + w.name()) + 1:-3] for f in files)
+        functions = self._snapshot_functions()
+        times = _times(functions[0])
+        for w in functions[1:]:
+            times = times.intersection(_times(w))
+        if not times:
+            raise RuntimeError("No checkpoint found in '%s'" % prefix)
+        tstr = max(times, key=float)
+
+        # Load data
+        fname = lambda w: prefix + w.name() + "_" + tstr + ".h5"
+        filenames = [[fname(w) for w in sol] for sol in sol_ptl]
+        DS.load_ic_from_file(filenames, [fname(w) for w in sol_ctl])
+        hdf5_file = HDF5File(self._comm, fname(sol_ctl[0]), "r")
+        attr = hdf5_file.attributes(sol_ctl[0].name())
+        result = dict((key, attr[key]) for key in attr.list_attributes())
+        result["it"] = int(result["it"])
+        hdf5_file.close()
+        info("Loaded checkpoint at t = %g, step = %g"
+             % (result["t"], result["it"]))
+
+        return result
+
+    def _checkpoint_folder(self):
+        return os.path.join(self._outdir,
+                            self.parameters["checkpoint"]["folder"])
+
+    def _save_checkpoint(self, t, it, dt, force=False,
+                         metadata={}, functions=[]):
+        """
+        Save all solution functions together with ``it`` and ``dt`` if
+        required by the parameter ``checkpoint.modulo`` or if ``force`` is
+        ``True``. Additional ``metadata`` and ``functions`` needed to resume
+        the algorithm are saved as well.
+        """
+        modulo = self.parameters["checkpoint"]["modulo"]
+        if force or (modulo > 0 and it % modulo == 0):
+            if getattr(self, "_last_checkpoint", None) == it:
+                return # already saved
+            attrs = {"it": it, "dt": float(dt)}
+            attrs.update(metadata)
+            with phase(self._profiler, "io"):
+                self._hdf5_writer.write(t, attrs, functions)
+            self._last_checkpoint = it
+
+    def _prepare_steady_monitor(self):
+        """
+        Prepare forms for monitoring relative increments of primitive
+        variables listed (space separated) in the parameter ``steady.fields``.
+        """
+        self._steady_count = 0
+        self._steady_increment = None
+        self._steady_forms = []
+        if not self.parameters["steady"]["tol"] > 0.0:
+            return
+        DS = self._solver.data["model"].discretization_scheme()
+        pv = DS.primitive_vars_ctl(indexed=True)
+        pv0 = DS.primitive_vars_ptl(0, indexed=True)
+        for var in self.parameters["steady"]["fields"].split():
+            if var not in pv:
+                raise ValueError("Cannot monitor unknown variable '%s'" % var)
+            inc = pv[var] - pv0[var]
+            self._steady_forms.append((Form(inner(inc, inc)*dx),
+                                       Form(inner(pv[var], pv[var])*dx)))
+
+    def _steady_state_reached(self, t):
+        """
+        Compute relative increments (in the :math:`L^2` norm) of monitored
+        variables between the current and the closest previous time level.
+        Steady state is reached if the maximal increment stays below the
+        tolerance ``steady.tol`` for ``steady.window`` consecutive steps.
+
+        (This method must be called before the solution is shifted to
+        previous time levels.)
+
+        :param t: time
+        :type t: float
+        :returns: ``True`` if steady state has been reached
+        :rtype: bool
+        """
+        if not self._steady_forms:
+            return False
+        prm = self.parameters["steady"]
+        increment = 0.0
+        for (form_inc, form_norm) in self._steady_forms:
+            inc = assemble(form_inc)**0.5
+            norm = assemble(form_norm)**0.5
+            increment = max(increment, inc/norm if norm > 0.0 else inc)
+        self._steady_increment = increment
+        self._logger.info("relative increment = %g",
+                          (increment,), ("increment",), t)
+        if increment < prm["tol"]:
+            self._steady_count += 1
+        else:
+            self._steady_count = 0
+        return self._steady_count >= prm["window"]
+
+    def _walltime_exceeded(self, tmr_solve):
+        """
+        Decide whether the next time step would exceed the wall-clock budget
+        given by the parameter ``walltime.budget``.
+
+        :param tmr_solve: timer used to measure the last solution time
+        :type tmr_solve: :py:class:`dolfin.Timer`
+        :returns: ``True`` if the computation should be stopped
+        :rtype: bool
+        """
+        prm = self.parameters["walltime"]
+        if not prm["budget"] > 0.0:
+            return False
+        self._solve_times.append(tmr_solve.elapsed()[0])
+        average = sum(self._solve_times)/len(self._solve_times)
+        elapsed = time.time() - self._walltime_start
+        # NOTE: All processes must agree on the decision
+        average = MPI.max(self._comm, average)
+        elapsed = MPI.max(self._comm, elapsed)
+        return elapsed + prm["safety"]*average > prm["budget"]
+
+    def _adapt_mesh(self, t, it, OTD, dt):
+        """
+        Adapt the mesh to the current position of the interface if required
+        by the parameter ``remesh.modulo``.
+
+        The new mesh is obtained by local refinement of the mesh that has
+        been used at the beginning of the computation, see
+        :py:meth:`Discretization.adapt_to_interface
+        <muflon.functions.discretization.Discretization.adapt_to_interface>`.
+        Solution functions are transferred to the new mesh and the new solver
+        is obtained from :py:meth:`TSHook.rebuild`. Writers are redirected to
+        the new functions, see :py:meth:`XDMFWriter.replace_fields
+        <muflon.io.writers.XDMFWriter.replace_fields>`. (Checkpoints saved
+        after the adaptation can be loaded only on the adapted mesh.)
+
+        The mesh is repartitioned if the refinement makes the distribution
+        of cells among processes worse than allowed by ``remesh.imbalance``.
+        Resulting imbalance of DOFs and cells is reported by the logger.
+
+        (This method must be called after the solution has been shifted to
+        previous time levels.)
+
+        :param t: time
+        :type t: float
+        :param it: iteration number
+        :type it: int
+        :param OTD: order of time discretization
+        :type OTD: int
+        :param dt: time step
+        :type dt: float
+        :returns: ``True`` if the mesh has been adapted
+        :rtype: bool
+        """
+        prm = self.parameters["remesh"]
+        if not (prm["modulo"] > 0 and it % prm["modulo"] == 0):
+            return False
+        if self._hook is None:
+            raise RuntimeError("Mesh adaptivity requires a hook"
+                               " implementing 'TSHook.rebuild'")
+        with phase(self._profiler, "remesh"):
+            DS = self._solver.data["model"].discretization_scheme()
+            if not hasattr(self, "_base_mesh"):
+                self._base_mesh = DS.mesh()
+            DS = DS.adapt_to_interface(self._base_mesh, prm["levels"],
+                                       prm["tol"], prm["imbalance"])
+            info("Mesh adapted to the interface (%g cells)"
+                 % MPI.sum(self._comm, DS.mesh().num_cells()))
+            imbalance = DS.load_imbalance()
+            self._logger.info("load imbalance: dofs = %g, cells = %g",
+                              (imbalance["dofs"], imbalance["cells"]),
+                              ("imbalance_dofs", "imbalance_cells"), t)
+            self._solver, xfields = self._hook.rebuild(DS)
+            model = self._solver.data["model"]
+            model.update_TD_factors(OTD, dt)
+            model.update_time_step_value(dt)
+            self._solver.setup()
+            if self._profiler is not None:
+                self._solver.set_profiler(self._profiler)
+
+            # Redirect output and release data bound to the original mesh
+            if xfields is None and hasattr(self, "_xdmf_writer"):
+                self._xdmf_writer.close()
+                del self._xdmf_writer
+            elif hasattr(self, "_xdmf_writer"):
+                self._xdmf_writer.replace_fields(xfields)
+            self._xfields = xfields
+            if hasattr(self, "_hdf5_writer"):
+                self._hdf5_writer.replace_fields(self._snapshot_functions())
+            if hasattr(self, "_snapshot"):
+                del self._snapshot
+            self._prepare_steady_monitor()
+        return True
+
     def _tstepping_loop(self, *args, **kwargs):
         """
         An abstract method.
@@ -248,11 +614,114 @@ class TimeStepping(object):
         """
         return self._logger
 
+    def _update_ptl(self):
+        """
+        Shift solution functions to previous time levels.
+        """
+        DS = self._solver.data["model"].discretization_scheme()
+        with phase(self._profiler, "ptl"):
+            DS.update_ptl() # t^(n-k) <-- t^(n-k+1), t^(n-0) <-- t^(n+1)
+
+    def _snapshot_functions(self):
+        """
+        Returns list of functions that are stored in the in-memory snapshot,
+        i.e. solution functions at the current as well as at all previous
+        time levels.
+        """
+        DS = self._solver.data["model"].discretization_scheme()
+        functions = list(DS.solution_ctl())
+        for sol in DS.solution_ptl():
+            functions += list(sol)
+        return functions
+
+    def _take_snapshot(self):
+        """
+        Store current state of solution functions in memory. Vectors for the
+        snapshot are allocated only once and then overwritten in place.
+        """
+        functions = self._snapshot_functions()
+        if not hasattr(self, "_snapshot"):
+            self._snapshot = [w.vector().copy() for w in functions]
+            return
+        for (s, w) in zip(self._snapshot, functions):
+            s.zero()
+            s.axpy(1.0, w.vector())
+
+    def _restore_snapshot(self):
+        """
+        Restore solution functions from the last snapshot.
+        """
+        for (s, w) in zip(self._snapshot, self._snapshot_functions()):
+            w.vector().zero()
+            w.vector().axpy(1.0, s)
+
+    def _try_solve(self):
+        """
+        Solve the system for a single time step. If rollback is enabled, then
+        failure of the solver (indicated by :py:class:`RuntimeError`) is
+        caught and solution functions are restored from the snapshot that was
+        taken right before the solution.
+
+        :returns: ``True`` if the solver succeeded, ``False`` otherwise
+        :rtype: bool
+        """
+        if not self.parameters["rollback"]["enabled"]:
+            self._solver.solve()
+            return True
+        self._take_snapshot()
+        try:
+            self._solver.solve()
+        except RuntimeError as err:
+            warning("Solver failed, restoring solution from snapshot (%s)"
+                    % str(err).strip().split("\n")[-1])
+            self._restore_snapshot()
+            return False
+        return True
+
+    def _solve_with_rollback(self, dt, OTD, retries=0):
+        """
+        Solve the system for a single time step. If the solver fails and
+        rollback is enabled, then the state is restored and the step is
+        repeated as a sequence of substeps with a smaller time step.
+
+        :param dt: time step
+        :type dt: float
+        :param OTD: order of time discretization
+        :type OTD: int
+        :param retries: number of previous attempts
+        :type retries: int
+        """
+        if self._try_solve():
+            return
+        prm = self.parameters["rollback"]
+        if retries >= prm["max_retries"]:
+            raise RuntimeError("Solver failed for %g consecutive attempts"
+                               " (last time step dt = %g)" % (retries + 1, dt))
+        n = prm["subdivision"]
+        info("Repeating the step as %g substeps with dt = %g" % (n, dt/n))
+        self._solver.update_time_step(OTD, dt/n)
+        for j in range(n):
+            self._solve_with_rollback(dt/n, OTD, retries + 1)
+            if j < n - 1:
+                self._update_ptl()
+        self._solver.update_time_step(OTD, dt)
+
 # --- Algorithms with constant time step --------------------------------------
 
 class ConstantTimeStep(TimeStepping):
     """
     This class implements time-stepping algorithms with constant time step.
+
+    If the parameter ``rollback.enabled`` is set to ``True``, then a time step
+    for which the solver failed is repeated (starting from the in-memory
+    snapshot of the last good state) as a sequence of substeps with a smaller
+    time step. Boundary conditions and other data updated within
+    :py:meth:`TSHook.head` are kept fixed during the substeps.
+
+    If the parameter ``remesh.modulo`` is positive, then the mesh is adapted
+    to the interface every ``remesh.modulo`` steps and the computation
+    continues with the solver returned by :py:meth:`TSHook.rebuild`, see
+    :py:meth:`TimeStepping._adapt_mesh`.
     """
     class Factory(object):
         def create(self, *args, **kwargs):
@@ -262,18 +731,28 @@ class ConstantTimeStep(TimeStepping):
         """
         Run time-stepping algorithm.
 
-        .. todo::
+        Stationary problems can be solved in two ways:
 
-            Explain what is the adequate setup for stationary problems.
-            (``dt = 0`` and ``t_end > t_beg``)
+        * Call the method with ``dt = 0`` and ``t_end > t_beg``. Time
+          derivatives then vanish from the forms and the stationary problem
+          is solved just once (nonlinear solver must converge from the
+          initial conditions).
+        * Use pseudo-transient continuation with ``dt > 0`` and a positive
+          value of the parameter ``steady.tol``. The computation is then
+          terminated as soon as the monitored variables stop changing,
+          see :py:meth:`TimeStepping._steady_state_reached`. The returned
+          dictionary contains the flag ``steady`` and the last relative
+          ``increment``.
         """
         prm = self.parameters
         logger = self._logger
         solver = self._solver
         model = solver.data["model"]
-        sol_ptl = model.discretization_scheme().solution_ptl()
 
         t = t_beg
+        resume = False
+        steady = False
+        self._prepare_steady_monitor()
         model.update_TD_factors(OTD, dt)
         model.update_time_step_value(dt)
         solver.setup()
@@ -281,40 +760,65 @@ class ConstantTimeStep(TimeStepping):
             # Move to the current time level
             t += dt                   # update time
             it += 1                   # update iteration number
+            self._begin_step()
 
             # User defined instructions
             if self._hook is not None:
-                self._hook.head(t, it, logger)
+                with phase(self._profiler, "hook"):
+                    self._hook.head(t, it, logger)
 
             # Solve
             info("t = %g, step = %g, dt = %g" % (t, it, dt))
             with Timer("Solve (per time step)") as tmr_solve:
-                solver.solve()
+                if dt > 0:
+                    self._solve_with_rollback(dt, OTD)
+                else:
+                    solver.solve()
 
             # User defined instructions
             if self._hook is not None:
-                self._hook.tail(t, it, logger)
+                with phase(self._profiler, "hook"):
+                    self._hook.tail(t, it, logger)
 
             # Save results
             if it % prm["xdmf"]["modulo"] == 0:
                 if hasattr(self, "_xdmf_writer"):
-                    self._xdmf_writer.write(t)
+                    with phase(self._profiler, "io"):
+                        self._xdmf_writer.write(t)
+
+            # Check whether the solution still changes
+            if dt > 0:
+                steady = self._steady_state_reached(t)
 
             # Update variables at previous time levels
             if dt > 0:
-                L = len(sol_ptl)
-                for k in reversed(range(1, L)): # k goes from L-1 to 1
-                    for (i, w) in enumerate(sol_ptl[k-1]):
-                        sol_ptl[k][i].assign(w) # t^(n-k) <-- t^(n-k+1)
-                for (i, w) in enumerate(solver.solution_ctl()):
-                    sol_ptl[0][i].assign(w) # t^(n-0) <-- t^(n+1)
-            else:
+                self._update_ptl()
+                self._save_checkpoint(t, it, dt)
+                if self._adapt_mesh(t, it, OTD, dt):
+                    solver = self._solver
+            self._end_step(t, it)
+            if not dt > 0:
                 # NOTE:
                 #   dt = 0 indicates that a stationary problem is being solved
                 break
+            if steady:
+                info("Steady state reached at t = %g" % t)
+                break
 
-        # Flush output from logger
+            # Stop if we are running out of time
+            if (t < t_end and not near(t, t_end, 0.1*dt)
+                  and self._walltime_exceeded(tmr_solve)):
+                info("Wall-clock budget exhausted, stopping at t = %g" % t)
+                self._save_checkpoint(t, it, dt, force=True)
+                resume = True
+                break
+
+        # Flush output from logger, profiler and writer
         self._logger.dump_to_file()
+        if self._profiler is not None:
+            self._profiler.dump_to_file()
+        if hasattr(self, "_xdmf_writer"):
+            self._xdmf_writer.flush()
 
         # Refresh solver for further use
         solver.refresh()
@@ -322,8 +826,422 @@ class ConstantTimeStep(TimeStepping):
         result = {
             "dt": dt,
             "it": it,
+            "t": t,
             "t_end": t_end,
+            "resume": resume,
+            "steady": steady,
+            "increment": self._steady_increment,
             "tmr_solve": tmr_solve.elapsed()[0]
         }
 
         return result
+
+# --- Algorithms with adaptive time step --------------------------------------
+
+class AdaptiveTimeStep(TimeStepping):
+    """
+    This class implements time-stepping algorithms with adaptive time step.
+
+    The time step is controlled by an estimate of the local truncation error
+    and by the CFL condition. The error is estimated as the difference between
+    the solution computed at the current time level and its linear
+    extrapolation from previous time levels. Only the order parameters
+    ``phi`` and the velocity ``v`` enter the estimate, ``chi`` and ``p``
+    are determined by them. Steps with the (scaled) error estimate greater
+    than one are rejected and repeated with a smaller time step. The same
+    happens if rollback is enabled and the solver fails. The CFL condition
+    bounds the time step by the ratio of the minimal cell size and the
+    maximal magnitude of the velocity.
+
+    Each change of the time step invalidates everything the solver keeps
+    for the old value (e.g. the :py:class:`FullyDecoupled
+    <muflon.solving.solvers.FullyDecoupled>` solver reassembles and
+    refactorizes its matrices), hence the proposed time step is accepted
+    only if it is smaller than the current one, or greater at least by the
+    factor ``min_increase``.
+
+    The value of ``dt`` passed to :py:meth:`TimeStepping.run` is used as the
+    initial time step. See the `table`__ below for parameters that control
+    the adaptivity.
+
+    __ tab_adaptprm_
+
+    .. warning::
+
+      Time discretization factors of the :py:class:`FullyDecoupled
+      <muflon.functions.discretization.FullyDecoupled>` scheme used with
+      ``OTD = 2`` are derived for a constant time step.
+    """
+    class Factory(object):
+        def create(self, *args, **kwargs):
+            return AdaptiveTimeStep(*args, **kwargs)
+
+    def __init__(self, *args, **kwargs):
+        """
+        See :py:class:`TimeStepping` for the list of valid initialization
+        arguments.
+        """
+        super(AdaptiveTimeStep, self).__init__(*args, **kwargs)
+
+        # Add parameters controlling the adaptivity
+        self.parameters.add(AdaptiveTimeStep._init_adaptive_parameters())
+
+    @staticmethod
+    def _init_adaptive_parameters():
+        """
+        .. _tab_adaptprm:
+
+           ====================  ===============  =================================
+           AdaptiveTimeStep      \                \
+           parameters
+           ------------------------------------------------------------------------
+           Option                Suboption        Description
+           ====================  ===============  =================================
+           --adaptive
+           \                     .rtol            relative tolerance for the error
+           \                     .atol            absolute tolerance for the error
+           \                     .safety          safety factor of the controller
+           \                     .factor_min      minimal change of the time step
+           \                     .factor_max      maximal change of the time step
+           \                     .min_increase    minimal relative increase of
+                                                  the time step
+           \                     .dt_min          minimal time step
+           \                     .dt_max          maximal time step (0 = no limit)
+           \                     .cfl             CFL number (0 = no CFL limit)
+           \                     .max_rejections  max. number of rejections/step
+           ====================  ===============  =================================
+        """
+        prm = Parameters("adaptive")
+        prm.add("rtol", 1e-3)
+        prm.add("atol", 1e-6)
+        prm.add("safety", 0.9)
+        prm.add("factor_min", 0.2)
+        prm.add("factor_max", 2.0)
+        prm.add("min_increase", 1.2)
+        prm.add("dt_min", 0.0)
+        prm.add("dt_max", 0.0)
+        prm.add("cfl", 1.0)
+        prm.add("max_rejections", 8)
+        return prm
+
+    def _tstepping_loop(self, t_beg, t_end, dt, OTD=1, it=0):
+        """
+        Run time-stepping algorithm.
+        """
+        prm = self.parameters
+        logger = self._logger
+        solver = self._solver
+        model = solver.data["model"]
+        DS = model.discretization_scheme()
+        sol_ctl = DS.solution_ctl()
+        sol_ptl = DS.solution_ptl()
+
+        if not dt > 0.0:
+            raise ValueError("Initial time step must be positive,"
+                             " got dt = %g" % dt)
+        if prm["remesh"]["modulo"] > 0:
+            raise ValueError("Mesh adaptivity is not supported by '%s'"
+                             % type(self).__name__)
+        if OTD == 2 and DS.name() == "FullyDecoupled":
+            warning("Time discretization of order %g for '%s' scheme"
+                    " assumes constant time step" % (OTD, DS.name()))
+
+        # Prepare vectors needed for the estimate of the truncation error
+        self._work = [w.vector().copy() for w in sol_ctl]
+        self._error_dofs = self._prepare_error_dofs(sol_ctl)
+        if len(sol_ptl) == 1:
+            # Keep our own copy of the solution at the time level (n-1)
+            self._backup = [self._backup_function(i, w)
+                            for (i, w) in enumerate(sol_ptl[0])]
+
+        t = t_beg
+        dt_prev = None   # time step used to get solution at PTL
+        restored = getattr(self, "_restored", None)
+        self._restored = None
+        if restored is not None and near(restored["t"], t_beg):
+            # Continue with the history loaded from the checkpoint
+            if not hasattr(self, "_backup"):
+                dt_prev = restored["dt_prev"]
+            elif restored["backup"]:
+                for (f, g) in zip(self._backup, restored["backup"]):
+                    f.vector().zero()
+                    f.vector().axpy(1.0, g.vector())
+                dt_prev = restored["dt_prev"]
+        dt_range = [dt, dt]
+        rejected = 0     # total number of rejected steps
+        num_rejections = 0
+        num_failures = 0 # consecutive failures of the solver
+        resume = False
+        steady = False
+        self._prepare_steady_monitor()
+        solver.update_time_step(OTD, dt)
+        solver.setup()
+        while t < t_end and not near(t, t_end, 1e-8*dt):
+            # Do not step over the termination time
+            if t + dt > t_end:
+                dt = t_end - t
+                solver.update_time_step(OTD, dt)
+
+            # Move to the current time level
+            it += 1                   # update iteration number
+            self._begin_step()
+
+            # User defined instructions
+            if self._hook is not None:
+                with phase(self._profiler, "hook"):
+                    self._hook.head(t + dt, it, logger)
+
+            # Solve
+            info("t = %g, step = %g, dt = %g" % (t + dt, it, dt))
+            with Timer("Solve (per time step)") as tmr_solve:
+                solved = self._try_solve()
+
+            # Repeat the step with a smaller time step if the solver failed
+            if not solved:
+                num_failures += 1
+                dt_next = dt/prm["rollback"]["subdivision"]
+                if (num_failures > prm["rollback"]["max_retries"]
+                      or dt_next < prm["adaptive"]["dt_min"]):
+                    raise RuntimeError("Solver failed for %g consecutive"
+                                       " attempts (last time step dt = %g)"
+                                       % (num_failures, dt))
+                it -= 1
+                rejected += 1
+                dt = dt_next
+                solver.update_time_step(OTD, dt)
+                continue
+            num_failures = 0
+
+            # Estimate the error and propose the next time step
+            err = self._estimate_error(sol_ctl, sol_ptl, dt, dt_prev)
+            dt_next = self._propose_time_step(dt, err)
+
+            # Reject the step if the error is too large
+            if (err > 1.0 and dt > prm["adaptive"]["dt_min"]
+                  and num_rejections < prm["adaptive"]["max_rejections"]):
+                info("Step rejected (error estimate = %g)" % err)
+                DS.copy_ptl_to_ctl() # t^(n+1) <-- t^(n-0)
+                it -= 1
+                rejected += 1
+                num_rejections += 1
+                dt = min(dt_next, dt) # CFL may want a larger step
+                solver.update_time_step(OTD, dt)
+                continue
+            num_rejections = 0
+            t += dt                   # update time
+            logger.info("dt = %g, error estimate = %g",
+                        (dt, err), ("dt", "err"), t)
+
+            # User defined instructions
+            if self._hook is not None:
+                with phase(self._profiler, "hook"):
+                    self._hook.tail(t, it, logger)
+
+            # Save results
+            if it % prm["xdmf"]["modulo"] == 0:
+                if hasattr(self, "_xdmf_writer"):
+                    with phase(self._profiler, "io"):
+                        self._xdmf_writer.write(t)
+
+            # Check whether the solution still changes
+            steady = self._steady_state_reached(t)
+
+            # Update variables at previous time levels
+            if hasattr(self, "_backup"):
+                for (i, w) in enumerate(sol_ptl[0]):
+                    self._backup[i].vector().zero()
+                    self._backup[i].vector().axpy(1.0, w.vector())
+                    # t^(n-1) <-- t^(n)
+            self._update_ptl()
+            history = {"dt_prev": float(dt)}
+            self._save_checkpoint(t, it, dt_next, False, history,
+                                  getattr(self, "_backup", []))
+            self._end_step(t, it)
+
+            # Update the time step
+            dt_range = [min(dt_range[0], dt), max(dt_range[1], dt)]
+            dt_prev = dt
+            if dt_next != dt:
+                dt = dt_next
+                solver.update_time_step(OTD, dt)
+            if steady:
+                info("Steady state reached at t = %g" % t)
+                break
+
+            # Stop if we are running out of time
+            if (t < t_end and not near(t, t_end, 1e-8*dt)
+                  and self._walltime_exceeded(tmr_solve)):
+                info("Wall-clock budget exhausted, stopping at t = %g" % t)
+                self._save_checkpoint(t, it, dt, True, history,
+                                      getattr(self, "_backup", []))
+                resume = True
+                break
+
+        # Flush output from logger, profiler and writer
+        self._logger.dump_to_file()
+        if self._profiler is not None:
+            self._profiler.dump_to_file()
+        if hasattr(self, "_xdmf_writer"):
+            self._xdmf_writer.flush()
+
+        # Refresh solver for further use
+        solver.refresh()
+
+        # Release auxiliary vectors
+        del self._work, self._error_dofs
+        if hasattr(self, "_backup"):
+            del self._backup
+
+        result = {
+            "dt": dt,
+            "it": it,
+            "t": t,
+            "t_end": t_end,
+            "resume": resume,
+            "steady": steady,
+            "increment": self._steady_increment,
+            "tmr_solve": tmr_solve.elapsed()[0],
+            "dt_min": dt_range[0],
+            "dt_max": dt_range[1],
+            "rejected": rejected
+        }
+
+        return result
+
+    def load_checkpoint(self):
+        """
+        Restore solution functions from the latest checkpoint (see
+        :py:meth:`TimeStepping.load_checkpoint`) together with the history
+        needed for the estimate of the truncation error. The history is used
+        by the next call of :py:meth:`TimeStepping.run` starting from the
+        time of the checkpoint, so that the time step is controlled as if the
+        computation had not been interrupted.
+
+        :returns: dictionary with time ``t``, iteration number ``it``, time
+                  step ``dt`` and the previous time step ``dt_prev``
+        :rtype: dict
+        """
+        result = super(AdaptiveTimeStep, self).load_checkpoint()
+        self._restored = None
+        if "dt_prev" not in result:
+            return result
+        DS = self._solver.data["model"].discretization_scheme()
+        prefix = self._checkpoint_folder() + os.path.sep
+        backup = []
+        for (i, w) in enumerate(DS.solution_ptl(0)):
+            f = self._backup_function(i, w)
+            fname = prefix + f.name() + HDF5Writer.suffix(result["t"])
+            if not os.path.isfile(fname):
+                backup = []
+                break
+            hdf5_file = HDF5File(self._comm, fname, "r")
+            hdf5_file.read(f, f.name())
+            hdf5_file.close()
+            backup.append(f)
+        self._restored = {"t": result["t"], "dt_prev": result["dt_prev"],
+                          "backup": backup}
+        return result
+
+    @staticmethod
+    def _backup_function(i, w):
+        """
+        Returns a copy of the solution function ``w`` at the time level
+        (n-1), which is kept if the discretization scheme does not store
+        more previous time levels.
+        """
+        f = Function(w.function_space())
+        f.vector().axpy(1.0, w.vector())
+        f.rename("backup_%d" % i, "solution_full_%d_backup" % i)
+        return f
+
+    def _prepare_error_dofs(self, sol_ctl):
+        """
+        Returns arrays with local indices of DOFs of ``phi`` and ``v`` in the
+        vectors of solution functions ``sol_ctl``.
+        """
+        DS = self._solver.data["model"].discretization_scheme()
+        pv = DS.primitive_vars_ctl()
+        spaces = [DS.subspace(var, i)
+                  for var in ["phi", "v"] for i in range(len(pv[var]))]
+        dofs = []
+        for w in sol_ctl:
+            W = w.function_space()
+            offset = w.vector().local_range()[0]
+            idx = [V.dofmap().dofs() - offset
+                   for V in spaces if W.contains(V)]
+            idx = np.concatenate(idx) if idx else np.array([], dtype=int)
+            dofs.append(np.sort(idx).astype(np.intc))
+        return dofs
+
+    def _estimate_error(self, sol_ctl, sol_ptl, dt, dt_prev):
+        """
+        Estimate the local truncation error as the difference between the
+        solution at the current time level and its linear extrapolation from
+        the two closest previous time levels. Only DOFs of ``phi`` and ``v``
+        are taken into account. The estimate is scaled by given tolerances so
+        that the step is acceptable if the returned value does not exceed one.
+        """
+        if dt_prev is None:
+            return 0.0 # history is not available yet
+        prm = self.parameters["adaptive"]
+        if len(sol_ptl) > 1:
+            history = [w.vector() for w in sol_ptl[1]]
+        else:
+            history = [f.vector() for f in self._backup]
+        r = dt/dt_prev
+        err = 0.0
+        for (i, w) in enumerate(sol_ctl):
+            idx = self._error_dofs[i]
+            size = MPI.sum(self._comm, float(len(idx)))
+            if size == 0.0:
+                continue
+            e = self._work[i]
+            e.zero()
+            e.axpy(1.0, w.vector())
+            e.axpy(-(1.0 + r), sol_ptl[0][i].vector())
+            e.axpy(r, history[i])
+            e_norm = MPI.sum(self._comm, np.sum(e.get_local()[idx]**2))**0.5
+            w_norm = MPI.sum(self._comm,
+                             np.sum(w.vector().get_local()[idx]**2))**0.5
+            scale = prm["atol"]*size**0.5 + prm["rtol"]*w_norm
+            err = max(err, e_norm/scale)
+        return err
+
+    def _propose_time_step(self, dt, err):
+        """
+        Propose new time step based on the error estimate and the CFL
+        condition. Small increases of the time step are ignored.
+        """
+        prm = self.parameters["adaptive"]
+        # NOTE: Extrapolation error behaves like O(dt^2)
+        factor = prm["safety"]*err**(-0.5) if err > 0.0 else prm["factor_max"]
+        factor = min(prm["factor_max"], max(prm["factor_min"], factor))
+        dt_new = factor*dt
+        dt_cfl = self._cfl_time_step()
+        if dt_cfl is not None:
+            dt_new = min(dt_new, dt_cfl)
+        if prm["dt_max"] > 0.0:
+            dt_new = min(dt_new, prm["dt_max"])
+        if dt < dt_new < prm["min_increase"]*dt:
+            dt_new = dt # NOTE: Change of the time step is not for free
+        return max(dt_new, prm["dt_min"])
+
+    def _cfl_time_step(self):
+        """
+        Returns the largest time step satisfying the CFL condition or ``None``
+        if the time step is not restricted by this condition.
+        """
+        cfl = self.parameters["adaptive"]["cfl"]
+        if not cfl > 0.0:
+            return None
+        DS = self._solver.data["model"].discretization_scheme()
+        if not hasattr(self, "_cfl_v"):
+            self._cfl_v = len(DS.primitive_vars_ctl()["v"])*[None,]
+        # NOTE: Components are copied into the same functions in each step
+        self._cfl_v = [DS.split_component("v", i, f=f)
+                       for (i, f) in enumerate(self._cfl_v)]
+        v_max = sum([v_i.vector().norm("linf")**2.0 for v_i in self._cfl_v])**0.5
+        if v_max == 0.0:
+            return None
+        h_min = MPI.min(self._comm, DS.mesh().hmin())
+        return cfl*h_min/v_max
@@ -85,10 +85,7 @@ def load_initial_conditions(DS, c):
     _phi = df.Function(V_phi)
     _phi.interpolate(phi_expr)
 
-    pv0 = DS.primitive_vars_ptl(0)
-    phi = pv0["phi"].split()[0]
-    df.assign(phi, _phi) # with uncached dofmaps
-    # FIXME: consider creating FunctionAssigner instances within DS
+    DS.gather_component(_phi, "phi", 0, level=0)
 
     # Copy interpolated initial condition also to CTL
     for i, w in enumerate(DS.solution_ptl(0)):
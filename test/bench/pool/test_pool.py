@@ -187,10 +187,7 @@ def load_initial_conditions(DS, eps):
         setattr(expr, key, val)
     _phi.interpolate(expr)
 
-    pv0 = DS.primitive_vars_ptl(0)
-    phi = pv0["phi"].split()[0]
-    assign(phi, _phi) # with uncached dofmaps
-    # FIXME: consider creating FunctionAssigner instances within DS
+    DS.gather_component(_phi, "phi", 0, level=0)
 
     # Copy interpolated initial condition also to CTL
     for i, w in enumerate(DS.solution_ptl(0)):
@@ -1,5 +1,9 @@
 import pytest
 import gc
+import getpass
+import re
+import tempfile
+import py
 from dolfin import MPI, mpi_comm_world
 
 # Configuration from dolfin
@@ -17,3 +21,19 @@ def pytest_runtest_teardown(item):
     #       to 'item'?! Well, it seems that it works...
     gc.collect()
     MPI.barrier(mpi_comm_world())
+
+@pytest.fixture
+def tmpdir(request):
+    """Overrides the fixture provided by pytest, which creates different
+    directories on different processes. The returned directory is shared
+    by all processes and it is empty at the beginning of the test."""
+    comm = mpi_comm_world()
+    name = re.sub(r"[\W]", "_", request.node.name)
+    path = py.path.local(tempfile.gettempdir()).join(
+        "pytest-of-%s-muflon" % getpass.getuser(), name)
+    if MPI.rank(comm) == 0:
+        if path.check():
+            path.remove()
+        path.ensure(dir=True)
+    MPI.barrier(comm)
+    return path
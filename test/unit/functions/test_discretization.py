@@ -1,11 +1,13 @@
 import pytest
 import six
+import numpy as np
 
 import dolfin
 
 from muflon.functions.discretization import DiscretizationFactory
 from muflon.functions.primitives import PrimitiveShell
 from muflon.functions.iconds import SimpleCppIC
+from muflon.io.writers import HDF5Writer
 
 def get_arguments(dim=2, th=False, nx=2):
     if dim == 1:
@@ -35,7 +37,7 @@ def test_GenericDiscretization():
 @pytest.mark.parametrize("scheme", ["Monolithic", "SemiDecoupled", "FullyDecoupled"])
 @pytest.mark.parametrize("N", [2, 3])
 @pytest.mark.parametrize("dim", range(1, 4))
-def test_discretization_schemes(scheme, N, dim, th):
+def test_discretization_schemes(scheme, N, dim, th, tmpdir):
 
     args = get_arguments(dim, th)
     DS = DiscretizationFactory.create(scheme, *args)
@@ -184,8 +186,30 @@ def test_discretization_schemes(scheme, N, dim, th):
     # dolfin.info(pv0["p"].dolfin_repr().vector(), True)
 
     # prepare initial condition from files
-    with pytest.raises(NotImplementedError):
+    with pytest.raises(ValueError):
         DS.load_ic_from_file([])
+    writer = HDF5Writer(DS.mesh().mpi_comm(), str(tmpdir),
+                        list(DS.solution_ptl(0)))
+    writer.write(0.0)
+    filenames = [writer.prefix() + w.name() + writer.suffix(0.0)
+                 for w in DS.solution_ptl(0)]
+    norms = [w.vector().norm("l2") for w in DS.solution_ptl(0)]
+    for w in DS.solution_ctl() + DS.solution_ptl(0):
+        w.vector().zero()
+    DS.load_ic_from_file([filenames])
+    for i, w in enumerate(DS.solution_ptl(0)):
+        assert dolfin.near(w.vector().norm("l2"), norms[i])
+        assert dolfin.near(DS.solution_ctl()[i].vector().norm("l2"), norms[i])
+
+    # shift solution to previous time levels
+    for w in DS.solution_ctl():
+        w.vector()[:] = 1.0
+    DS.update_ptl()
+    for i, w in enumerate(DS.solution_ptl(0)):
+        assert w.vector().norm("linf") == 1.0
+        if DS.number_of_ptl() > 1:
+            w1 = DS.solution_ptl(1)[i]
+            assert dolfin.near(w1.vector().norm("l2"), norms[i])
 
     del pv0, v0, ic
 
@@ -211,6 +235,178 @@ def test_discretization_schemes(scheme, N, dim, th):
 
     del tr_fcns, te_fcns, pv, pv_ufl
 
+    # --- Mesh hierarchy ------------------------------------------------------
+    assert DS.mesh_hierarchy() == (DS.mesh(),)
+    coarse_mesh = dolfin.Mesh(DS.mesh())
+    DS.set_coarse_meshes([coarse_mesh,])
+    # NOTE: The computational mesh is not a refinement of the coarse one here,
+    #       but transfer matrices can be created anyway
+    assert len(DS.mesh_hierarchy()) == 2
+    P = DS.transfer_matrices("p")
+    assert len(P) == 1
+    assert P[0].size(0) == P[0].size(1)
+    assert DS.transfer_matrices("p") is P
+    DS.set_coarse_meshes([])
+
     # --- Cleanup -------------------------------------------------------------
     del foo, foo_list, gdim
     del DS, args
+
+@pytest.mark.parametrize("scheme", ["Monolithic", "SemiDecoupled", "FullyDecoupled"])
+def test_adapt_to_interface(scheme):
+    args = get_arguments(nx=4)
+    DS = DiscretizationFactory.create(scheme, *args)
+    DS.parameters["N"] = 2
+    DS.setup()
+
+    # Initialize sharp interface at x = 0.5
+    ic = SimpleCppIC()
+    ic.add("phi", "x[0] < 0.5 ? 1.0 : 0.0")
+    ic.add("v", 0.0)
+    ic.add("v", 0.0)
+    DS.load_ic_from_simple_cpp(ic)
+    for (w, w0) in zip(DS.solution_ctl(), DS.solution_ptl(0)):
+        w.assign(w0)
+
+    base_mesh = DS.mesh()
+    DS_new = DS.adapt_to_interface(base_mesh, 2, 0.1)
+    mesh = DS_new.mesh()
+    assert DS_new.name() == DS.name()
+    assert DS_new.parameters["N"] == 2
+    assert base_mesh.num_cells() < mesh.num_cells() < 16*base_mesh.num_cells()
+    assert len(DS_new.mesh_hierarchy()) == 3
+
+    # Values far from the interface are preserved
+    phi = DS_new.primitive_vars_ptl(0)["phi"].split()[0]
+    assert dolfin.near(phi(0.1, 0.1), 1.0)
+    assert dolfin.near(phi(0.9, 0.9), 0.0)
+
+    # No refinement takes place if the threshold is not exceeded
+    DS_new = DS.adapt_to_interface(base_mesh, 1, 1e+6)
+    assert DS_new.mesh().num_cells() == base_mesh.num_cells()
+
+    # Load is measured relative to the average one
+    imbalance = DS.load_imbalance()
+    assert imbalance["dofs"] >= 1.0 and imbalance["cells"] >= 1.0
+    if dolfin.MPI.size(base_mesh.mpi_comm()) == 1:
+        assert imbalance["dofs"] == 1.0 and imbalance["cells"] == 1.0
+    DS_new = DS.adapt_to_interface(base_mesh, 2, 0.1, max_imbalance=1.0)
+    assert DS_new.load_imbalance()["cells"] >= 1.0
+
+def test_adapt_to_interface_rebalance():
+    args = get_arguments(nx=16)
+    DS = DiscretizationFactory.create("FullyDecoupled", *args)
+    DS.parameters["N"] = 2
+    DS.setup()
+    base_mesh = DS.mesh()
+    comm = base_mesh.mpi_comm()
+    rank, size = dolfin.MPI.rank(comm), dolfin.MPI.size(comm)
+
+    # Sharp interface of a small droplet lying in the part of the domain
+    # owned by the first process, hence all refined cells belong to it
+    center = np.mean(base_mesh.coordinates(), axis=0) if rank == 0 \
+        else np.zeros(2)
+    center = [min(max(dolfin.MPI.sum(comm, float(c)), 0.15), 0.85)
+              for c in center]
+    phi = dolfin.Function(DS.subspace("phi", 0, deepcopy=True))
+    phi.interpolate(dolfin.Expression(
+        "pow(x[0] - x0, 2) + pow(x[1] - y0, 2) < r*r ? 1.0 : 0.0",
+        x0=center[0], y0=center[1], r=0.1, degree=1))
+    DS.gather_component(phi, "phi", 0)
+
+    # Refinement without repartitioning makes the first process overloaded
+    levels, tol, max_imbalance = 3, 0.1, 1.2
+    DS_new = DS.adapt_to_interface(base_mesh, levels, tol)
+    imbalance = DS_new.load_imbalance()
+    num_cells = lambda mesh: dolfin.MPI.sum(comm, float(mesh.num_cells()))
+    assert num_cells(DS_new.mesh()) > 2*num_cells(base_mesh)
+    if size > 1:
+        assert imbalance["cells"] > max_imbalance
+        assert imbalance["dofs"] > 1.0
+
+    # Repartitioning brings the imbalance under the threshold
+    DS_bal = DS.adapt_to_interface(base_mesh, levels, tol, max_imbalance)
+    assert num_cells(DS_bal.mesh()) == num_cells(DS_new.mesh())
+    assert DS_bal.load_imbalance()["cells"] <= max_imbalance
+
+@pytest.mark.parametrize("scheme", ["Monolithic", "SemiDecoupled", "FullyDecoupled"])
+def test_cached_views_and_assigners(scheme):
+    args = get_arguments()
+    DS = DiscretizationFactory.create(scheme, *args)
+    DS.parameters["N"] = 3
+    DS.setup()
+
+    # Shallow copies of primitive variables are created only once
+    pv = DS.primitive_vars_ctl()
+    assert pv["phi"] is DS.primitive_vars_ctl()["phi"]
+    assert pv["phi"].split() is pv["phi"].split()
+    assert DS.primitive_vars_ptl(0)["p"] is DS.primitive_vars_ptl(0)["p"]
+    assert DS.primitive_vars_ctl(deepcopy=True)["p"] is not pv["p"]
+    assert DS.subspace("phi", 1, deepcopy=True) \
+        is DS.subspace("phi", 1, deepcopy=True)
+
+    # Assign to a component and get it back
+    f = dolfin.Function(DS.subspace("phi", 1, deepcopy=True))
+    f.vector()[:] = 42.0
+    DS.gather_component(f, "phi", 1, level=0)
+    g = DS.split_component("phi", 1, level=0)
+    assert g.vector().max() == 42.0 and g.vector().min() == 42.0
+    h = DS.split_component("phi", 0, level=0)
+    assert h.vector().norm("linf") == 0.0
+    p = DS.split_component("p")
+    assert DS.split_component("p", f=p) is p
+
+@pytest.mark.parametrize("scheme", ["Monolithic", "SemiDecoupled", "FullyDecoupled"])
+def test_cached_views_after_loading_ic(scheme, tmpdir):
+    args = get_arguments()
+    DS = DiscretizationFactory.create(scheme, *args)
+    DS.parameters["N"] = 3
+    DS.setup()
+
+    # Get cached views before initial conditions are loaded
+    pv = DS.primitive_vars_ctl()
+    pv0 = DS.primitive_vars_ptl(0)
+    phi, phi0 = pv["phi"].split()[1], pv0["phi"].split()[1]
+    area = dolfin.assemble(dolfin.Constant(1.0)*dolfin.dx(DS.mesh()))
+
+    # Views must see values loaded at both time levels
+    ic = SimpleCppIC()
+    ic.add("phi", 0.2)
+    ic.add("phi", 0.3)
+    ic.add("v", 1.0)
+    ic.add("v", 2.0)
+    ic.add("p", 0.0)
+    DS.load_ic_from_simple_cpp(ic)
+    assert dolfin.near(dolfin.assemble(phi0*dolfin.dx), 0.3*area)
+    assert dolfin.near(dolfin.assemble(phi*dolfin.dx), 0.3*area)
+    assert dolfin.near(DS.split_component("v", 1).vector().min(), 2.0)
+    assert pv is not DS.primitive_vars_ctl() # a new dict ...
+    assert pv["phi"] is DS.primitive_vars_ctl()["phi"] # ... with same views
+
+    # The same holds for initial conditions loaded from files
+    writer = HDF5Writer(DS.mesh().mpi_comm(), str(tmpdir),
+                        list(DS.solution_ptl(0)))
+    writer.write(0.0)
+    filenames = [writer.prefix() + w.name() + writer.suffix(0.0)
+                 for w in DS.solution_ptl(0)]
+    for w in DS.solution_ctl() + DS.solution_ptl(0):
+        w.vector().zero()
+    assert dolfin.near(dolfin.assemble(phi*dolfin.dx), 0.0)
+    DS.load_ic_from_file([filenames])
+    assert dolfin.near(dolfin.assemble(phi*dolfin.dx), 0.3*area)
+    assert dolfin.near(DS.split_component("v", 1).vector().min(), 2.0)
+
+    # Check explicit copy from PTL to CTL
+    for w in DS.solution_ctl():
+        w.vector().zero()
+    DS.copy_ptl_to_ctl()
+    assert dolfin.near(dolfin.assemble(phi*dolfin.dx), 0.3*area)
+
+    # Views are renewed when solution functions get new vectors
+    for w in DS.solution_ctl():
+        w.vector().zero()
+    for (w, w0) in zip(DS.solution_ctl(), DS.solution_ptl(0)):
+        w.assign(w0)
+    phi = DS.primitive_vars_ctl()["phi"].split()[1]
+    assert dolfin.near(dolfin.assemble(phi*dolfin.dx), 0.3*area)
+    assert dolfin.near(DS.split_component("v", 1).vector().min(), 2.0)
@@ -0,0 +1,63 @@
+import os
+
+import dolfin
+
+from muflon.io.writers import XDMFWriter, AsyncXDMFWriter
+
+def test_AsyncXDMFWriter(tmpdir):
+    mesh = dolfin.UnitSquareMesh(4, 4)
+    comm = mesh.mpi_comm()
+    V = dolfin.FunctionSpace(mesh, "Lagrange", 1)
+    W = dolfin.VectorFunctionSpace(mesh, "Lagrange", 1)
+    f, g = dolfin.Function(V), dolfin.Function(W)
+    f.rename("f", "scalar")
+    g.rename("g", "vector")
+    fields = [(f, None), (g, "velocity")]
+    outdir = {"sync": str(tmpdir.join("sync")),
+              "async": str(tmpdir.join("async"))}
+    writers = {"sync": XDMFWriter(comm, outdir["sync"], fields),
+               "async": AsyncXDMFWriter(comm, outdir["async"], fields,
+                                        queue_size=1)}
+    times = [0.0, 0.5, 1.0]
+    for t in times:
+        f.interpolate(dolfin.Expression("x[0] + t", t=t, degree=1))
+        g.interpolate(dolfin.Expression(("t*x[1]", "-t"), t=t, degree=1))
+        for key in ["sync", "async"]:
+            writers[key].write(t)
+        # Output lags behind by at most one snapshot
+        assert len(writers["async"]._pending) == 1
+        suffix = "_%d.bin" % dolfin.MPI.rank(comm)
+        dumps = [f for f in os.listdir(os.path.join(outdir["async"], "_async"))
+                 if f.endswith(suffix)]
+        assert len(dumps) <= len(fields)
+    writers["sync"].flush()
+    writers["async"].close()
+    del writers
+
+    # Compare the output
+    dolfin.MPI.barrier(comm)
+    for name in ["f", "velocity"]:
+        xdmf = {}
+        for key in ["sync", "async"]:
+            with open(os.path.join(outdir[key], name + ".xdmf")) as xfile:
+                xdmf[key] = xfile.read()
+        assert xdmf["sync"] == xdmf["async"]
+        h5 = {}
+        for key in ["sync", "async"]:
+            h5[key] = dolfin.HDF5File(
+                comm, os.path.join(outdir[key], name + ".h5"), "r")
+        for k in range(len(times)):
+            dataset = "/VisualisationVector/%d" % k
+            x = {}
+            for key in ["sync", "async"]:
+                assert h5[key].has_dataset(dataset)
+                x[key] = dolfin.Vector(comm)
+                h5[key].read(x[key], dataset, False)
+            x["async"].axpy(-1.0, x["sync"])
+            assert x["sync"].norm("linf") > 0.0 or k == 0
+            assert x["async"].norm("linf") == 0.0
+        for key in ["sync", "async"]:
+            h5[key].close()
+
+    # Dumped files are removed after the output
+    assert not os.listdir(os.path.join(outdir["async"], "_async"))
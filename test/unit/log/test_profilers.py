@@ -0,0 +1,28 @@
+import pytest
+import time
+
+from dolfin import mpi_comm_world
+
+from muflon.log.profilers import MuflonProfiler, phase
+
+def test_profiler():
+    comm = mpi_comm_world()
+    profiler = MuflonProfiler(comm)
+    with pytest.raises(ValueError):
+        profiler.phase("foo")
+
+    # Nested phases are measured exclusively
+    profiler.begin_step()
+    with phase(profiler, "solve"):
+        with phase(profiler, "assembly"):
+            time.sleep(0.02)
+    with phase(None, "io"): # does nothing
+        pass
+    profiler.end_step(0.1, 1, {"NS": [3, 3]})
+    record = profiler.data[-1]
+    assert record["it"] == 1
+    assert record["assembly_min"] >= 0.02
+    assert record["solve_max"] < record["assembly_min"]
+    assert record["io_max"] == 0.0
+    assert record["iters_NS"] == 3
+    assert record["step_max"] >= record["assembly_max"]
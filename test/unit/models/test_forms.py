@@ -172,6 +172,13 @@ def test_forms(scheme, N, dim, th, plotter):
         bforms = forms["lin"]
         for a, L in zip(bforms["lhs"], bforms["rhs"]):
             A, b = dolfin.assemble_system(a, L)
+    elif scheme == "SemiDecoupled":
+        # Check cell-wise update of SD stabilization parameter
+        sdstab = model.coeffs["sdstab"]
+        model._update_sd_stab_parameter()
+        delta = dolfin.project(sdstab["ufl"], sdstab["fcn"].function_space())
+        delta.vector().axpy(-1.0, sdstab["fcn"].vector())
+        assert delta.vector().norm("linf") < 1e-10
 
     # Test variable time step
     dt = 42
@@ -189,6 +196,25 @@ def test_forms(scheme, N, dim, th, plotter):
                                   # independently of the mesh
         assert flag
 
+def test_schur_ch_forms_negative_mobility():
+    model, DS, bcs = prepare_model_and_bcs("Monolithic", 2, 2, False)
+    model.parameters["sigma"].add("12", 4.0)
+    for key in ["rho", "nu"]:
+        prm = model.parameters[key]
+        prm.add("1", 42.)
+        prm.add("2", 4.0)
+    model.parameters["mobility"]["M0"] = -1.0
+    forms = model.create_forms()
+    model.update_TD_factors(1)
+    model.update_time_step_value(0.25)
+
+    # Diffusion term vanishes, only the scaled mass matrix remains
+    X = dolfin.assemble(forms["schur_ch"][0])
+    chi = dolfin.TrialFunction(DS.subspace("chi", 0))
+    chi_te = dolfin.TestFunction(DS.subspace("chi", 0))
+    M = dolfin.assemble(2.0*chi*chi_te*dolfin.dx)
+    assert X.norm("frobenius") == pytest.approx(M.norm("frobenius"))
+
 @pytest.fixture(scope='module')
 def plotter(request):
     def fin():
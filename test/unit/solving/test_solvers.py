@@ -1,12 +1,17 @@
 import pytest
+import numpy as np
 
 import dolfin
 
 from muflon.functions.discretization import DiscretizationFactory
 from muflon.models.forms import ModelFactory
-from muflon.solving.solvers import SolverFactory
+from muflon.solving.solvers import SolverFactory, JacobianMonitor
+from muflon.log.profilers import MuflonProfiler
+
+from fenapack import PCDKrylovSolver
 
 from unit.models.test_forms import prepare_model_and_bcs
+from unit.models.test_forms import prepare_initial_condition
 
 def prepare_solver(scheme):
     # Prepare model
@@ -24,6 +29,60 @@ def prepare_solver(scheme):
 
     return SolverFactory.create(model)
 
+def prepare_stratified_solver(scheme, N=2, nx=8, **kwargs):
+    """
+    Prepare solver for a well posed problem with two layers of fluids
+    (the heavier one at the bottom) in a closed box.
+    """
+    mesh = dolfin.UnitSquareMesh(nx, nx)
+    P1 = dolfin.FiniteElement("Lagrange", mesh.ufl_cell(), 1)
+    P2 = dolfin.FiniteElement("Lagrange", mesh.ufl_cell(), 2)
+    DS = DiscretizationFactory.create(scheme, mesh, P1, P1, P2, P1)
+    DS.parameters["N"] = N
+    DS.setup()
+    prepare_initial_condition(DS)
+
+    return create_stratified_solver(DS, **kwargs)
+
+def create_stratified_solver(DS, **kwargs):
+    """
+    Create solver for the problem described in
+    :py:func:`prepare_stratified_solver` on a given discretization scheme.
+    """
+    mesh = DS.mesh()
+
+    # No-slip boundary conditions
+    noslip = dolfin.Constant(0.0)
+    bcs = {"v": [tuple(dolfin.DirichletBC(DS.subspace("v", i), noslip,
+                                          "on_boundary")
+                       for i in range(2)),],
+           "pcd": []}
+
+    # Prepare model
+    model = ModelFactory.create("Incompressible", DS, bcs)
+    model.parameters["eps"] = 0.125
+    model.parameters["mobility"]["M0"] = 1e-3
+    model.parameters["sigma"].add("12", 1.0)
+    for key in ["rho", "nu"]:
+        prm = model.parameters[key]
+        prm.add("1", 2.0)
+        prm.add("2", 1.0)
+    model.load_sources(dolfin.Constant((0.0, -1.0), cell=mesh.ufl_cell()))
+    forms = model.create_forms()
+
+    return SolverFactory.create(model, forms, fix_p=True, **kwargs)
+
+def solve_time_step(solver, dt, OTD=1):
+    """
+    Solve a single time step and shift the solution to previous time levels.
+    """
+    model = solver.data["model"]
+    model.update_TD_factors(OTD, dt)
+    model.update_time_step_value(dt)
+    solver.setup()
+    solver.solve()
+    model.discretization_scheme().update_ptl()
+
 @pytest.mark.parametrize("scheme", ["Monolithic", "FullyDecoupled", "SemiDecoupled"])
 def test_solvers(scheme):
     solver = prepare_solver(scheme)
@@ -33,6 +92,563 @@ def test_solvers(scheme):
     with pytest.raises(NotImplementedError):
         SolverFactory.create(model, name="Solver")
 
+    # Check parameters
+    assert solver.parameters["initial_guess"] == "previous"
+    solver.parameters["initial_guess"] = "foo"
+    with pytest.raises(ValueError):
+        solver._extrapolation_order()
+    solver.parameters["initial_guess"] = "quadratic"
+    assert solver._extrapolation_order() == 2
+    if scheme in ["Monolithic", "FullyDecoupled"]:
+        assert solver.parameters["ls"] == "direct"
+        solver.parameters["ls"] = "foo"
+        with pytest.raises(ValueError):
+            solver.setup()
+    if scheme != "FullyDecoupled":
+        assert solver.parameters["jacobian"]["reuse"] == False
+    if scheme == "SemiDecoupled":
+        assert solver.parameters["ch_ls"] == "direct"
+        solver.parameters["ch_ls"] = "foo"
+        with pytest.raises(ValueError):
+            solver.setup()
+        assert solver.parameters["ch_pc"] == "default"
+        assert solver.parameters["ns_krylov"]["guess"] == "zero"
+        solver.parameters["ch_ls"] = "iterative"
+        solver.parameters["ch_pc"] = "foo"
+        with pytest.raises(ValueError):
+            solver.setup()
+
     # Try to call solve method
     #solver.solve()
     # FIXME: Problem is not well defined
+
+def test_initial_guess_extrapolation():
+    solver = prepare_stratified_solver("Monolithic")
+    model = solver.data["model"]
+    DS = model.discretization_scheme()
+    solver.parameters["initial_guess"] = "quadratic"
+    x = solver.data["sol_fcn"].vector()
+    n = x.local_size()
+
+    # Store levels lying on a parabola with non-uniform time steps
+    a, b, c = [np.random.rand(n) for k in range(3)]
+    levels = []
+    for (tau, dt) in [(0.0, 0.1), (0.1, 0.1), (0.3, 0.2)]:
+        model.update_time_step_value(dt)
+        x.set_local(a + b*tau + c*tau**2)
+        x.apply("insert")
+        solver._store_history("nln", x)
+        levels.append(x.get_local())
+        DS.update_ptl()
+    model.update_time_step_value(0.15)
+    tau = 0.45
+
+    # Quadratic extrapolation is exact
+    y = x.copy()
+    solver._apply_initial_guess("nln", y)
+    assert np.allclose(y.get_local(), a + b*tau + c*tau**2)
+
+    # Linear extrapolation uses the last two levels
+    solver.parameters["initial_guess"] = "linear"
+    solver._apply_initial_guess("nln", y)
+    x1, x2 = levels[1:]
+    assert np.allclose(y.get_local(), x2 + (x2 - x1)*0.15/0.2)
+
+    # Nothing happens with the default guess
+    solver.parameters["initial_guess"] = "previous"
+    solver._apply_initial_guess("nln", y)
+    assert np.allclose(y.get_local(), x2 + (x2 - x1)*0.15/0.2)
+
+    # Extrapolated guesses are closer to the solution and save iterations
+    dt = 0.02
+    iters, errors = {}, {}
+    for guess in ["previous", "quadratic"]:
+        solver = prepare_stratified_solver("Monolithic")
+        solver.parameters["initial_guess"] = guess
+        model = solver.data["model"]
+        DS = model.discretization_scheme()
+        model.update_TD_factors(1, dt)
+        model.update_time_step_value(dt)
+        solver.setup()
+        errors[guess] = []
+        for k in range(6):
+            x = solver.data["sol_fcn"].vector()
+            y = x.copy()
+            solver._apply_initial_guess("nln", y)
+            solver.solve()
+            y.axpy(-1.0, x)
+            errors[guess].append(y.norm("l2"))
+            DS.update_ptl()
+        iters[guess] = solver.iters["nln"][0]
+    assert np.allclose(errors["quadratic"][:2], errors["previous"][:2])
+    assert all(e_q < e_p for (e_q, e_p)
+               in zip(errors["quadratic"][2:], errors["previous"][2:]))
+    assert iters["quadratic"] <= iters["previous"]
+
+def test_JacobianMonitor():
+    prm = dolfin.Parameters("jacobian")
+    prm.add("reuse", True)
+    prm.add("max_steps", 2)
+    prm.add("rate", 0.5)
+    b = dolfin.Vector(dolfin.mpi_comm_world(), 1)
+
+    def record(val):
+        b[:] = val
+        monitor.record_residual(b)
+
+    # Jacobian is always assembled at the beginning
+    monitor = JacobianMonitor()
+    monitor.begin_solve(prm)
+    record(1.0)
+    assert monitor.refresh_needed()
+    monitor.refreshed()
+    # Fast convergence, reuse the matrix
+    record(0.1)
+    assert not monitor.refresh_needed()
+    # Slow convergence, refresh
+    record(0.09)
+    assert monitor.refresh_needed()
+
+    # Second step reuses the Jacobian, third one refreshes it
+    monitor.begin_solve(prm)
+    record(1.0)
+    assert not monitor.refresh_needed()
+    monitor.begin_solve(prm)
+    record(1.0)
+    assert monitor.refresh_needed()
+    monitor.refreshed()
+
+    # Change of time step enforces refresh
+    monitor.begin_solve(prm)
+    monitor.invalidate()
+    record(1.0)
+    assert monitor.refresh_needed()
+
+    # Full Newton
+    prm["reuse"] = False
+    monitor.begin_solve(prm)
+    monitor.refreshed()
+    assert monitor.refresh_needed()
+
+class StallingNewtonSolver(object):
+    """
+    Wrapper of Newton solver which is allowed to perform only a single
+    iteration in its first solve.
+    """
+    def __init__(self, solver):
+        self._solver = solver
+        self.stalled = False
+
+    def solve(self, problem, x):
+        if self.stalled:
+            return self._solver.solve(problem, x)
+        self.stalled = True
+        prm = self._solver.parameters
+        maxit = prm["maximum_iterations"]
+        prm["maximum_iterations"] = 1
+        try:
+            return self._solver.solve(problem, x)
+        finally:
+            prm["maximum_iterations"] = maxit
+
+    def iteration(self):
+        return self._solver.iteration()
+
+def test_reused_jacobian():
+    dt = 0.1
+    # Reference solution obtained by full Newton method
+    solver = prepare_stratified_solver("Monolithic")
+    w_ref = []
+    for k in range(3):
+        solve_time_step(solver, dt)
+        w_ref.append(solver.data["sol_fcn"].vector().copy())
+
+    solver = prepare_stratified_solver("Monolithic")
+    solver.parameters["jacobian"]["reuse"] = True
+    solver.parameters["jacobian"]["max_steps"] = 3
+    problem = solver.data["problem"]
+    x = solver.data["sol_fcn"].vector()
+    solve_time_step(solver, dt)
+    assert not problem.jacobian.reused
+    x0 = solver._backups[id(problem)]
+
+    # Reused Jacobian converges to the same solution
+    solve_time_step(solver, dt)
+    assert problem.jacobian.reused
+    assert solver._backups[id(problem)] is x0
+    x.axpy(-1.0, w_ref[1])
+    assert x.norm("l2") < 1e-6*w_ref[1].norm("l2")
+    x.axpy(1.0, w_ref[1])
+
+    # Stalled modified Newton method falls back to full Newton
+    solver.data["solver"] = StallingNewtonSolver(solver.data["solver"])
+    solve_time_step(solver, dt)
+    assert solver.data["solver"].stalled
+    assert not problem.jacobian.reuse
+    assert solver.iters["nln"][-1] > 1
+    assert solver._backups[id(problem)] is x0
+    x.axpy(-1.0, w_ref[2])
+    assert x.norm("l2") < 1e-6*w_ref[2].norm("l2")
+
+def test_FullyDecoupled_update_time_step():
+    solver = prepare_stratified_solver("FullyDecoupled")
+    model = solver.data["model"]
+    model.update_TD_factors(1, 0.1)
+    model.update_time_step_value(0.1)
+
+    # Matrices are not assembled before the setup
+    solver.update_time_step(1, 0.2)
+    assert "A" not in solver.data
+    solver.setup()
+    A_phi = solver.data["A"]["phi"][0]
+    A_v = solver.data["A"]["v"][0]
+    norm_phi = A_phi.norm("frobenius")
+    norm_v = A_v.norm("frobenius")
+
+    # Operators depending on the time step must be rebuilt
+    solver.update_time_step(1, 0.1)
+    assert solver.data["A"]["phi"][0] is not A_phi
+    assert solver.data["A"]["v"][0] is not A_v
+    assert solver.data["A"]["phi"][0].norm("frobenius") != norm_phi
+    assert solver.data["A"]["v"][0].norm("frobenius") != norm_v
+
+    # The new operators are used in the next solve
+    solver.solve()
+    for w in model.discretization_scheme().solution_ctl():
+        assert w.vector().norm("l2") < float("inf")
+
+    # Nothing is rebuilt after refresh
+    solver.refresh()
+    A_phi = solver.data["A"]["phi"][0]
+    solver.update_time_step(1, 0.2)
+    assert solver.data["A"]["phi"][0] is A_phi
+
+def test_SemiDecoupled_persistent_ns_system():
+    solver = prepare_stratified_solver("SemiDecoupled")
+    model = solver.data["model"]
+    DS = model.discretization_scheme()
+    model.update_TD_factors(1, 0.1)
+    model.update_time_step_value(0.1)
+    keys = ["A_ns", "b_ns", "P_ns"]
+    for it in range(3):
+        solver.setup()
+        assert solver._flags["setup"]
+        if it == 0:
+            objects = [solver.data[key] for key in keys]
+            solver_ch = solver.data["solver"]["CH"]["nln"]
+        solver.solve()
+        assert all(solver.data[key] is obj
+                   for (key, obj) in zip(keys, objects))
+        assert solver.data["solver"]["CH"]["nln"] is solver_ch
+
+        # System assembled in place agrees with a fresh assembly
+        A = dolfin.assemble(solver.data["forms"]["lin"]["lhs"])
+        b = dolfin.assemble(solver.data["forms"]["lin"]["rhs"])
+        for bc in solver.data["bcs_ns"]:
+            bc.apply(A, b)
+        solver.data["null_space"].orthogonalize(b)
+        A.axpy(-1.0, solver.data["A_ns"], False)
+        b.axpy(-1.0, solver.data["b_ns"])
+        assert A.norm("frobenius") < 1e-12*solver.data["A_ns"].norm("frobenius")
+        assert b.norm("l2") < 1e-12*solver.data["b_ns"].norm("l2")
+        DS.update_ptl()
+
+    # Solvers are rebuilt when parameters change
+    solver.parameters["ch_ls"] = "iterative"
+    solver.setup()
+    assert solver.data["solver"]["CH"]["nln"] is not solver_ch
+    assert isinstance(solver.data["solver"]["CH"]["lin"],
+                      dolfin.PETScKrylovSolver)
+    solver.solve()
+    solver.parameters["ch_ls"] = "direct"
+    solver.setup()
+    assert isinstance(solver.data["solver"]["CH"]["lin"], dolfin.LUSolver)
+    solver.solve()
+    assert all(solver.data[key] is obj for (key, obj) in zip(keys, objects))
+
+def test_FullyDecoupled_cached_solvers():
+    solver = prepare_stratified_solver("FullyDecoupled")
+    model = solver.data["model"]
+    model.update_TD_factors(1, 0.1)
+    model.update_time_step_value(0.1)
+    solver.setup()
+
+    # Operators differing only in coefficients must not share the solver
+    V = model.discretization_scheme().subspace("phi", 0, deepcopy=True)
+    u, v = dolfin.TrialFunction(V), dolfin.TestFunction(V)
+    c1, c2 = dolfin.Constant(1.0), dolfin.Constant(2.0)
+    a1, a2 = c1*u*v*dolfin.dx, c2*u*v*dolfin.dx
+    assert a1.signature() == a2.signature()
+    A1, lu1 = solver._cached_solver("phi", a1)
+    A2, lu2 = solver._cached_solver("phi", a2)
+    assert A1 is not A2 and lu1 is not lu2
+    assert dolfin.near(A2.norm("frobenius"), 2.0*A1.norm("frobenius"))
+    assert solver._cached_solver("phi", c1*u*v*dolfin.dx)[1] is lu1
+
+class CountingProfiler(MuflonProfiler):
+    """
+    Profiler counting how many times each phase has been entered.
+    """
+    def __init__(self, *args, **kwargs):
+        super(CountingProfiler, self).__init__(*args, **kwargs)
+        self.counts = dict((p, 0) for p in self._phases)
+
+    def _push(self, name):
+        self.counts[name] += 1
+        super(CountingProfiler, self)._push(name)
+
+def test_FullyDecoupled_factorization_reuse():
+    solver = prepare_stratified_solver("FullyDecoupled")
+    model = solver.data["model"]
+    DS = model.discretization_scheme()
+    profiler = CountingProfiler(DS.mesh().mpi_comm())
+    solver.set_profiler(profiler)
+    model.update_TD_factors(1, 0.01)
+    model.update_time_step_value(0.01)
+    solver.setup()
+    solvers = [lu for lu, indices in sum(solver.data["groups"].values(), [])]
+    solvers.append(solver.data["solver"]["p"])
+    num_operators = len(solver._operators)
+    assert num_operators == len(set(id(lu) for lu in solvers))
+
+    # Each distinct operator is factorized only in the first step
+    for k in range(4):
+        solver.solve()
+        DS.update_ptl()
+        assert profiler.counts["factorization"] == num_operators
+    groups = sum(solver.data["groups"].values(), [])
+    assert all(g[0] is lu for (g, lu) in zip(groups, solvers))
+    assert solver.data["solver"]["p"] is solvers[-1]
+
+def test_FullyDecoupled_factorization_phase():
+    solver = prepare_stratified_solver("FullyDecoupled")
+    model = solver.data["model"]
+    DS = model.discretization_scheme()
+    profiler = MuflonProfiler(DS.mesh().mpi_comm())
+    solver.set_profiler(profiler)
+    model.update_TD_factors(1, 0.1)
+    model.update_time_step_value(0.1)
+    solver.setup()
+
+    # Operators are factorized only in the first step
+    for it in range(2):
+        profiler.begin_step()
+        solver.solve()
+        profiler.end_step(0.1*(it + 1), it + 1)
+        DS.update_ptl()
+    assert profiler.data[0]["factorization_max"] > 0.0
+    assert profiler.data[1]["factorization_max"] == 0.0
+    assert profiler.data[1]["solve_max"] > 0.0
+
+    # New factorizations are needed when the time step changes
+    solver.update_time_step(1, 0.05)
+    profiler.begin_step()
+    solver.solve()
+    profiler.end_step(0.25, 3)
+    assert profiler.data[2]["factorization_max"] > 0.0
+
+def test_SemiDecoupled_ch_block_preconditioner():
+    dt = 0.1
+    iters = []
+    for nx in [8, 16, 32]:
+        # Reference solution obtained by the direct solver
+        solver = prepare_stratified_solver("SemiDecoupled", nx=nx)
+        solve_time_step(solver, dt)
+        DS = solver.data["model"].discretization_scheme()
+        w_ref = DS.solution_ptl(0)[0].vector().copy()
+
+        # Preconditioned GMRES
+        solver = prepare_stratified_solver("SemiDecoupled", nx=nx)
+        solver.parameters["ch_ls"] = "iterative"
+        solver.parameters["ch_pc"] = "schur"
+        solve_time_step(solver, dt)
+        DS = solver.data["model"].discretization_scheme()
+        w = DS.solution_ptl(0)[0].vector()
+        history = solver.data["solver"]["CH"]["nln"].history
+        iters.append(max(history["linear_iterations"]))
+        w.axpy(-1.0, w_ref)
+        assert w.norm("l2") < 1e-6*w_ref.norm("l2")
+
+    # Number of linear iterations is bounded under refinement
+    dolfin.info("Max. number of GMRES iterations per Newton step: %s" % iters)
+    assert iters[-1] <= iters[0] + 5
+
+def test_Monolithic_fieldsplit():
+    dt = 0.1
+    # Reference solution obtained by the direct solver
+    solver = prepare_stratified_solver("Monolithic")
+    solve_time_step(solver, dt)
+    DS = solver.data["model"].discretization_scheme()
+    w_ref = DS.solution_ptl(0)[0].vector().copy()
+
+    # GMRES with nested fieldsplit preconditioners
+    solver = prepare_stratified_solver("Monolithic")
+    solver.parameters["ls"] = "iterative"
+    solver.parameters["krylov"]["rtol"] = 1e-10
+    solve_time_step(solver, dt)
+    assert solver._flags["setup"]
+    ksp = solver.data["linear_solver"].ksp()
+    assert ksp.getPC().getType() == "fieldsplit"
+    assert ksp.getIterationNumber() < solver.parameters["krylov"]["maxit"]
+    ksp_ch = ksp.getPC().getFieldSplitSubKSP()[0]
+    ksp_S = ksp_ch.getPC().getFieldSplitSubKSP()[1]
+    assert ksp_S.getPC().getType() == "python"
+    DS = solver.data["model"].discretization_scheme()
+    w = DS.solution_ptl(0)[0].vector()
+    w.axpy(-1.0, w_ref)
+    assert w.norm("l2") < 1e-6*w_ref.norm("l2")
+
+def test_FullyDecoupled_iterative():
+    w = {}
+    for ls in ["direct", "iterative"]:
+        solver = prepare_stratified_solver("FullyDecoupled")
+        solver.parameters["ls"] = ls
+        solver.parameters["krylov"]["rtol"] = 1e-12
+        solver.parameters["krylov"]["atol"] = 1e-14
+        for k in range(2):
+            solve_time_step(solver, 0.1)
+        DS = solver.data["model"].discretization_scheme()
+        w[ls] = [f.vector().get_local() for f in DS.solution_ptl(0)]
+
+    # CG/GMRES with AMG is used for all sub-problems
+    for lu, indices in sum(solver.data["groups"].values(), []):
+        assert isinstance(lu, dolfin.PETScKrylovSolver)
+    ksp = solver.data["solver"]["p"].ksp()
+    assert ksp.getType() == "cg"
+    assert 0 < ksp.getIterationNumber() < solver.parameters["krylov"]["maxit"]
+    assert solver.data["groups"]["v"][0][0].ksp().getType() == "gmres"
+
+    # Iterative solvers give the same results as the direct ones
+    for (x_it, x) in zip(w["iterative"], w["direct"]):
+        assert np.allclose(x_it, x, rtol=1e-6, atol=1e-8)
+
+def test_FullyDecoupled_geometric_multigrid():
+    # Nested hierarchy of meshes
+    meshes = [dolfin.UnitSquareMesh(2, 2)]
+    for k in range(2):
+        meshes.append(dolfin.refine(meshes[-1]))
+    mesh = meshes.pop()
+    P1 = dolfin.FiniteElement("Lagrange", mesh.ufl_cell(), 1)
+    P2 = dolfin.FiniteElement("Lagrange", mesh.ufl_cell(), 2)
+
+    w = {}
+    for pc in ["direct", "gmg"]:
+        DS = DiscretizationFactory.create("FullyDecoupled",
+                                          mesh, P1, P1, P2, P1)
+        DS.parameters["N"] = 2
+        DS.setup()
+        prepare_initial_condition(DS)
+        DS.set_coarse_meshes(meshes)
+        solver = create_stratified_solver(DS)
+        if pc != "direct":
+            solver.parameters["ls"] = "iterative"
+            solver.parameters["krylov"]["pc"] = pc
+            solver.parameters["krylov"]["rtol"] = 1e-12
+            solver.parameters["krylov"]["atol"] = 1e-14
+        for k in range(2):
+            solve_time_step(solver, 0.1)
+        w[pc] = [f.vector().get_local() for f in DS.solution_ptl(0)]
+
+    # All sub-problems are preconditioned by PCMG with three levels
+    solvers = [lu for lu, indices in sum(solver.data["groups"].values(), [])]
+    solvers.append(solver.data["solver"]["p"])
+    maxit = solver.parameters["krylov"]["maxit"]
+    for lu in solvers:
+        pc = lu.ksp().getPC()
+        assert pc.getType() == "mg"
+        assert pc.getMGLevels() == 3
+        assert lu.ksp().getIterationNumber() < maxit
+
+    # Results agree with the direct solver
+    for (x_mg, x) in zip(w["gmg"], w["direct"]):
+        assert np.allclose(x_mg, x, rtol=1e-6, atol=1e-8)
+
+    # Algebraic multigrid is used without the hierarchy
+    DS.set_coarse_meshes([])
+    solver = create_stratified_solver(DS)
+    solver.parameters["ls"] = "iterative"
+    solver.parameters["krylov"]["pc"] = "gmg"
+    solve_time_step(solver, 0.1)
+    pc = solver.data["solver"]["p"].ksp().getPC()
+    assert pc.getType() in ["hypre", "gamg"]
+
+def test_FullyDecoupled_fused_rhs():
+    b = {}
+    for fuse in [False, True]:
+        solver = prepare_stratified_solver("FullyDecoupled")
+        solver.parameters["fuse_rhs"] = fuse
+        solve_time_step(solver, 0.1) # nontrivial solution at PTL
+        solver.setup()
+        assert ("fused" in solver.data["rhs_assembly"]["v"]) == fuse
+        b[fuse] = dict((var, [b_i.get_local()
+                              for b_i in solver._assemble_rhs(var)])
+                       for var in ["phi", "chi", "v", "p"])
+
+    # Fused and separate assembly give the same vectors
+    for var in ["phi", "chi", "v", "p"]:
+        assert len(b[True][var]) == len(b[False][var])
+        for (b_fused, b_sep) in zip(b[True][var], b[False][var]):
+            assert np.linalg.norm(b_sep) > 0.0 or var != "v"
+            assert np.allclose(b_fused, b_sep, rtol=1e-12, atol=1e-14)
+
+def test_FullyDecoupled_block_solve():
+    w = {}
+    for block_solve in [True, False]:
+        solver = prepare_stratified_solver("FullyDecoupled")
+        solver._flags["block_solve"] = block_solve
+        for k in range(2):
+            solve_time_step(solver, 0.1)
+        # Velocity components are solved together if possible
+        groups = solver.data["groups"]["v"]
+        assert sum(len(indices) for (lu, indices) in groups) == 2
+        assert solver._flags["block_solve"] == block_solve
+        DS = solver.data["model"].discretization_scheme()
+        w[block_solve] = [f.vector().get_local() for f in DS.solution_ptl(0)]
+
+    # Multi-RHS solves give the same results as separate solves
+    for (x_block, x) in zip(w[True], w[False]):
+        assert np.allclose(x_block, x, rtol=1e-10, atol=1e-12)
+
+@pytest.mark.parametrize("scheme", ["Monolithic", "SemiDecoupled", "FullyDecoupled"])
+def test_calibrate_pressure(scheme):
+    solver = prepare_stratified_solver(scheme)
+    DS = solver.data["model"].discretization_scheme()
+    p = DS.primitive_vars_ctl(indexed=True)["p"]
+    area = DS.compute_domain_size()
+
+    # Hydrostatic pressure has zero mean after calibration
+    solve_time_step(solver, 0.1)
+    p_weights = solver.data["p_weights"]
+    assert dolfin.near(dolfin.assemble(p*dolfin.dx)/area, 0.0, 1e-10)
+    assert dolfin.assemble(p*p*dolfin.dx) > 0.0
+
+    # Weights are computed only once
+    solve_time_step(solver, 0.1)
+    assert solver.data["p_weights"] is p_weights
+    assert dolfin.near(dolfin.assemble(p*dolfin.dx)/area, 0.0, 1e-10)
+
+def test_SemiDecoupled_ns_krylov_guess():
+    iters, w = {}, {}
+    for guess in ["zero", "previous"]:
+        solver = prepare_stratified_solver("SemiDecoupled")
+        solver.parameters["ns_krylov"]["guess"] = guess
+        prefix = "NS_%s_" % guess
+        ns_solver = PCDKrylovSolver(comm=solver.comm())
+        ns_solver.set_options_prefix(prefix)
+        ns_solver.parameters["relative_tolerance"] = 1e-8
+        dolfin.PETScOptions.set(prefix + "fieldsplit_p_pc_python_type",
+                                "fenapack.PCDRPC_BRM1")
+        ns_solver.set_from_options()
+        solver.data["solver"]["NS"] = ns_solver
+        iters[guess] = []
+        for k in range(3):
+            solve_time_step(solver, 0.1)
+            iters[guess].append(solver.iters["NS"][-1])
+        DS = solver.data["model"].discretization_scheme()
+        w[guess] = DS.solution_ptl(0)[1].vector().get_local()
+
+    # Solutions agree, but fewer iterations are needed with the guess
+    dolfin.info("NS iterations: %s" % iters)
+    assert np.allclose(w["previous"], w["zero"], rtol=1e-5, atol=1e-7)
+    assert iters["previous"][0] == iters["zero"][0]
+    assert sum(iters["previous"][1:]) < sum(iters["zero"][1:])
@@ -1,10 +1,61 @@
+import os
 import pytest
+import numpy as np
 
 import dolfin
 
-from muflon.solving.tstepping import TimeSteppingFactory
+from muflon.solving.tstepping import TimeSteppingFactory, TSHook
 
 from unit.solving.test_solvers import prepare_solver
+from unit.solving.test_solvers import prepare_stratified_solver
+from unit.solving.test_solvers import create_stratified_solver
+
+def shift_vectors(functions, value):
+    for w in functions:
+        x = w.vector()
+        x.set_local(x.get_local() + value)
+        x.apply("insert")
+
+def fake_solve(solver, calls, failures=[]):
+    """
+    Returns a function that replaces ``solver.solve``. The function records
+    the time step and a copy of all solution vectors on every call, then it
+    shifts the solution at the current time level by one. Calls with indices
+    listed in ``failures`` corrupt the solution at all time levels and raise
+    :py:class:`RuntimeError`.
+    """
+    model = solver.data["model"]
+    DS = model.discretization_scheme()
+    functions = list(DS.solution_ctl())
+    for sol in DS.solution_ptl():
+        functions += list(sol)
+    def solve():
+        calls.append((model.time_step_value(),
+                      [w.vector().copy() for w in functions]))
+        if len(calls) - 1 in failures:
+            shift_vectors(functions, 42.0)
+            raise RuntimeError("Forced failure")
+        shift_vectors(DS.solution_ctl(), 1.0)
+    return solve
+
+def fake_linear_solve(solver, calls, jumps=[]):
+    """
+    Returns a function that replaces ``solver.solve``. The function records
+    the time step and a copy of all solution vectors on every call, then it
+    shifts the solution at the current time level by the time step, so that
+    the solution grows linearly in time. Calls with indices listed in
+    ``jumps`` shift the solution by a large value instead.
+    """
+    model = solver.data["model"]
+    DS = model.discretization_scheme()
+    functions = list(DS.solution_ctl())
+    for sol in DS.solution_ptl():
+        functions += list(sol)
+    def solve():
+        dt = model.time_step_value()
+        calls.append((dt, [w.vector().copy() for w in functions]))
+        shift_vectors(DS.solution_ctl(), 1e3 if len(calls) - 1 in jumps else dt)
+    return solve
 
 def test_TimeStepping():
     with pytest.raises(NotImplementedError):
@@ -31,3 +82,290 @@ def test_ConstantTimeStep(scheme):
     logger = TS.logger()
 
     # FIXME: This test needs improvements
+
+@pytest.mark.parametrize("scheme", ["Monolithic", "FullyDecoupled"])
+def test_rollback(scheme, tmpdir):
+    solver = prepare_stratified_solver(scheme, nx=4)
+    model = solver.data["model"]
+    DS = model.discretization_scheme()
+    comm = DS.mesh().mpi_comm()
+    forms = solver.data["forms"]
+
+    TS = TimeSteppingFactory.create("ConstantTimeStep", comm, solver,
+                                    outdir=str(tmpdir))
+    prm = TS.parameters
+    dt = 0.1
+
+    # Failure is fatal if rollback is not enabled
+    calls = []
+    solver.solve = fake_solve(solver, calls, failures=[0])
+    with pytest.raises(RuntimeError):
+        TS.run(0.0, dt, dt)
+
+    # Repeat the failed step as two substeps
+    prm["rollback"]["enabled"] = True
+    calls = []
+    solver.solve = fake_solve(solver, calls, failures=[0])
+    TS.run(0.0, 2*dt, dt)
+    assert [c[0] for c in calls] == [dt, 0.5*dt, 0.5*dt, dt]
+    assert model.time_step_value() == dt
+    assert solver.data["forms"] is forms # nothing has been rebuilt
+
+    # State must be restored exactly before the first substep
+    for (x, y) in zip(calls[0][1], calls[1][1]):
+        y.axpy(-1.0, x)
+        assert y.norm("linf") == 0.0
+
+    # Recursive subdivision
+    calls = []
+    solver.solve = fake_solve(solver, calls, failures=[0, 1])
+    TS.run(0.0, dt, dt)
+    assert [c[0] for c in calls] == [dt, 0.5*dt, 0.25*dt, 0.25*dt, 0.5*dt]
+    assert model.time_step_value() == dt
+
+    # Give up when all attempts fail
+    prm["rollback"]["max_retries"] = 1
+    calls = []
+    solver.solve = fake_solve(solver, calls, failures=range(10))
+    with pytest.raises(RuntimeError):
+        TS.run(0.0, dt, dt)
+    assert [c[0] for c in calls] == [dt, 0.5*dt]
+
+class RemeshHook(TSHook):
+    def rebuild(self, DS):
+        self.meshes.append(DS.mesh())
+        if self.xfields is None:
+            return create_stratified_solver(DS), None
+        return create_stratified_solver(DS), self.xfields(DS)
+
+def test_remesh(tmpdir):
+    solver = prepare_stratified_solver("FullyDecoupled", nx=4)
+    DS = solver.data["model"].discretization_scheme()
+    base_mesh = DS.mesh()
+    comm = base_mesh.mpi_comm()
+    num_cells = lambda mesh: dolfin.MPI.sum(comm, mesh.num_cells())
+    xfields = lambda DS: [(DS.primitive_vars_ctl()["phi"].split()[0], "phi1")]
+    outdir = str(tmpdir)
+
+    hook = RemeshHook(meshes=[], xfields=xfields)
+    TS = TimeSteppingFactory.create("ConstantTimeStep", comm, solver,
+                                    hook=hook, xfields=xfields(DS),
+                                    outdir=outdir)
+    TS.parameters["remesh"]["modulo"] = 2
+    TS.parameters["remesh"]["levels"] = 1
+    result = TS.run(0.0, 0.4, 0.1)
+    assert result["it"] == 4 and dolfin.near(result["t"], 0.4)
+
+    # Time stepping continues on the adapted mesh
+    assert len(hook.meshes) == 2
+    assert TS.solver() is not solver
+    DS = TS.solver().data["model"].discretization_scheme()
+    assert DS.mesh() is hook.meshes[-1]
+    assert num_cells(DS.mesh()) > num_cells(base_mesh)
+    assert DS.number_of_ptl_updates() == 4
+    for w in DS.solution_ptl(0):
+        x = w.vector().get_local()
+        assert np.isfinite(x).all()
+    assert DS.solution_ptl(0)[0].vector().norm("l2") > 0.0
+
+    # Output continues in new files
+    for name in ["phi1", "phi1_mesh1"]:
+        xfile = os.path.join(outdir, "XDMFdata", name + ".xdmf")
+        assert os.path.isfile(xfile)
+
+    # Output is stopped if the hook does not provide new fields
+    solver = prepare_stratified_solver("FullyDecoupled", nx=4)
+    DS = solver.data["model"].discretization_scheme()
+    hook = RemeshHook(meshes=[], xfields=None)
+    TS = TimeSteppingFactory.create("ConstantTimeStep", comm, solver,
+                                    hook=hook, xfields=xfields(DS),
+                                    outdir=str(tmpdir.join("none")))
+    TS.parameters["remesh"]["modulo"] = 1
+    TS.parameters["remesh"]["levels"] = 1
+    result = TS.run(0.0, 0.2, 0.1)
+    assert result["it"] == 2 and len(hook.meshes) == 2
+    assert not hasattr(TS, "_xdmf_writer")
+
+def test_walltime_budget(tmpdir):
+    dt, t_end = 0.1, 0.4
+
+    # Reference solution computed without interruption
+    solver = prepare_stratified_solver("FullyDecoupled", nx=4)
+    DS = solver.data["model"].discretization_scheme()
+    comm = DS.mesh().mpi_comm()
+    TS = TimeSteppingFactory.create("ConstantTimeStep", comm, solver,
+                                    outdir=str(tmpdir.join("ref")))
+    TS.run(0.0, t_end, dt)
+    w_ref = [w.vector().copy() for w in DS.solution_ptl(0)]
+
+    # Budget is exhausted after the first step
+    solver = prepare_stratified_solver("FullyDecoupled", nx=4)
+    DS = solver.data["model"].discretization_scheme()
+    TS = TimeSteppingFactory.create("ConstantTimeStep", comm, solver,
+                                    outdir=str(tmpdir.join("run")))
+    TS.parameters["walltime"]["budget"] = 1e-6
+    result = TS.run(0.0, t_end, dt)
+    assert result["resume"]
+    assert result["it"] == 1 and dolfin.near(result["t"], dt)
+
+    # Resume the computation from the checkpoint
+    for w in TS._snapshot_functions():
+        w.vector().zero()
+    chkp = TS.load_checkpoint()
+    assert chkp["it"] == 1 and dolfin.near(chkp["t"], dt)
+    assert dolfin.near(chkp["dt"], dt)
+    TS.parameters["walltime"]["budget"] = 0.0
+    result = TS.run(chkp["t"], t_end, chkp["dt"], it=chkp["it"])
+    assert not result["resume"]
+    assert result["it"] == 4 and dolfin.near(result["t"], t_end)
+    for (w, x) in zip(DS.solution_ptl(0), w_ref):
+        x.axpy(-1.0, w.vector())
+        assert x.norm("linf") < 1e-10
+
+def test_steady_state(tmpdir):
+    # Stable stratification of two fluids at rest is (almost) steady
+    solver = prepare_stratified_solver("FullyDecoupled", nx=4)
+    DS = solver.data["model"].discretization_scheme()
+    comm = DS.mesh().mpi_comm()
+    TS = TimeSteppingFactory.create("ConstantTimeStep", comm, solver,
+                                    outdir=str(tmpdir))
+    prm = TS.parameters["steady"]
+    prm["fields"] = "phi"
+    prm["window"] = 3
+    dt = 0.1
+
+    # Monitor is switched off by default
+    result = TS.run(0.0, 4*dt, dt)
+    assert not result["steady"] and result["increment"] is None
+    assert result["it"] == 4
+
+    # Increments are below the tolerance in all steps
+    prm["tol"] = 1e-2
+    result = TS.run(0.0, 100*dt, dt)
+    assert result["steady"]
+    assert result["it"] == prm["window"]
+    assert 0.0 < result["increment"] < prm["tol"]
+
+    # Increments never fall below the tolerance
+    prm["tol"] = 1e-14
+    result = TS.run(0.0, 4*dt, dt)
+    assert not result["steady"]
+    assert result["it"] == 4 and result["increment"] > prm["tol"]
+
+    with pytest.raises(ValueError):
+        prm["fields"] = "foo"
+        TS.run(0.0, 4*dt, dt)
+
+@pytest.mark.parametrize("scheme", ["Monolithic", "FullyDecoupled"])
+def test_AdaptiveTimeStep(scheme, tmpdir):
+    # Prepare solver
+    solver = prepare_stratified_solver(scheme, nx=4)
+    model = solver.data["model"]
+    DS = model.discretization_scheme()
+    comm = DS.mesh().mpi_comm()
+
+    TS = TimeSteppingFactory.create("AdaptiveTimeStep", comm, solver,
+                                    outdir=str(tmpdir))
+    prm = TS.parameters
+    assert prm["adaptive"]["rtol"] > 0.0
+    prm["adaptive"]["cfl"] = 0.0
+    prm["adaptive"]["dt_max"] = 0.5
+
+    with pytest.raises(ValueError):
+        TS.run(0.0, 1.0, 0.0)
+
+    # Linear growth is extrapolated exactly, hence the time step is doubled
+    # until the jump in the third step causes its rejection
+    factor_max = prm["adaptive"]["factor_max"]
+    factor_min = prm["adaptive"]["factor_min"]
+    dt, t_end = 0.1, 0.5
+    calls = []
+    solver.solve = fake_linear_solve(solver, calls, jumps=[2])
+    result = TS.run(0.0, t_end, dt)
+    dts = [c[0] for c in calls]
+    assert len(dts) == 5 and result["rejected"] == 1
+    assert dts[1] == pytest.approx(factor_max*dts[0])
+    assert dts[2] == pytest.approx(factor_max*dts[1])
+    assert dts[3] == pytest.approx(factor_min*dts[2]) # rejected
+    assert dts[4] == pytest.approx(t_end - sum(dts[:2]) - dts[3])
+    assert result["dt_min"] == pytest.approx(dts[3])
+    assert result["dt_max"] == pytest.approx(dts[1])
+    assert dolfin.near(result["t"], t_end) and result["it"] == 4
+
+    # Rejected step must be repeated from the solution at the previous level
+    n = len(DS.solution_ctl())
+    for (x, y) in zip(calls[3][1], calls[2][1]):
+        y.axpy(-1.0, x)
+        assert y.norm("linf") == 0.0
+    for (x, y) in zip(calls[3][1][:n], calls[3][1][n:2*n]):
+        y.axpy(-1.0, x)
+        assert y.norm("linf") == 0.0
+
+    # Jumps of chi and p do not enter the error estimate
+    calls = []
+    linear_solve = fake_linear_solve(solver, calls)
+    def solve():
+        linear_solve()
+        if len(calls) == 3:
+            for (var, i) in [("chi", 0), ("p", None)]:
+                f = DS.split_component(var, i)
+                shift_vectors([f], 1e3)
+                DS.gather_component(f, var, i)
+    solver.solve = solve
+    result = TS.run(0.0, t_end, dt)
+    assert result["rejected"] == 0
+
+    # Small increases of the time step are ignored
+    prm["adaptive"]["dt_max"] = 1.1*dt
+    calls = []
+    solver.solve = fake_linear_solve(solver, calls)
+    result = TS.run(0.0, t_end, dt)
+    assert all(c[0] == pytest.approx(dt) for c in calls)
+    assert result["dt_max"] == pytest.approx(dt) and result["it"] == 5
+
+def test_AdaptiveTimeStep_checkpoint(tmpdir):
+    dt, t_end = 0.05, 0.4
+
+    def record_time_steps(solver, dts):
+        solve = solver.solve
+        def wrapped_solve():
+            dts.append(solver.data["model"].time_step_value())
+            solve()
+        solver.solve = wrapped_solve
+
+    # Reference run without interruption
+    solver = prepare_stratified_solver("FullyDecoupled", nx=4)
+    DS = solver.data["model"].discretization_scheme()
+    comm = DS.mesh().mpi_comm()
+    TS = TimeSteppingFactory.create("AdaptiveTimeStep", comm, solver,
+                                    outdir=str(tmpdir.join("ref")))
+    dts_ref = []
+    record_time_steps(solver, dts_ref)
+    result_ref = TS.run(0.0, t_end, dt)
+    w_ref = [w.vector().copy() for w in DS.solution_ptl(0)]
+
+    # Budget is exhausted after the first step
+    solver = prepare_stratified_solver("FullyDecoupled", nx=4)
+    DS = solver.data["model"].discretization_scheme()
+    TS = TimeSteppingFactory.create("AdaptiveTimeStep", comm, solver,
+                                    outdir=str(tmpdir.join("run")))
+    TS.parameters["walltime"]["budget"] = 1e-6
+    result = TS.run(0.0, t_end, dt)
+    assert result["resume"] and result["it"] == 1
+    prefix = TS._checkpoint_folder() + os.path.sep
+    assert os.path.isfile(prefix + "backup_0" + "_%.12g.h5" % result["t"])
+
+    # Resumed computation continues with the same time steps
+    for w in TS._snapshot_functions():
+        w.vector().zero()
+    chkp = TS.load_checkpoint()
+    assert chkp["it"] == 1 and dolfin.near(chkp["dt_prev"], dt)
+    TS.parameters["walltime"]["budget"] = 0.0
+    dts = []
+    record_time_steps(solver, dts)
+    result = TS.run(chkp["t"], t_end, chkp["dt"], it=chkp["it"])
+    assert not result["resume"] and result["it"] == result_ref["it"]
+    assert np.allclose(dts, dts_ref[1:], rtol=1e-10)
+    for (w, x) in zip(DS.solution_ptl(0), w_ref):
+        x.axpy(-1.0, w.vector())
+        assert x.norm("linf") < 1e-10